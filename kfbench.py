@@ -0,0 +1,399 @@
+#!/usr/bin/python
+#
+# KiFisher benchmarks
+#
+# Times the parts of kifisher.py that grow with the size
+# of the board, on a synthetic project generated to
+# order, so changes to them can be compared before and
+# after.
+#
+# The same setups are timed by the pytest-benchmark suite
+# in tests/bench_*.py; this runner needs only the standard
+# library and also checks kf's startup time.
+#
+# usage: python kfbench.py [-n components] [--vendors n]
+#                          [--json results.json]
+#                          [--compare old.json]
+#                          [benchmark name ...]
+#
+# Released under the GPLv3.
+#
+
+import os, sys, timeit, random, argparse, json, math, shutil, tempfile, datetime, platform, subprocess
+import kifisher, kfgerber
+
+###########################################################
+#
+#                make_synthetic_project
+#
+# inputs:
+# - directory to write the project into
+# - number of components
+# - number of vendors to spread the parts across
+# - random seed, so every run gets the same board
+#
+# what it does:
+# - writes name.net in KiCad's netlist export format,
+#   with resistors, capacitors, LEDs, ICs and connectors
+#   in a few hundred distinct parts
+# - writes name-top.pos and name-bottom.pos placing
+#   them on a grid, leaving a few parts out and adding a
+#   few that aren't in the netlist
+# - writes an Edge.Cuts gerber with a wavy edge, arc
+#   corners and round cutouts, and an F.Cu gerber with
+#   two pads and a trace per component
+#
+# returns:
+# - dict of the project's name, dir and file paths
+#
+###########################################################
+
+PART_KINDS = [
+  # prefix, symbol, values, footprint, type
+  ('R', 'RES', ['10k','4k7','470','1M','100'], 'RLC-0603-SMD', 'smt'),
+  ('C', 'CAP', ['100n','1u','10u','22p'], 'RLC-0402-SMD', 'smt'),
+  ('LED', 'LED', ['RED','GREEN','BLUE'], 'LED-1206-SMD', 'smt'),
+  ('U', 'IC', ['ATSAMD21','LM358','TLV70033'], 'SOIC-8', 'smt'),
+  ('J', 'CONN', ['1x02','1x04','2x05'], 'PinHeader-2.54', 'th'),
+]
+
+def gerber_number(mm):
+  return str(int(round(mm*1e6)))
+
+def make_synthetic_project(root, components, vendors, seed=1):
+
+  rng = random.Random(seed)
+  name = 'bench'
+  gerbers_dir = os.path.join(root, 'gerbers')
+  os.makedirs(gerbers_dir)
+
+  # netlist
+
+  counts = {}
+  comps = []
+  with open(os.path.join(root, name+'.net'), 'w') as net:
+    net.write('(export (version D)\n  (components\n')
+    for i in range(components):
+      prefix, symbol, values, footprint, thsmt = PART_KINDS[rng.randrange(len(PART_KINDS))]
+      counts[prefix] = counts.get(prefix, 0) + 1
+      ref = prefix+str(counts[prefix])
+      value = values[rng.randrange(len(values))]
+      variant = rng.randrange(40)
+      vendor = 'Vendor%d' % rng.randrange(vendors)
+      part = '%s-%s-%d' % (symbol, value, variant)
+      net.write('    (comp (ref %s) (value %s) (footprint Bench:%s)\n' % (ref, value, footprint))
+      net.write('      (fields (field (name Description) "%s %s") (field (name MF_Name) Maker%d)'
+                ' (field (name MF_PN) MPN-%s) (field (name S1_Name) %s) (field (name S1_PN) %s-%s)'
+                ' (field (name Type) %s))\n' % (symbol, value, variant % 7, part, vendor, vendor, part, thsmt))
+      net.write('      (libsource (lib bench) (part %s)))\n' % part)
+      comps.append((ref, value, footprint))
+    net.write('  )\n  (libparts (libpart (lib bench))))\n')
+
+  # pos files, on a grid about 3mm apart
+
+  side = int(math.ceil(math.sqrt(components)))
+  pitch = 3.0
+  width = height = side*pitch + 10.0
+
+  placed = [c for c in comps if rng.random() > 0.01]
+  placed += [('X%d' % i, '0', 'NONE') for i in range(max(1, components // 1000))]
+
+  posfiles = {'top': os.path.join(root, name+'-top.pos'), 'bottom': os.path.join(root, name+'-bottom.pos')}
+  pos = dict([(s, open(posfiles[s], 'w')) for s in posfiles])
+  for s in pos:
+    pos[s].write('### Module positions - synthetic ###\n# Unit = mm, Angle = deg.\n## Side : '+s+'\n')
+    pos[s].write('# Ref    Val       Package              PosX       PosY       Rot     Side\n')
+  for i, (ref, value, footprint) in enumerate(placed):
+    s = 'top' if i % 5 else 'bottom'
+    x = 5.0 + (i % side)*pitch
+    y = -(5.0 + (i // side)*pitch)
+    pos[s].write('%-8s %-9s %-20s %9.4f %10.4f %9.4f   %s\n' % (ref, value, footprint, x, y, 90.0*(i % 4), s))
+  for s in pos:
+    pos[s].write('## End\n')
+    pos[s].close()
+
+  # board outline: wavy edges, arc corners and a row of round cutouts
+
+  outline = os.path.join(gerbers_dir, name+'-Edge.Cuts.gko')
+  r = 3.0
+  with open(outline, 'w') as g:
+    g.write('%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.150000*%\nG75*\nD10*\n')
+    g.write('X%sY%sD02*\n' % (gerber_number(r), gerber_number(0)))
+    steps = max(50, components // 20)
+    for i in range(1, steps+1):
+      x = r + (width - 2*r)*i/float(steps)
+      g.write('G01X%sY%sD01*\n' % (gerber_number(x), gerber_number(-0.2*math.sin(i))))
+    g.write('G03X%sY%sI0J%sD01*\n' % (gerber_number(width), gerber_number(r), gerber_number(r)))
+    g.write('G01X%sY%sD01*\n' % (gerber_number(width), gerber_number(height - r)))
+    g.write('G03X%sY%sI%sJ0D01*\n' % (gerber_number(width - r), gerber_number(height), gerber_number(-r)))
+    g.write('G01X%sY%sD01*\n' % (gerber_number(r), gerber_number(height)))
+    g.write('G03X%sY%sI0J%sD01*\n' % (gerber_number(0), gerber_number(height - r), gerber_number(-r)))
+    g.write('G01X%sY%sD01*\n' % (gerber_number(0), gerber_number(r)))
+    g.write('G03X%sY%sI%sJ0D01*\n' % (gerber_number(r), gerber_number(0), gerber_number(r)))
+    for i in range(10):
+      cx = width*(i+1)/11.0
+      g.write('X%sY%sD02*\n' % (gerber_number(cx + 1.0), gerber_number(height/2)))
+      g.write('G02X%sY%sI%sJ0D01*\n' % (gerber_number(cx + 1.0), gerber_number(height/2), gerber_number(-1.0)))
+    g.write('M02*\n')
+
+  # copper: two pads and a trace per component
+
+  copper = os.path.join(gerbers_dir, name+'-F.Cu.gtl')
+  with open(copper, 'w') as g:
+    g.write('%FSLAX46Y46*%\n%MOMM*%\n%ADD10R,0.800000X0.900000*%\n%ADD11C,0.250000*%\n')
+    g.write('D10*\n')
+    for i in range(components):
+      x = 5.0 + (i % side)*pitch
+      y = 5.0 + (i // side)*pitch
+      g.write('X%sY%sD03*\n' % (gerber_number(x - 0.8), gerber_number(y)))
+      g.write('X%sY%sD03*\n' % (gerber_number(x + 0.8), gerber_number(y)))
+    g.write('D11*\n')
+    for i in range(components):
+      x = 5.0 + (i % side)*pitch
+      y = 5.0 + (i // side)*pitch
+      g.write('X%sY%sD02*\n' % (gerber_number(x + 0.8), gerber_number(y)))
+      g.write('G01X%sY%sD01*\n' % (gerber_number(x + 1.5), gerber_number(y + 1.5)))
+    g.write('M02*\n')
+
+  return {
+    'name': name,
+    'dir': root,
+    'gerbers_dir': gerbers_dir,
+    'netlist': os.path.join(root, name+'.net'),
+    'posfiles': (posfiles['top'], posfiles['bottom']),
+    'outline': outline,
+    'copper': copper,
+    'data': {'projname': name, 'version': '1.0', 'bom_dir': 'bom',
+             'gerbers_dir': 'gerbers', 'bom_group_by': 'symbol'},
+  }
+
+###########################################################
+#
+#                       Benchmarks
+#
+# each one takes the synthetic project, does any one-off
+# setup and returns a function that does the work once;
+# functions that print are run with stdout silenced
+#
+###########################################################
+
+class quiet(object):
+
+  def __enter__(self):
+    self.stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def __exit__(self, *exc):
+    sys.stdout.close()
+    sys.stdout = self.stdout
+
+def parse_netlist(project):
+  with open(project['netlist']) as netfile:
+    return list(kifisher.iter_components(netfile))
+
+def bench_compress_refs(project):
+
+  rng = random.Random(1)
+  refs = ['C'+str(n) for n in range(1,200) if n % 7]
+  refs += ['R'+str(n) for n in range(10,120)]
+  refs += ['LCD1','J1','J2','MH']
+  refs += ['U1A','U1B','U2A','U2B','U3A']
+  rng.shuffle(refs)
+
+  return lambda: kifisher.compress_refs(refs)
+
+def bench_netlist_parse(project):
+
+  return lambda: parse_netlist(project)
+
+def bench_bom(project):
+
+  # the first run fills the netlist cache, so the timed
+  # runs measure grouping and the BOM writers
+  def run():
+    with quiet():
+      kifisher.create_bill_of_materials(project['data'])
+  run()
+  return run
+
+def bench_pos_join(project):
+
+  components = parse_netlist(project)
+  return lambda: kifisher.join_pos_placements(components, project['posfiles'])
+
+def bench_board_size(project):
+
+  def run():
+    kfgerber._layer_cache.clear()
+    with quiet():
+      kifisher.get_board_size(project['name'], project['gerbers_dir'])
+  return run
+
+def bench_gerber_render(project):
+
+  def run():
+    kfgerber._layer_cache.clear()
+    kfgerber.render_board_side(project['copper'], None, None, project['outline'], None, 700, 700)
+  return run
+
+def bench_zip_cold(project):
+
+  store_dir = os.path.join(project['dir'], 'cold-store')
+  members = [(os.path.basename(p), p) for p in (project['copper'], project['outline'], project['netlist'])]
+
+  def run():
+    if os.path.exists(store_dir):
+      shutil.rmtree(store_dir)
+    kifisher.ArtifactStore(store_dir).write_zip(os.path.join(project['dir'], 'cold.zip'), members)
+  return run
+
+def bench_zip_warm(project):
+
+  store_dir = os.path.join(project['dir'], 'warm-store')
+  members = [(os.path.basename(p), p) for p in (project['copper'], project['outline'], project['netlist'])]
+  kifisher.ArtifactStore(store_dir).write_zip(os.path.join(project['dir'], 'warm.zip'), members)
+
+  # a new store each time, like a new build, so only the
+  # on-disk blobs are reused
+  return lambda: kifisher.ArtifactStore(store_dir).write_zip(os.path.join(project['dir'], 'warm.zip'), members)
+
+###########################################################
+#
+#                    bench_startup_*
+#
+# what they do:
+# - run kifisher.py in a fresh interpreter with a BOM or
+#   PDF only command line plus --help, so it stops right
+#   after argument parsing, where the build would start
+# - fail if pcbnew, numpy or PIL got imported by then
+#
+# the times are checked against startup_budgets below
+#
+###########################################################
+
+KIFISHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kifisher.py')
+HEAVY_MODULES = ('pcbnew', 'wx', 'numpy', 'PIL', 'Image')
+
+STARTUP_CHECK = """
+import sys, os, runpy
+sys.path.insert(0, os.path.dirname(%r))
+sys.argv = [%r] + %r + ['--help']
+try:
+  runpy.run_path(%r, run_name='__main__')
+except SystemExit:
+  pass
+heavy = [m for m in %r if m in sys.modules]
+if heavy:
+  sys.exit('imported at startup: ' + ', '.join(heavy))
+"""
+
+def startup(flags):
+
+  code = STARTUP_CHECK % (KIFISHER, KIFISHER, flags, KIFISHER, HEAVY_MODULES)
+  def run():
+    proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode:
+      raise RuntimeError(err.decode('utf-8', 'replace').strip())
+  return run
+
+def bench_startup_bom(project):
+  return startup(['-b', 'bench'])
+
+def bench_startup_pdf(project):
+  return startup(['-p', 'bench'])
+
+# seconds per call; kfbench exits non-zero if one is over
+startup_budgets = {
+  'startup_bom': 0.5,
+  'startup_pdf': 0.5,
+}
+
+benchmarks = [
+  ('compress_refs', bench_compress_refs),
+  ('netlist_parse', bench_netlist_parse),
+  ('bom', bench_bom),
+  ('pos_join', bench_pos_join),
+  ('board_size', bench_board_size),
+  ('gerber_render', bench_gerber_render),
+  ('zip_cold', bench_zip_cold),
+  ('zip_warm', bench_zip_warm),
+  ('startup_bom', bench_startup_bom),
+  ('startup_pdf', bench_startup_pdf),
+]
+
+###########################################################
+#
+#                         main
+#
+# generates the synthetic project in a temporary dir,
+# runs every benchmark, or only the ones named on the
+# command line, and prints the best time per call
+# - --json saves the results for a later --compare
+# - --compare prints how each time changed against a
+#   saved run
+# - exits non-zero if a startup time is over budget
+#
+###########################################################
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('names',nargs='*',help='benchmarks to run, default all')
+  parser.add_argument('-n','--components',type=int,default=10000,help='components on the synthetic board')
+  parser.add_argument('--vendors',type=int,default=20,help='vendors to spread the parts across')
+  parser.add_argument('--json',dest='json_file',help='save the results to this file')
+  parser.add_argument('--compare',dest='compare_file',help='compare against results saved with --json')
+  args = parser.parse_args()
+
+  previous = {}
+  if args.compare_file:
+    with open(args.compare_file) as f:
+      saved = json.load(f)
+    previous = saved['results']
+    if saved.get('components') != args.components:
+      print('note: %s was run with %s components' % (args.compare_file, saved.get('components')))
+
+  root = tempfile.mkdtemp(prefix='kfbench-')
+  cwd = os.getcwd()
+  results = {}
+  over_budget = []
+
+  try:
+    print('generating %d components across %d vendors' % (args.components, args.vendors))
+    project = make_synthetic_project(root, args.components, args.vendors)
+    os.chdir(root)
+
+    for name, setup in benchmarks:
+      if args.names and name not in args.names:
+        continue
+      func = setup(project)
+      timer = timeit.Timer(func)
+      number, _ = timer.autorange() if hasattr(timer, 'autorange') else (1, None)
+      best = min(timer.repeat(repeat=3, number=number)) / number
+      results[name] = best
+
+      line = '%-20s %12.1f us per call' % (name, best*1e6)
+      if name in previous:
+        line = line + '   %+6.1f%%' % ((best/previous[name] - 1)*100)
+      if name in startup_budgets and best > startup_budgets[name]:
+        line = line + '   over the %.1fs budget' % startup_budgets[name]
+        over_budget.append(name)
+      print(line)
+
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(root)
+
+  if args.json_file:
+    with open(args.json_file, 'w') as f:
+      json.dump({
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'components': args.components,
+        'vendors': args.vendors,
+        'results': results,
+      }, f, indent=2, sort_keys=True)
+
+  if over_budget:
+    sys.exit('over the startup budget: '+', '.join(over_budget))
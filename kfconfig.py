@@ -3,7 +3,19 @@
 
 templates_dir = '/home/wicker/wickerlib-private/templates/'
 
+# cached netlist parses and other build state are kept
+# in this subdirectory of each project, next to proj.json
+cache_dir = '.kifisher'
+
+# part library indexes built by --index-lib, one per lib_dir
+lib_index_dir = '~/.kifisher'
+
 default_assembly_image_width = 50
 default_schematic_image_width = 50
 default_preview_image_width = 50
 default_other_image_width = 50
+
+# extra preview image sizes, the long edge in pixels of each
+# board side, when proj.json has no preview_sizes; 700 is
+# always made, as preview.png
+default_preview_sizes = '700'
@@ -0,0 +1,1421 @@
+#!/usr/bin/python
+#
+# KiFisher gerber tools
+#
+# Reads the RS-274X gerber and Excellon drill files that
+# KiCad plots and draws them into NumPy arrays, so the
+# preview and assembly images can be made in-process
+# instead of launching gerbv for every picture.
+#
+# Covers the subset KiCad writes: C/R/O/P and macro
+# apertures, D01/D02/D03, G01/G02/G03 with G74/G75,
+# G36/G37 regions and LPD/LPC polarity.
+#
+# Released under the GPLv3.
+#
+
+import os, re, math
+
+# numpy is only needed to draw, so it's imported by the
+# first Raster or image helper rather than at startup;
+# reading, checking and merging gerbers don't need it
+np = None
+
+def load_numpy():
+  global np
+  if np is None:
+    import numpy
+    np = numpy
+
+###########################################################
+#
+#                 iter_gerber_commands
+#
+# inputs:
+# - an open gerber file
+#
+# what it does:
+# - splits the file into commands on '*', ignoring line
+#   breaks, and keeps each %...% block together
+#
+# yields:
+# - (extended, text) tuples, ex: (False, 'X100Y200D01')
+#   or (True, 'ADD10C,0.350000*') for a %...% block
+#
+###########################################################
+
+def iter_gerber_commands(gerberfile):
+
+  buf = ''
+  in_block = False
+
+  for line in gerberfile:
+    buf = buf + line.strip('\r\n')
+
+    while buf:
+      if in_block:
+        end = buf.find('%')
+        if end < 0:
+          break
+        yield (True, buf[:end])
+        buf = buf[end+1:]
+        in_block = False
+      else:
+        pct = buf.find('%')
+        star = buf.find('*')
+        if pct >= 0 and (star < 0 or pct < star):
+          buf = buf[pct+1:]
+          in_block = True
+        elif star >= 0:
+          cmd = buf[:star].strip()
+          buf = buf[star+1:]
+          if cmd:
+            yield (False, cmd)
+        else:
+          break
+
+###########################################################
+#
+#                      Aperture shapes
+#
+# an aperture is a list of shapes around its own origin,
+# in mm:
+# - ('c', cx, cy, r, exposure)     a filled circle
+# - ('p', [(x,y), ...], exposure)  a filled polygon
+#
+###########################################################
+
+def rotate_points(pts, degrees):
+
+  if not degrees:
+    return pts
+  a = math.radians(degrees)
+  ca, sa = math.cos(a), math.sin(a)
+  return [(x*ca - y*sa, x*sa + y*ca) for x, y in pts]
+
+def rect_points(w, h, cx=0.0, cy=0.0):
+
+  return [(cx-w/2, cy-h/2), (cx+w/2, cy-h/2), (cx+w/2, cy+h/2), (cx-w/2, cy+h/2)]
+
+def regular_polygon_points(d, n, rot=0.0, cx=0.0, cy=0.0):
+
+  n = max(3, int(n))
+  return [(cx + d/2*math.cos(math.radians(rot + 360.0*i/n)),
+           cy + d/2*math.sin(math.radians(rot + 360.0*i/n))) for i in range(n)]
+
+def standard_aperture(template, params):
+
+  if template == 'C':
+    shapes = [('c', 0.0, 0.0, params[0]/2, True)]
+    if len(params) > 1:
+      shapes.append(('c', 0.0, 0.0, params[1]/2, False))
+  elif template == 'R':
+    shapes = [('p', rect_points(params[0], params[1]), True)]
+  elif template == 'O':
+    w, h = params[0], params[1]
+    if w > h:
+      shapes = [('p', rect_points(w-h, h), True),
+                ('c', -(w-h)/2, 0.0, h/2, True), ('c', (w-h)/2, 0.0, h/2, True)]
+    else:
+      shapes = [('p', rect_points(w, h-w), True),
+                ('c', 0.0, -(h-w)/2, w/2, True), ('c', 0.0, (h-w)/2, w/2, True)]
+  elif template == 'P':
+    rot = params[2] if len(params) > 2 else 0.0
+    shapes = [('p', regular_polygon_points(params[0], params[1], rot), True)]
+  else:
+    shapes = []
+
+  return shapes
+
+###########################################################
+#
+#                     macro_aperture
+#
+# inputs:
+# - the '*'-separated statements of an %AM...% block
+# - the aperture's parameters, $1, $2, ...
+# - unit scale to mm
+#
+# what it does:
+# - evaluates variables and expressions, then turns
+#   primitives 1, 4, 5, 7, 20, 21 and 22 into shapes
+#
+# returns:
+# - list of shapes
+#
+###########################################################
+
+# one match is one token: a number, a $n variable or an operator
+MACRO_TOKEN = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|\$(\d+)|([-+xX/()]))')
+MACRO_MAX_DEPTH = 50
+
+def eval_macro_expr(expr, variables):
+
+  # the spec's arithmetic: + - x / with the usual
+  # precedence, parentheses and unary signs; anything
+  # else is a ValueError rather than a python expression
+
+  expr = expr.strip()
+  tokens = []
+  pos = 0
+  while pos < len(expr):
+    match = MACRO_TOKEN.match(expr, pos)
+    if match is None:
+      raise ValueError('bad aperture macro expression: '+expr)
+    if match.group(1):
+      tokens.append(float(match.group(1)))
+    elif match.group(2):
+      tokens.append(float(variables.get(int(match.group(2)), 0.0)))
+    else:
+      tokens.append(match.group(3).lower())
+    pos = match.end()
+
+  state = {'pos': 0}
+
+  def peek():
+    if state['pos'] < len(tokens):
+      return tokens[state['pos']]
+    return None
+
+  def take():
+    token = peek()
+    if token is None:
+      raise ValueError('bad aperture macro expression: '+expr)
+    state['pos'] += 1
+    return token
+
+  def parse_sum(depth):
+    value = parse_product(depth)
+    while peek() in ('+', '-'):
+      if take() == '+':
+        value += parse_product(depth)
+      else:
+        value -= parse_product(depth)
+    return value
+
+  def parse_product(depth):
+    value = parse_unary(depth)
+    while peek() in ('x', '/'):
+      op = take()
+      rhs = parse_unary(depth)
+      if op == 'x':
+        value *= rhs
+      elif rhs == 0:
+        raise ValueError('division by zero in aperture macro expression: '+expr)
+      else:
+        value /= rhs
+    return value
+
+  def parse_unary(depth):
+    sign = 1.0
+    while peek() in ('+', '-'):
+      if take() == '-':
+        sign = -sign
+    token = take()
+    if isinstance(token, float):
+      return sign*token
+    if token == '(':
+      if depth >= MACRO_MAX_DEPTH:
+        raise ValueError('aperture macro expression nested too deeply: '+expr)
+      value = parse_sum(depth+1)
+      if take() != ')':
+        raise ValueError('bad aperture macro expression: '+expr)
+      return sign*value
+    raise ValueError('bad aperture macro expression: '+expr)
+
+  value = parse_sum(0)
+  if peek() is not None:
+    raise ValueError('bad aperture macro expression: '+expr)
+  return value
+
+def macro_aperture(statements, params, scale):
+
+  variables = dict([(i+1, p) for i, p in enumerate(params)])
+  shapes = []
+
+  for st in statements:
+    st = st.strip()
+    if not st or st.startswith('0 ') or st == '0':
+      continue
+    if st.startswith('$'):
+      name, expr = st.split('=',1)
+      variables[int(name[1:])] = eval_macro_expr(expr, variables)
+      continue
+
+    vals = [eval_macro_expr(v, variables) for v in st.split(',')]
+    code = int(vals[0])
+    on = vals[1] != 0
+
+    if code == 1:
+      # circle: exposure, diameter, center x, center y[, rotation]
+      rot = vals[5] if len(vals) > 5 else 0.0
+      cx, cy = rotate_points([(vals[3]*scale, vals[4]*scale)], rot)[0]
+      shapes.append(('c', cx, cy, vals[2]*scale/2, on))
+    elif code in (2, 20):
+      # vector line: exposure, width, start x, y, end x, y, rotation
+      w = vals[2]*scale
+      x1, y1, x2, y2 = [v*scale for v in vals[3:7]]
+      length = math.hypot(x2-x1, y2-y1) or 1.0
+      nx, ny = -(y2-y1)/length*w/2, (x2-x1)/length*w/2
+      pts = [(x1+nx, y1+ny), (x2+nx, y2+ny), (x2-nx, y2-ny), (x1-nx, y1-ny)]
+      shapes.append(('p', rotate_points(pts, vals[7]), on))
+    elif code == 21:
+      # center line: exposure, width, height, center x, y, rotation
+      pts = rect_points(vals[2]*scale, vals[3]*scale, vals[4]*scale, vals[5]*scale)
+      shapes.append(('p', rotate_points(pts, vals[6]), on))
+    elif code == 22:
+      # lower left line: exposure, width, height, lower left x, y, rotation
+      w, h = vals[2]*scale, vals[3]*scale
+      pts = rect_points(w, h, vals[4]*scale + w/2, vals[5]*scale + h/2)
+      shapes.append(('p', rotate_points(pts, vals[6]), on))
+    elif code == 4:
+      # outline: exposure, n, x0, y0, ... xn, yn, rotation
+      n = int(vals[2])
+      coords = vals[3:3+2*(n+1)]
+      pts = [(coords[i]*scale, coords[i+1]*scale) for i in range(0, len(coords)-1, 2)]
+      shapes.append(('p', rotate_points(pts, vals[3+2*(n+1)]), on))
+    elif code == 5:
+      # polygon: exposure, vertices, center x, y, diameter, rotation
+      pts = regular_polygon_points(vals[5]*scale, vals[2], 0.0, vals[3]*scale, vals[4]*scale)
+      shapes.append(('p', rotate_points(pts, vals[6]), on))
+    elif code == 7:
+      # thermal: center x, y, outer, inner, gap, rotation
+      # drawn as a plain ring, the gaps are too small to matter here
+      cx, cy = rotate_points([(vals[1]*scale, vals[2]*scale)], vals[6])[0]
+      shapes.append(('c', cx, cy, vals[3]*scale/2, True))
+      shapes.append(('c', cx, cy, vals[4]*scale/2, False))
+
+  return shapes
+
+def aperture_radius(shapes):
+
+  r = 0.0
+  for shape in shapes:
+    if shape[0] == 'c':
+      r = max(r, math.hypot(shape[1], shape[2]) + shape[3])
+    else:
+      for x, y in shape[1]:
+        r = max(r, math.hypot(x, y))
+  return r
+
+###########################################################
+#
+#                      GerberLayer
+#
+# one parsed gerber or drill file, in mm:
+# - ops, the display list in file order:
+#   ('flash', shapes, x, y, dark)
+#   ('path', shapes, [(x,y), ...], dark)
+#   ('region', [[(x,y), ...], ...], dark)
+# - bbox, (xmin, ymin, xmax, ymax) of everything drawn
+#   including aperture size, or None if nothing is
+#
+###########################################################
+
+class GerberLayer(object):
+
+  def __init__(self, path):
+    self.path = path
+    self.ops = []
+    self.xmin = self.ymin = float('inf')
+    self.xmax = self.ymax = float('-inf')
+
+  def grow(self, pts, r=0.0):
+    for x, y in pts:
+      self.xmin = min(self.xmin, x - r)
+      self.xmax = max(self.xmax, x + r)
+      self.ymin = min(self.ymin, y - r)
+      self.ymax = max(self.ymax, y + r)
+
+  @property
+  def bbox(self):
+    if self.xmin > self.xmax:
+      return None
+    return (self.xmin, self.ymin, self.xmax, self.ymax)
+
+  def segments(self):
+    # every drawn path and region edge as ((x1,y1),(x2,y2))
+    segs = []
+    for op in self.ops:
+      if op[0] == 'path':
+        pts = op[2]
+        segs.extend(zip(pts[:-1], pts[1:]))
+      elif op[0] == 'region':
+        for contour in op[1]:
+          segs.extend(zip(contour, contour[1:] + contour[:1]))
+    return segs
+
+###########################################################
+#
+#                       arc_points
+#
+# inputs:
+# - start point, end point and center, in mm
+# - clockwise flag (G02) or counterclockwise (G03)
+# - multi-quadrant flag (G75); a zero-length multi
+#   quadrant arc is a full circle
+#
+# returns:
+# - list of points along the arc, about 5 degrees apart
+#   plus any 0/90/180/270 degree points, from start to
+#   end inclusive
+#
+###########################################################
+
+def arc_sweep(start, end, center, clockwise, multi):
+
+  a0 = math.atan2(start[1]-center[1], start[0]-center[0])
+  a1 = math.atan2(end[1]-center[1], end[0]-center[0])
+  sweep = a1 - a0
+
+  if clockwise:
+    if sweep >= 0:
+      sweep = sweep - 2*math.pi
+  elif sweep <= 0:
+    sweep = sweep + 2*math.pi
+
+  if abs(start[0]-end[0]) < 1e-9 and abs(start[1]-end[1]) < 1e-9:
+    sweep = (-2*math.pi if clockwise else 2*math.pi) if multi else 0.0
+
+  return a0, sweep
+
+def arc_points(start, end, center, clockwise, multi):
+
+  a0, sweep = arc_sweep(start, end, center, clockwise, multi)
+  r = math.hypot(start[0]-center[0], start[1]-center[1])
+  if not sweep:
+    return [start, end]
+  n = max(2, int(abs(sweep)/math.radians(5)) + 1)
+
+  # also pass through every quadrant point the arc crosses,
+  # so the flattened arc has the same extents as the real one
+  steps = [sweep*i/n for i in range(n)]
+  for k in range(-6, 7):
+    t = k*math.pi/2 - a0
+    if 0 < t/sweep < 1:
+      steps.append(t)
+  steps.sort(key=lambda t: t/sweep)
+
+  pts = [(center[0] + r*math.cos(a0 + t), center[1] + r*math.sin(a0 + t)) for t in steps]
+  pts.append(end)
+  return pts
+
+def single_quadrant_center(start, end, i, j, clockwise):
+
+  # G74 offsets are unsigned; pick the center that gives
+  # a consistent radius and a sweep of 90 degrees or less
+  best = None
+  for sx in (1, -1):
+    for sy in (1, -1):
+      c = (start[0] + sx*i, start[1] + sy*j)
+      r0 = math.hypot(start[0]-c[0], start[1]-c[1])
+      r1 = math.hypot(end[0]-c[0], end[1]-c[1])
+      sweep = abs(arc_sweep(start, end, c, clockwise, False)[1])
+      if sweep <= math.pi/2 + 1e-6:
+        err = abs(r0 - r1)
+        if best is None or err < best[0]:
+          best = (err, c)
+
+  return best[1] if best else (start[0]+i, start[1]+j)
+
+###########################################################
+#
+#                    gerber_is_empty
+#
+# inputs:
+# - path to an RS-274X file
+#
+# what it does:
+# - streams the commands and stops at the first draw
+#   (D01) or flash (D03), including coordinates that
+#   reuse a previous D01/D03; aperture selects (D10 and
+#   up), moves and the header don't count
+#
+# returns:
+# - True if nothing is drawn, also for a missing file
+#
+###########################################################
+
+COORD_PARTS = re.compile(r'([GDMXYIJ])([+-]?[\d.]+)')
+
+def gerber_is_empty(path):
+
+  if not os.path.isfile(path):
+    return True
+
+  last_d = None
+  with open(path,'r') as gerberfile:
+    for extended, cmd in iter_gerber_commands(gerberfile):
+      if extended or cmd.startswith('G04'):
+        continue
+
+      d_code = None
+      has_coords = False
+      for letter, value in COORD_PARTS.findall(cmd):
+        if letter == 'D':
+          d_code = int(value)
+        elif letter in 'XYIJ':
+          has_coords = True
+
+      if d_code is not None and d_code >= 10:
+        continue
+      if d_code is None and has_coords:
+        d_code = last_d
+      if d_code in (1, 3):
+        return False
+      if d_code is not None:
+        last_d = d_code
+
+  return True
+
+###########################################################
+#
+#                      read_gerber
+#
+# inputs:
+# - path to an RS-274X file
+#
+# what it does:
+# - follows the format (FS), units (MO), apertures (AD,
+#   AM), polarity (LP), interpolation and D-code
+#   operations and records everything drawn
+#
+# returns:
+# - GerberLayer
+#
+###########################################################
+
+def parse_gerber_number(text, decimals, int_digits, omit_trailing):
+
+  if '.' in text:
+    return float(text)
+  if omit_trailing:
+    sign = ''
+    if text[0] in '+-':
+      sign, text = text[0], text[1:]
+    text = text.ljust(int_digits + decimals, '0')
+    return float(sign+text) / 10**decimals
+  return int(text) / float(10**decimals)
+
+def read_gerber(path):
+
+  layer = GerberLayer(path)
+
+  scale = 1.0                  # file units to mm
+  int_digits, decimals = 3, 4
+  omit_trailing = False
+  apertures = {}
+  macros = {}
+
+  shapes = []
+  radius = 0.0
+  dark = True
+  x = y = 0.0
+  interp = 1                   # 1 linear, 2 clockwise, 3 counterclockwise
+  multi = False
+  last_d = 2
+  path_pts = None
+  in_region = False
+  contour = None
+  contours = []
+
+  def end_path():
+    if path_pts is not None and len(path_pts) > 1:
+      layer.ops.append(('path', shapes, path_pts, dark))
+      layer.grow(path_pts, radius)
+
+  def end_contour():
+    if contour is not None and len(contour) > 2:
+      contours.append(contour)
+
+  with open(path,'r') as gerberfile:
+    for extended, cmd in iter_gerber_commands(gerberfile):
+
+      if extended:
+        if cmd.startswith('FS'):
+          m = re.search(r'X(\d)(\d)', cmd)
+          if m:
+            int_digits, decimals = int(m.group(1)), int(m.group(2))
+          omit_trailing = cmd[2:3] == 'T'
+        elif cmd.startswith('MO'):
+          scale = 25.4 if cmd.startswith('MOIN') else 1.0
+        elif cmd.startswith('LP'):
+          end_path()
+          path_pts = None
+          dark = not cmd.startswith('LPC')
+        elif cmd.startswith('AM'):
+          statements = cmd[2:].split('*')
+          macros[statements[0].strip()] = statements[1:]
+        elif cmd.startswith('AD'):
+          m = re.match(r'ADD(\d+)([^,*]+),?([^*]*)', cmd)
+          if m:
+            code, template = int(m.group(1)), m.group(2)
+            params = [float(p) for p in m.group(3).split('X') if p.strip()]
+            if template in ('C','R','O','P'):
+              # polygon vertex count and rotation aren't lengths
+              params = [p*scale if template != 'P' or i in (0, 3) else p
+                        for i, p in enumerate(params)]
+              apertures[code] = standard_aperture(template, params)
+            elif template in macros:
+              apertures[code] = macro_aperture(macros[template], params, scale)
+        continue
+
+      if cmd.startswith('G04') or cmd.startswith('G4 '):
+        continue
+
+      parts = COORD_PARTS.findall(cmd)
+      d_code = None
+      coords = {}
+      for letter, value in parts:
+        if letter == 'G':
+          g = int(float(value))
+          if g in (1, 2, 3):
+            interp = g
+          elif g == 74:
+            multi = False
+          elif g == 75:
+            multi = True
+          elif g == 36:
+            end_path()
+            path_pts = None
+            in_region = True
+            contour = None
+            contours = []
+          elif g == 37:
+            end_contour()
+            if contours:
+              layer.ops.append(('region', contours, dark))
+              for c in contours:
+                layer.grow(c)
+            in_region = False
+            contour = None
+            contours = []
+        elif letter == 'D':
+          d_code = int(value)
+        elif letter == 'M':
+          if int(value) == 2:
+            end_path()
+            path_pts = None
+        else:
+          coords[letter] = value
+
+      # aperture select
+      if d_code is not None and d_code >= 10:
+        end_path()
+        path_pts = None
+        shapes = apertures.get(d_code, [])
+        radius = aperture_radius(shapes)
+        continue
+
+      if not coords and d_code is None:
+        continue
+      if d_code is None:
+        d_code = last_d
+      last_d = d_code
+
+      nx = parse_gerber_number(coords['X'], decimals, int_digits, omit_trailing)*scale if 'X' in coords else x
+      ny = parse_gerber_number(coords['Y'], decimals, int_digits, omit_trailing)*scale if 'Y' in coords else y
+
+      if d_code == 1:
+        if interp == 1:
+          seg = [(nx, ny)]
+        else:
+          i = parse_gerber_number(coords.get('I','0'), decimals, int_digits, omit_trailing)*scale
+          j = parse_gerber_number(coords.get('J','0'), decimals, int_digits, omit_trailing)*scale
+          if multi:
+            center = (x + i, y + j)
+          else:
+            center = single_quadrant_center((x, y), (nx, ny), abs(i), abs(j), interp == 2)
+          seg = arc_points((x, y), (nx, ny), center, interp == 2, multi)[1:]
+
+        if in_region:
+          if contour is None:
+            contour = [(x, y)]
+          contour.extend(seg)
+        else:
+          if path_pts is None:
+            path_pts = [(x, y)]
+          path_pts.extend(seg)
+
+      elif d_code == 2:
+        if in_region:
+          end_contour()
+          contour = None
+        else:
+          end_path()
+          path_pts = None
+
+      elif d_code == 3:
+        end_path()
+        path_pts = None
+        layer.ops.append(('flash', shapes, nx, ny, dark))
+        layer.grow([(nx, ny)], radius)
+
+      x, y = nx, ny
+
+  end_path()
+  return layer
+
+###########################################################
+#
+#                     merge_gerbers
+#
+# inputs:
+# - list of gerber paths, ex: drill map, Dwgs.User and
+#   Edge.Cuts
+# - path of the merged file to write
+#
+# what it does:
+# - writes in the units and decimals of the finest input,
+#   ex: mm with 6 decimals over inch with 4, and rewrites
+#   coordinates and aperture sizes from the others to
+#   match, so no file loses precision; inch 3.4 and 3.5
+#   convert to mm 4.6 exactly, anything else is rounded
+#   to the output's last decimal
+# - gives every file's apertures new D-codes after the
+#   ones already used, and renames aperture macros that
+#   clash with a different macro of the same name
+# - starts every file in dark polarity, linear and
+#   single quadrant mode, drops the other files' headers
+#   and end-of-file codes and writes a single M02
+# - builds the file in memory and writes it once
+#
+# returns nothing
+#
+###########################################################
+
+D_CODE = re.compile(r'D(\d+)')
+COORD_NUMBER = re.compile(r'([XYIJ])([+-]?\d+)')
+
+def parse_format(cmd):
+
+  m = re.search(r'X(\d)(\d)', cmd)
+  digits = (int(m.group(1)), int(m.group(2))) if m else (3, 4)
+  return digits + (cmd[2:3] == 'T',)
+
+def gerber_format(path):
+
+  # the (integer digits, decimals, trailing zeros) format
+  # and the mm per unit of a file, or None if it has no MO
+  fmt = None
+  units = None
+
+  with open(path,'r') as gerberfile:
+    for extended, cmd in iter_gerber_commands(gerberfile):
+      if not extended:
+        continue
+      for part in cmd.split('*'):
+        part = part.strip()
+        if part.startswith('FS'):
+          fmt = parse_format(part)
+        elif part.startswith('MO'):
+          units = 25.4 if part.startswith('MOIN') else 1.0
+      if fmt and units:
+        break
+
+  return fmt or (3, 4, False), units
+
+def merge_gerbers(paths, out_path):
+
+  # pick the finest resolution of all the inputs
+
+  formats = [gerber_format(path) for path in paths]
+  known = [(units * 10**-fmt[1], units, fmt) for fmt, units in formats if units]
+  if known:
+    resolution, out_units, finest = min(known)
+  else:
+    out_units, finest = None, formats[0][0]
+
+  # mm numbers need two more integer digits than inch ones
+  int_digits = max([fmt[0] + (2 if units and out_units and units > out_units else 0)
+                    for fmt, units in formats] + [finest[0]])
+  out_fmt = (min(int_digits, 6), finest[1], False)
+
+  # written with leading zeros omitted, whatever the sources used
+  header = ['%%FSLAX%d%dY%d%d*%%' % (out_fmt[0], out_fmt[1], out_fmt[0], out_fmt[1])]
+  if out_units:
+    header.append('%MOIN*%' if out_units == 25.4 else '%MOMM*%')
+  body = []
+  next_d = 10
+  macro_names = {}      # macro name in the output -> its body
+  multi = False
+
+  for path in paths:
+
+    src_fmt = (3, 4, False)
+    src_units = None
+    dmap = {}
+    mmap = {}
+
+    body.append('G04 merged from '+os.path.basename(path)+'*')
+    body.append('%LPD*%')
+    body.append('G01*')
+    if multi:
+      body.append('G74*')
+      multi = False
+
+    with open(path,'r') as gerberfile:
+      for extended, cmd in iter_gerber_commands(gerberfile):
+
+        if extended:
+
+          if cmd.startswith('AM'):
+            statements = cmd[2:].split('*')
+            name = statements[0].strip()
+            macro = '*'.join(statements[1:])
+            new_name = name
+            n = 1
+            while new_name in macro_names and macro_names[new_name] != macro:
+              new_name = '%s_%d' % (name, n)
+              n = n + 1
+            mmap[name] = new_name
+            if new_name not in macro_names:
+              macro_names[new_name] = macro
+              body.append('%AM'+new_name+'*'+macro+'%')
+            continue
+
+          for part in cmd.split('*'):
+            part = part.strip()
+            if not part:
+              continue
+
+            if part.startswith('FS'):
+              src_fmt = parse_format(part)
+            elif part.startswith('MO'):
+              src_units = 25.4 if part.startswith('MOIN') else 1.0
+            elif part.startswith('AD'):
+              m = re.match(r'ADD(\d+)([^,]+)(,?.*)', part)
+              if not m:
+                continue
+              template, params = m.group(2), m.group(3)
+              ratio = (src_units or out_units or 1.0) / (out_units or src_units or 1.0)
+              if ratio != 1.0 and template in ('C','R','O','P') and params:
+                values = params[1:].split('X')
+                values = ['%.6f' % (float(v)*ratio) if template != 'P' or i == 0 or i == 3 else v
+                          for i, v in enumerate(values)]
+                params = ','+'X'.join(values)
+              elif ratio != 1.0:
+                print('warning: '+path+' uses macro '+template+' in different units, it may be scaled wrong')
+              dmap[int(m.group(1))] = next_d
+              body.append('%%ADD%d%s%s*%%' % (next_d, mmap.get(template, template), params))
+              next_d = next_d + 1
+            elif part.startswith('IP'):
+              if not [h for h in header if h.startswith('%IP')]:
+                header.append('%'+part+'*%')
+            elif part.startswith('TF'):
+              # file attributes describe the source file, not the merge
+              continue
+            else:
+              body.append('%'+part+'*%')
+          continue
+
+        if cmd.startswith('M02') or cmd.startswith('M00'):
+          continue
+        if cmd.startswith('G04'):
+          body.append(cmd+'*')
+          continue
+
+        if 'G75' in cmd:
+          multi = True
+        elif 'G74' in cmd:
+          multi = False
+
+        cmd = D_CODE.sub(lambda m: 'D%d' % dmap.get(int(m.group(1)), int(m.group(1)))
+                         if int(m.group(1)) >= 10 else m.group(0), cmd)
+
+        if src_fmt[1:] != out_fmt[1:] or (src_units or out_units) != out_units:
+          ratio = (src_units or out_units or 1.0) / (out_units or 1.0)
+          def convert(m):
+            value = parse_gerber_number(m.group(2), src_fmt[1], src_fmt[0], src_fmt[2])*ratio
+            return m.group(1) + str(int(round(value * 10**out_fmt[1])))
+          cmd = COORD_NUMBER.sub(convert, cmd)
+
+        body.append(cmd+'*')
+
+  with open(out_path,'w') as merged:
+    merged.write('\n'.join(header + body + ['M02*']) + '\n')
+
+###########################################################
+#
+#                     read_excellon
+#
+# inputs:
+# - path to an Excellon drill file
+#
+# what it does:
+# - reads the tool table and every drill hit; routed
+#   slots are drawn as their end holes
+#
+# returns:
+# - GerberLayer with one flash per hole
+#
+###########################################################
+
+def read_excellon(path):
+
+  layer = GerberLayer(path)
+  scale = 1.0
+  decimals = 3
+  leading_zeros = False
+  tools = {}
+  shapes = []
+  radius = 0.0
+  x = y = 0.0
+
+  with open(path,'r') as drillfile:
+    for line in drillfile:
+      line = line.strip()
+      if not line or line.startswith(';'):
+        continue
+
+      if line.startswith('METRIC') or line.startswith('INCH'):
+        scale = 1.0 if line.startswith('METRIC') else 25.4
+        decimals = 3 if scale == 1.0 else 4
+        leading_zeros = ',LZ' in line
+        continue
+
+      m = re.match(r'^T(\d+)C([\d.]+)', line)
+      if m:
+        d = float(m.group(2))*scale
+        tools[int(m.group(1))] = [('c', 0.0, 0.0, d/2, True)]
+        continue
+
+      m = re.match(r'^T(\d+)$', line)
+      if m:
+        shapes = tools.get(int(m.group(1)), [])
+        radius = aperture_radius(shapes)
+        continue
+
+      if line.startswith('X') or line.startswith('Y'):
+        xs = re.search(r'X([+-]?[\d.]+)', line)
+        ys = re.search(r'Y([+-]?[\d.]+)', line)
+        if xs:
+          x = parse_excellon_number(xs.group(1), decimals, leading_zeros)*scale
+        if ys:
+          y = parse_excellon_number(ys.group(1), decimals, leading_zeros)*scale
+        layer.ops.append(('flash', shapes, x, y, True))
+        layer.grow([(x, y)], radius)
+
+  return layer
+
+def parse_excellon_number(text, decimals, leading_zeros):
+
+  if '.' in text:
+    return float(text)
+  if leading_zeros:
+    # leading zeros kept, trailing dropped: pad to the full width
+    sign = ''
+    if text[0] in '+-':
+      sign, text = text[0], text[1:]
+    return float(sign+text.ljust(decimals + 3, '0')) / 10**decimals
+  return int(text) / float(10**decimals)
+
+###########################################################
+#
+#                      load_layer
+#
+# inputs:
+# - path to a gerber or drill file
+#
+# what it does:
+# - parses the file once; later calls for an unchanged
+#   file return the same GerberLayer
+#
+# returns:
+# - GerberLayer, or None if there's no path or the file
+#   doesn't exist
+#
+###########################################################
+
+_layer_cache = {}
+
+DRILL_EXTENSIONS = ('.xln', '.drl', '.exc', '.txt')
+
+def load_layer(path):
+
+  if not path or not os.path.isfile(path):
+    return None
+
+  st = os.stat(path)
+  key = os.path.abspath(path)
+  cached = _layer_cache.get(key)
+  if cached and cached[0] == (st.st_size, st.st_mtime):
+    return cached[1]
+
+  if os.path.splitext(path)[1].lower() in DRILL_EXTENSIONS:
+    layer = read_excellon(path)
+  else:
+    layer = read_gerber(path)
+
+  _layer_cache[key] = ((st.st_size, st.st_mtime), layer)
+  return layer
+
+###########################################################
+#
+#                   outline_geometry
+#
+# inputs:
+# - path to the board outline gerber, ex: Edge.Cuts.gko
+#
+# what it does:
+# - joins the outline's lines and arcs end to end into
+#   closed loops; a full-circle arc is a loop by itself
+# - the loop with the largest area is the board edge and
+#   the others are cutouts
+#
+# returns:
+# - None if there is no outline, otherwise a dict of:
+#   'bbox'      (xmin, ymin, xmax, ymax) of the outline
+#               itself, in mm, including arc bulges
+#   'ink_bbox'  the same but including the line width
+#   'area'      board area in square mm, cutouts removed;
+#               arcs count as 5 degree chords, which
+#               reads about 0.1% small
+#   'perimeter' length of every edge in mm, cutouts
+#               included
+#   'loops'     number of closed loops found
+#
+###########################################################
+
+def chain_loops(segs, tol=1e-4):
+
+  def key(p):
+    return (int(round(p[0]/tol)), int(round(p[1]/tol)))
+
+  ends = {}
+  for i, (a, b) in enumerate(segs):
+    ends.setdefault(key(a), []).append(i)
+    ends.setdefault(key(b), []).append(i)
+
+  used = [False]*len(segs)
+  loops = []
+  for i in range(len(segs)):
+    if used[i]:
+      continue
+    used[i] = True
+    start, cur = segs[i]
+    loop = [start, cur]
+    while key(cur) != key(start):
+      nxt = None
+      for j in ends.get(key(cur), []):
+        if not used[j]:
+          nxt = j
+          break
+      if nxt is None:
+        break
+      used[nxt] = True
+      a, b = segs[nxt]
+      cur = b if key(a) == key(cur) else a
+      loop.append(cur)
+    loops.append(loop)
+
+  return loops
+
+def polygon_area(pts):
+
+  area = 0.0
+  for (x1, y1), (x2, y2) in zip(pts, pts[1:] + pts[:1]):
+    area = area + x1*y2 - x2*y1
+  return area/2
+
+def outline_geometry(path):
+
+  layer = load_layer(path)
+  if layer is None:
+    return None
+
+  segs = [s for s in layer.segments() if s[0] != s[1]]
+  if not segs:
+    return None
+
+  xs = [p[0] for s in segs for p in s]
+  ys = [p[1] for s in segs for p in s]
+
+  loops = chain_loops(segs)
+  areas = sorted([abs(polygon_area(l)) for l in loops], reverse=True)
+
+  return {
+    'bbox': (min(xs), min(ys), max(xs), max(ys)),
+    'ink_bbox': layer.bbox,
+    'area': areas[0] - sum(areas[1:]),
+    'perimeter': sum([math.hypot(b[0]-a[0], b[1]-a[1]) for a, b in segs]),
+    'loops': len(loops),
+  }
+
+###########################################################
+#
+#                        Raster
+#
+# maps board mm onto an image of width x height pixels,
+# fitting the view box (xmin, ymin, xmax, ymax) and
+# keeping its aspect ratio, with +y pointing up
+#
+###########################################################
+
+class Raster(object):
+
+  def __init__(self, view, width, height):
+    load_numpy()
+    xmin, ymin, xmax, ymax = view
+    vw = max(xmax - xmin, 1e-6)
+    vh = max(ymax - ymin, 1e-6)
+    self.width = int(width)
+    self.height = int(height)
+    self.scale = min(self.width/vw, self.height/vh)
+    self.x0 = xmin - (self.width/self.scale - vw)/2
+    self.y1 = ymax + (self.height/self.scale - vh)/2
+
+  def to_px(self, pts):
+    return [((x - self.x0)*self.scale, (self.y1 - y)*self.scale) for x, y in pts]
+
+  def blank(self):
+    return np.zeros((self.height, self.width), dtype=bool)
+
+###########################################################
+#
+#                     Fill primitives
+#
+# every fill works on the bounding window of the shape in
+# pixel coordinates and samples pixel centers
+#
+###########################################################
+
+def window(img, xmin, ymin, xmax, ymax):
+
+  h, w = img.shape
+  c0 = max(int(math.floor(xmin)), 0)
+  c1 = min(int(math.ceil(xmax)) + 1, w)
+  r0 = max(int(math.floor(ymin)), 0)
+  r1 = min(int(math.ceil(ymax)) + 1, h)
+  return r0, r1, c0, c1
+
+def edges_mask(x0, y0, x1, y1, h, w):
+
+  # even-odd fill: toggle at each edge crossing along
+  # every row, then a running xor across the row
+  load_numpy()
+  x0, y0, x1, y1 = [np.asarray(a, dtype=float) for a in (x0, y0, x1, y1)]
+  keep = y0 != y1
+  x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+
+  rmin = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, h).astype(int)
+  rmax = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, h).astype(int)
+  counts = rmax - rmin
+
+  acc = np.zeros((h, w+1), dtype=np.uint8)
+  total = int(counts.sum())
+  if total:
+    idx = np.repeat(np.arange(len(counts)), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    rows = np.repeat(rmin, counts) + (np.arange(total) - starts)
+    t = (rows + 0.5 - y0[idx]) / (y1[idx] - y0[idx])
+    xc = x0[idx] + t*(x1[idx] - x0[idx])
+    cols = np.clip(np.ceil(xc - 0.5), 0, w).astype(int)
+    np.add.at(acc, (rows, cols), 1)
+
+  return (np.cumsum(acc, axis=1, dtype=np.uint8)[:, :w] & 1).astype(bool)
+
+def fill_polygons(img, contours, value):
+
+  pts = [p for c in contours for p in c]
+  if not pts:
+    return
+  xs = [p[0] for p in pts]
+  ys = [p[1] for p in pts]
+  r0, r1, c0, c1 = window(img, min(xs), min(ys), max(xs), max(ys))
+  if r0 >= r1 or c0 >= c1:
+    return
+
+  x0 = []; y0 = []; x1 = []; y1 = []
+  for c in contours:
+    for (ax, ay), (bx, by) in zip(c, c[1:] + c[:1]):
+      x0.append(ax - c0); y0.append(ay - r0)
+      x1.append(bx - c0); y1.append(by - r0)
+
+  mask = edges_mask(x0, y0, x1, y1, r1 - r0, c1 - c0)
+  img[r0:r1, c0:c1][mask] = value
+
+def fill_circle(img, cx, cy, r, value):
+
+  r = max(r, 0.5)
+  r0, r1, c0, c1 = window(img, cx - r, cy - r, cx + r, cy + r)
+  if r0 >= r1 or c0 >= c1:
+    return
+  yy, xx = np.ogrid[r0:r1, c0:c1]
+  mask = (xx + 0.5 - cx)**2 + (yy + 0.5 - cy)**2 <= r*r
+  img[r0:r1, c0:c1][mask] = value
+
+def fill_capsule(img, ax, ay, bx, by, r, value):
+
+  r = max(r, 0.7)
+  r0, r1, c0, c1 = window(img, min(ax, bx) - r, min(ay, by) - r, max(ax, bx) + r, max(ay, by) + r)
+  if r0 >= r1 or c0 >= c1:
+    return
+  yy, xx = np.ogrid[r0:r1, c0:c1]
+  px = xx + 0.5 - ax
+  py = yy + 0.5 - ay
+  dx, dy = bx - ax, by - ay
+  l2 = dx*dx + dy*dy
+  if l2 == 0:
+    mask = px*px + py*py <= r*r
+  else:
+    t = np.clip((px*dx + py*dy)/l2, 0.0, 1.0)
+    mask = (px - t*dx)**2 + (py - t*dy)**2 <= r*r
+  img[r0:r1, c0:c1][mask] = value
+
+def convex_hull(pts):
+
+  pts = sorted(set(pts))
+  if len(pts) < 3:
+    return pts
+  def cross(o, a, b):
+    return (a[0]-o[0])*(b[1]-o[1]) - (a[1]-o[1])*(b[0]-o[0])
+  lower = []
+  for p in pts:
+    while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+      lower.pop()
+    lower.append(p)
+  upper = []
+  for p in reversed(pts):
+    while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+      upper.pop()
+    upper.append(p)
+  return lower[:-1] + upper[:-1]
+
+def shape_points(shape):
+
+  if shape[0] == 'c':
+    return regular_polygon_points(shape[3]*2, 16, 0.0, shape[1], shape[2])
+  return shape[1]
+
+###########################################################
+#
+#                      render_layer
+#
+# inputs:
+# - GerberLayer
+# - Raster
+#
+# what it does:
+# - draws every op in file order, dark ops setting and
+#   clear ops erasing pixels
+#
+# returns:
+# - boolean array, True where the layer has material
+#
+###########################################################
+
+def draw_flash(img, raster, shapes, x, y, dark):
+
+  for shape in shapes:
+    value = dark if shape[-1] else not dark
+    if shape[0] == 'c':
+      (px, py), = raster.to_px([(x + shape[1], y + shape[2])])
+      fill_circle(img, px, py, shape[3]*raster.scale, value)
+    else:
+      fill_polygons(img, [raster.to_px([(x + sx, y + sy) for sx, sy in shape[1]])], value)
+
+def draw_path(img, raster, shapes, pts, dark):
+
+  px_pts = raster.to_px(pts)
+
+  if len(shapes) == 1 and shapes[0][0] == 'c':
+    r = shapes[0][3]*raster.scale
+    for (ax, ay), (bx, by) in zip(px_pts[:-1], px_pts[1:]):
+      fill_capsule(img, ax, ay, bx, by, r, dark)
+    return
+
+  # other apertures sweep their outline along each segment
+  outline = [p for shape in shapes for p in shape_points(shape)]
+  if not outline:
+    return
+  for (ax, ay), (bx, by) in zip(pts[:-1], pts[1:]):
+    hull = convex_hull([(ax + ox, ay + oy) for ox, oy in outline] +
+                       [(bx + ox, by + oy) for ox, oy in outline])
+    fill_polygons(img, [raster.to_px(hull)], dark)
+
+def render_layer(layer, raster):
+
+  img = raster.blank()
+  if layer is None:
+    return img
+
+  for op in layer.ops:
+    if op[0] == 'flash':
+      draw_flash(img, raster, op[1], op[2], op[3], op[4])
+    elif op[0] == 'path':
+      draw_path(img, raster, op[1], op[2], op[3])
+    elif op[0] == 'region':
+      fill_polygons(img, [raster.to_px(c) for c in op[1]], op[2])
+
+  return img
+
+###########################################################
+#
+#                     render_outline
+#
+# inputs:
+# - GerberLayer of the board outline
+# - Raster
+#
+# what it does:
+# - treats every outline line and arc as an edge and
+#   fills between them, so cutouts stay open
+#
+# returns:
+# - boolean array, True inside the board
+#
+###########################################################
+
+def render_outline(layer, raster):
+
+  img = raster.blank()
+  if layer is None:
+    return img
+
+  segs = layer.segments()
+  if segs:
+    a = raster.to_px([s[0] for s in segs])
+    b = raster.to_px([s[1] for s in segs])
+    img = edges_mask([p[0] for p in a], [p[1] for p in a],
+                     [p[0] for p in b], [p[1] for p in b],
+                     raster.height, raster.width)
+  return img
+
+###########################################################
+#
+#                   render_board_side
+#
+# inputs:
+# - paths of one side's copper, mask, silk, the board
+#   outline and the drill file
+# - image width and height in pixels
+#
+# what it does:
+# - fits the view to the board outline
+# - paints soldermask over the board, copper showing
+#   through the mask openings, silk, then the outline and
+#   drill holes in black
+#
+# returns:
+# - height x width x 3 uint8 RGB array
+#
+###########################################################
+
+COLOR_BACKGROUND = (255, 255, 255)
+COLOR_MASK = (82, 0, 90)
+COLOR_MASK_COPPER = (120, 40, 130)
+COLOR_SUBSTRATE = (0, 0, 0)
+COLOR_COPPER = (230, 200, 0)
+COLOR_SILK = (255, 255, 255)
+COLOR_EDGE = (0, 0, 0)
+COLOR_DRILL = (0, 0, 0)
+
+def layer_view(layers):
+
+  boxes = [l.bbox for l in layers if l is not None and l.bbox]
+  if not boxes:
+    return (0.0, 0.0, 1.0, 1.0)
+  return (min([b[0] for b in boxes]), min([b[1] for b in boxes]),
+          max([b[2] for b in boxes]), max([b[3] for b in boxes]))
+
+def render_board_side(copper_path, mask_path, silk_path, outline_path, drill_path, width, height):
+
+  copper = load_layer(copper_path)
+  mask = load_layer(mask_path)
+  silk = load_layer(silk_path)
+  outline = load_layer(outline_path)
+  drill = load_layer(drill_path)
+
+  raster = Raster(layer_view([outline] if outline else [copper, mask, silk]), width, height)
+
+  board = render_outline(outline, raster)
+  copper_img = render_layer(copper, raster)
+  openings = render_layer(mask, raster)
+
+  rgb = np.empty((raster.height, raster.width, 3), dtype=np.uint8)
+  rgb[:] = COLOR_BACKGROUND
+  rgb[board] = COLOR_MASK
+  rgb[board & copper_img] = COLOR_MASK_COPPER
+  rgb[openings] = COLOR_SUBSTRATE
+  rgb[openings & copper_img] = COLOR_COPPER
+  rgb[render_layer(silk, raster)] = COLOR_SILK
+  rgb[render_layer(outline, raster)] = COLOR_EDGE
+  rgb[render_layer(drill, raster)] = COLOR_DRILL
+
+  return rgb
+
+###########################################################
+#
+#                   render_line_art
+#
+# inputs:
+# - list of gerber paths to draw, ex: F.Fab and the outline
+# - path of the layer that sets the view, usually the
+#   board outline so every image has the same scale
+# - image width and height in pixels
+#
+# returns:
+# - height x width uint8 array, black art on white
+#
+###########################################################
+
+def render_line_art(paths, view_path, width, height):
+
+  layers = [load_layer(p) for p in paths]
+  view_layer = load_layer(view_path)
+  raster = Raster(layer_view([view_layer] if view_layer else layers), width, height)
+
+  gray = np.empty((raster.height, raster.width), dtype=np.uint8)
+  gray[:] = 255
+  for layer in layers:
+    gray[render_layer(layer, raster)] = 0
+
+  return gray
+
+###########################################################
+#
+#                 pad_image, stitch_images
+#
+# inputs:
+# - image arrays, gray (h x w) or RGB (h x w x 3)
+#
+# what they do:
+# - pad_image adds white rows above and below and white
+#   columns left and right
+# - stitch_images puts the second image below the first
+#   for landscape boards, or to its right for portrait
+#   ones, with a white gap, padding the narrower one
+#
+# returns:
+# - a new array of the same kind
+#
+###########################################################
+
+def pad_image(img, rows, cols):
+
+  load_numpy()
+
+  pad = [(rows, rows), (cols, cols)] + [(0, 0)]*(img.ndim - 2)
+  return np.pad(img, pad, mode='constant', constant_values=255)
+
+def stitch_images(first, second, landscape, gap=20):
+
+  load_numpy()
+
+  axis = 0 if landscape else 1
+  other = 1 - axis
+  size = max(first.shape[other], second.shape[other])
+
+  def fit(img):
+    pad = [(0, 0)]*img.ndim
+    pad[other] = (0, size - img.shape[other])
+    return np.pad(img, pad, mode='constant', constant_values=255)
+
+  spacer_shape = list(first.shape)
+  spacer_shape[axis] = gap
+  spacer_shape[other] = size
+  spacer = np.empty(spacer_shape, dtype=first.dtype)
+  spacer[...] = 255
+
+  return np.concatenate([fit(first), spacer, fit(second)], axis=axis)
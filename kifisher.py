@@ -21,37 +21,53 @@
 # Released under the GPLv3.
 #
 
-import os, zipfile, glob, argparse, re, datetime, json, Image
-import kfconfig
-from shutil import copyfile
+import os, io, sys, copy, glob, argparse, re, datetime, time, json, csv, hashlib, sqlite3, struct, zlib, traceback, threading, multiprocessing
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+import kfconfig, kfgerber
+from shutil import copyfile, copyfileobj, copymode
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from contextlib import contextmanager
 from subprocess import call
-from pcbnew import *
 
 # see MacroFab XYRS formatting here:
 # https://macrofab.com/help/creating-managing-ordering-pcbs/required-design-files/
 
 # one component object with all possible attributes
-
-class Comp():
-  ref = ''          # ex: C1 -- this is required
-  value = ''        # ex: 1uF 20V
-  description = ''  # ex: CAP CER 1uF X7R 0402
-  footprint = ''    # ex: RLC-0402-SMD
-  fp_lib = ''       # ex: Wickerlib
-  symbol = ''       # ex: CAP-CER-1UF-X7R-0402
-  sym_lib = ''      # ex: wickerlib
-  datasheet = ''    # ex: http://iamadatasheet.digikey.com/part.pdf
-  mf_name = ''      # ex: Bourns
-  mf_pn = ''        # ex: ERJFO-1921-CP
-  s1_name = ''      # ex: Digikey
-  s1_pn = ''        # ex: 10281-ND
-  thsmt = ''        # 'th', 'smt', or 'dnp'
-  xsize_mils = ''   # length of part in mils in x direction
-  ysize_mils = ''   # width of part in mils in y direction
-  xloc = ''         # mils from bottom left, ex: 270.00
-  yloc = ''         # mils from bottom left, ex: 900.00
-  rot = ''          # rotation in degrees, ex: 270
-  side = ''         # layer part is on, 'top' or 'bottom'
+# __slots__ keeps each instance small on boards with
+# thousands of parts; every attribute starts out as ''
+
+class Comp(object):
+  __slots__ = (
+    'ref',          # ex: C1 -- this is required
+    'value',        # ex: 1uF 20V
+    'description',  # ex: CAP CER 1uF X7R 0402
+    'footprint',    # ex: RLC-0402-SMD
+    'fp_lib',       # ex: Wickerlib
+    'symbol',       # ex: CAP-CER-1UF-X7R-0402
+    'sym_lib',      # ex: wickerlib
+    'datasheet',    # ex: http://iamadatasheet.digikey.com/part.pdf
+    'mf_name',      # ex: Bourns
+    'mf_pn',        # ex: ERJFO-1921-CP
+    's1_name',      # ex: Digikey
+    's1_pn',        # ex: 10281-ND
+    'thsmt',        # 'th', 'smt', or 'dnp'
+    'xsize_mils',   # length of part in mils in x direction
+    'ysize_mils',   # width of part in mils in y direction
+    'xloc',         # mils from bottom left, ex: 270.00
+    'yloc',         # mils from bottom left, ex: 900.00
+    'rot',          # rotation in degrees, ex: 270
+    'side',         # layer part is on, 'top' or 'bottom'
+    'fields',       # any other schematic fields, ex: {'S2_PN': '311-1.00KHRCT-ND'}
+  )
+
+  def __init__(self):
+    for attr in self.__slots__:
+      setattr(self, attr, '')
+    self.fields = {}
 
   def print_component(self):
     print('-------------------------')
@@ -66,26 +82,113 @@ class Comp():
     print('Size in mils:',self.xsize_mils,'x',self.ysize_mils)
     print('Location:', self.xloc+'x ',self.yloc+'y')
     print('Rotation:',self.rot,'on the',self.side,'side')
+    for name in sorted(self.fields):
+      print(name+':',self.fields[name])
     print('')
 
-class BOMline():
-  refs = ''
-  qty = 0
-  footprint = ''
-  fp_lib = ''
-  symbol = ''
-  sym_lib = ''
-  datasheet = ''
-  description = ''
-  mf_pn = ''
-  mf_name = ''
-  s1_pn = ''
-  s1_name = ''
-  thsmt = ''
+# one line of the bill of materials, covering every
+# component that shares the same group key
+
+class BOMline(object):
+  __slots__ = (
+    'refs',         # ex: C1-C3 C5
+    'qty',          # ex: 4
+    'footprint',
+    'fp_lib',
+    'symbol',
+    'sym_lib',
+    'datasheet',
+    'description',
+    'mf_pn',
+    'mf_name',
+    's1_pn',
+    's1_name',
+    'thsmt',
+    'fields',       # the first component's other schematic fields
+  )
+
+  def __init__(self):
+    for attr in self.__slots__:
+      setattr(self, attr, '')
+    self.qty = 0
+    self.fields = {}
 
   def print_line(self):
     print(self.refs,self.qty,self.footprint,self.fp_lib,self.symbol,self.sym_lib,self.datasheet,self.description,self.mf_name,self.mf_pn,self.s1_name,self.s1_pn,self.thsmt)
 
+###########################################################
+#
+#                        Profiler
+#
+# records how long each build step and external tool
+# takes when kf runs with --profile
+#
+# - @profiled wraps a function so each call is recorded
+#   under the function's name; with profiling off it
+#   just calls through
+# - profile_span(name, cat) times a block, ex: one tool
+# - write_trace() saves the Chrome trace event format,
+#   which chrome://tracing and ui.perfetto.dev open,
+#   with one row per thread
+# - summary() totals the time per name, slowest first
+#
+###########################################################
+
+class Profiler(object):
+
+  def __init__(self):
+    self.events = []
+    self.start = time.time()
+
+  def record(self, name, cat, start, end):
+    self.events.append({
+      'name': name, 'cat': cat, 'ph': 'X',
+      'ts': int((start - self.start)*1e6),
+      'dur': int((end - start)*1e6),
+      'pid': os.getpid(),
+      'tid': threading.current_thread().ident,
+    })
+
+  def write_trace(self, trace_file):
+    trace_dir = os.path.dirname(trace_file)
+    if trace_dir and not os.path.exists(trace_dir):
+      os.makedirs(trace_dir)
+    with open(trace_file,'w') as f:
+      json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+  def summary(self):
+    totals = OrderedDict()
+    for e in self.events:
+      key = (e['cat'], e['name'])
+      calls, total, longest = totals.get(key, (0, 0, 0))
+      totals[key] = (calls + 1, total + e['dur'], max(longest, e['dur']))
+
+    lines = ['%-8s %-36s %6s %10s %10s' % ('kind', 'name', 'calls', 'total s', 'max s')]
+    for (cat, name), (calls, total, longest) in sorted(totals.items(), key=lambda t: -t[1][1]):
+      lines.append('%-8s %-36s %6d %10.3f %10.3f' % (cat, name, calls, total/1e6, longest/1e6))
+    return '\n'.join(lines)
+
+profiler = None
+
+@contextmanager
+def profile_span(name, cat):
+  if profiler is None:
+    yield
+    return
+  start = time.time()
+  try:
+    yield
+  finally:
+    profiler.record(name, cat, start, time.time())
+
+def profiled(func):
+  def wrapper(*args, **kwargs):
+    with profile_span(func.__name__, 'function'):
+      return func(*args, **kwargs)
+  wrapper.__name__ = func.__name__
+  wrapper.__doc__ = func.__doc__
+  return wrapper
+
 ###########################################################
 #
 #                    update_version
@@ -215,6 +318,65 @@ def create_new_project(projname,which_template,version):
   update_kicad_pcb_title_block(data)
   update_sch_title_block(data)
 
+###########################################################
+#
+#                rewrite_title_block
+#
+# inputs:
+# - path to a .kicad_pcb or .sch file
+# - text marking the first line of the title block
+# - text marking its last line
+# - list of new title block lines
+#
+# what it does:
+# - reads lines up to the end of the title block, which
+#   sits near the top of the file, and stops there if the
+#   block already matches the new lines
+# - otherwise writes what it read before the block, the
+#   new block and then streams the rest of the file into
+#   path.tmp, and renames that over the file, so a crash
+#   part way through never leaves a half written board
+#
+# returns True if the file was rewritten
+#
+###########################################################
+
+def rewrite_title_block(path, start, end, block):
+
+  block = [line.encode('utf-8') for line in block]
+  start = start.encode('utf-8')
+  end = end.encode('utf-8')
+
+  with open(path,'rb') as src:
+
+    # readline, not iteration, so the copyfileobj below
+    # picks up exactly where the scan stopped on python 2
+    head = []
+    line = src.readline()
+    while line and start not in line:
+      head.append(line)
+      line = src.readline()
+    if not line:
+      return False
+
+    old = [line]
+    while line and end not in line:
+      line = src.readline()
+      old.append(line)
+    if not line:
+      return False
+    if old == block:
+      return False
+
+    with open(path+'.tmp','wb') as dst:
+      dst.writelines(head)
+      dst.writelines(block)
+      copyfileobj(src, dst, 1024*1024)
+
+  copymode(path, path+'.tmp')
+  os.rename(path+'.tmp', path)
+  return True
+
 ###########################################################
 #
 #                update_kicad_pcb_title_block
@@ -223,44 +385,30 @@ def create_new_project(projname,which_template,version):
 # - data object
 #
 # what it does:
-# - reads in the existing file
-# - applies the current data to the entire title block
-# - writes the file back out
+# - applies the current data to the title block of the
+#   .kicad_pcb, leaving the file alone if it already
+#   matches
 #
-# returns nothing
+# returns True if the board was rewritten
 #
 ###########################################################
 
 def update_kicad_pcb_title_block(data):
   f = data['projname']+'/'+data['projname']+'.kicad_pcb'
-  f_temp = []
-  title_flag = False
-
-  with open(f,'r') as fixfile:
-    for line in fixfile:
-
-      if '  (title_block' in line:
-        title_flag = True
-      if title_flag is True:
-        if '  )' in line:
-          title_flag = False
-
-          f_temp.append('  (title_block\n')
-          f_temp.append('    (title "'+data['title']+'")\n')
-          f_temp.append('    (date "'+data['date_create']+'")\n')
-          f_temp.append(  '    (rev "'+data['version']+'")\n')
-          f_temp.append('    (company "'+data['license']+'")\n')
-          f_temp.append('    (comment 1 "'+data['email']+'")\n')
-          f_temp.append('    (comment 2 "'+data['website']+'")\n')
-          f_temp.append('    (comment 3 "'+data['company']+'")\n')
-          f_temp.append('  )\n')
 
-      else:
-        f_temp.append(line)
+  block = [
+    '  (title_block\n',
+    '    (title "'+data['title']+'")\n',
+    '    (date "'+data['date_create']+'")\n',
+    '    (rev "'+data['version']+'")\n',
+    '    (company "'+data['license']+'")\n',
+    '    (comment 1 "'+data['email']+'")\n',
+    '    (comment 2 "'+data['website']+'")\n',
+    '    (comment 3 "'+data['company']+'")\n',
+    '  )\n',
+  ]
 
-  with open(f,'w') as fixfile:
-    for line in f_temp:
-      fixfile.write(line)
+  return rewrite_title_block(f, '  (title_block', '  )', block)
 
 ###########################################################
 #
@@ -270,46 +418,43 @@ def update_kicad_pcb_title_block(data):
 # - data object
 #
 # what it does:
-# - reads in the existing .sch files
-# - applies the current data to the entire title block
-# - writes the file back out
+# - applies the current data to the title block of every
+#   .sch sheet in the project, a few sheets at a time in
+#   threads, leaving sheets that already match alone
 #
-# returns nothing
+# returns a list of the sheets that were rewritten
 #
 ###########################################################
 
 def update_sch_title_block(data):
 
-  filelist = glob.glob(data['projname']+'/*.sch')
+  filelist = sorted(glob.glob(data['projname']+'/*.sch'))
+  if not filelist:
+    return []
+
+  block = [
+    'Title "'+data['title']+'"\n',
+    'Date "'+data['date_create']+'"\n',
+    'Rev "'+data['version']+'"\n',
+    'Comp "'+data['license']+'"\n',
+    'Comment1 "'+data['email']+'"\n',
+    'Comment2 "'+data['website']+'"\n',
+    'Comment3 "'+data['company']+'"\n',
+    'Comment4 ""\n',
+    '$EndDescr\n',
+  ]
+
+  def rewrite(f):
+    return rewrite_title_block(f, 'Title ', '$EndDescr', block)
 
-  for f in filelist:
-    f_temp = []
-    title_flag = False
-
-    with open(f,'r') as fixfile:
-      for line in fixfile:
-
-        if 'Title ' in line:
-          title_flag = True
-        if title_flag is True:
-          if '$EndDescr' in line:
-            title_flag = False
-
-            f_temp.append('Title "'+data['title']+'"\n')
-            f_temp.append('Date "'+data['date_create']+'"\n')
-            f_temp.append('Rev "'+data['version']+'"\n')
-            f_temp.append('Comp "'+data['license']+'"\n')
-            f_temp.append('Comment1 "'+data['email']+'"\n')
-            f_temp.append('Comment2 "'+data['website']+'"\n')
-            f_temp.append('Comment3 "'+data['company']+'"\n')
-            f_temp.append('Comment4 ""\n')
-            f_temp.append('$EndDescr\n')
-        else:
-          f_temp.append(line)
+  pool = ThreadPool(min(len(filelist), multiprocessing.cpu_count()))
+  try:
+    changed = pool.map(rewrite, filelist)
+  finally:
+    pool.close()
+    pool.join()
 
-    with open(f,'w') as fixfile:
-      for line in f_temp:
-        fixfile.write(line)
+  return [f for f, c in zip(filelist, changed) if c]
 
 ###########################################################
 #
@@ -345,12 +490,17 @@ def create_readme(filename,data):
     o.write('### Bill of Materials\n\n')
     o.write('<!--- bom end --->\n\n')
     o.write('### Manufacturing Notes\n\n')
+    o.write('<!--- size start --->\n')
+    o.write('<!--- size end --->\n\n')
     o.write('This board must be v-scored. Do not panelize with support tabs or mousebites.\n\n')
     o.write('<!--- assy start --->\n')
     o.write('### Assembly Info for Quoting\n\n')
     o.write('<!--- assy end --->\n')
     o.write('![Assembly Diagram](assembly.png)\n\n')
     o.write('![Gerber Preview](preview.png)\n\n')
+    o.write('### Changelog\n\n')
+    o.write('<!--- changelog start --->\n')
+    o.write('<!--- changelog end --->\n')
 
 ###########################################################
 #
@@ -389,53 +539,30 @@ def sanitize_input_kicad_filename(filename):
 
 ###########################################################
 #
-#              plot_gerbers_and_drills
+#               set_gerber_plot_options
 #
 #  inputs:
-#  - root name of the project, where the
-#    root of 'project.kicad_pcb' would be 'project'
+#  - plot controller object
 #  - name of a subdirectory to put output files
 #
 #  what it does:
-#  - clean the output dir by removing all files
-#  - set plot options
-#  - create plot layers in output directory
-#  - safely close the plot object
-#  - set drill options
-#  - create drill and map files
-#  - create drill statistics report
+#  - sets the plot options shared by every gerber layer
 #
 #  returns nothing
 #
 ###########################################################
 
-def plot_gerbers_and_drills(projname, plot_dir):
-
-  # make the output dir if it doesn't already exist
-  if not os.path.exists(plot_dir):
-    os.makedirs(plot_dir)
-
-  # remove all files in the output dir
-  cwd = os.getcwd()
-  os.chdir(plot_dir)
-  filelist = glob.glob('*')
-  for f in filelist:
-    os.remove(f)
-  os.chdir('..')
-  print(os.getcwd())
+def set_gerber_plot_options(pctl, plot_dir):
 
-  # create board object
-  board = LoadBoard(projname+'.kicad_pcb')
+  import pcbnew
 
-  # create plot controller objects
-  pctl = PLOT_CONTROLLER(board)
   popt = pctl.GetPlotOptions()
   popt.SetOutputDirectory(plot_dir)
 
   # set plot options
 
   popt.SetPlotFrameRef(False)        # do not change it
-  popt.SetLineWidth(FromMM(0.35))
+  popt.SetLineWidth(pcbnew.FromMM(0.35))
   popt.SetAutoScale(False)           # do not change it
   popt.SetScale(1)                   # do not change it
   popt.SetMirror(False)
@@ -451,6 +578,152 @@ def plot_gerbers_and_drills(projname, plot_dir):
   # in any case, now it works when set to false.
   popt.SetUseAuxOrigin(False)
 
+###########################################################
+#
+#                  plot_gerber_layers
+#
+#  inputs:
+#  - plot controller object with options already set
+#  - list of (file suffix, layer number, description)
+#
+#  what it does:
+#  - plots each layer to its own gerber file
+#
+#  returns nothing
+#
+###########################################################
+
+def plot_gerber_layers(pctl, layers):
+
+  import pcbnew
+
+  for layer_info in layers:
+    pctl.SetLayer(layer_info[1])
+    pctl.OpenPlotfile(layer_info[0], pcbnew.PLOT_FORMAT_GERBER, layer_info[2])
+    if pctl.PlotLayer() == False:
+      print("Plot Error: Layer Missing?")
+
+###########################################################
+#
+#               plot_gerber_layer_group
+#
+#  inputs:
+#  - (projname, plot_dir, layers) tuple
+#
+#  what it does:
+#  - runs in a worker process: loads its own copy of the
+#    board and plots its share of the layers with the
+#    same options as the serial path
+#
+#  returns nothing
+#
+###########################################################
+
+def plot_gerber_layer_group(job):
+
+  import pcbnew
+
+  projname, plot_dir, layers = job
+
+  board = pcbnew.LoadBoard(projname+'.kicad_pcb')
+  pctl = pcbnew.PLOT_CONTROLLER(board)
+  set_gerber_plot_options(pctl, plot_dir)
+  plot_gerber_layers(pctl, layers)
+  pctl.ClosePlot()
+
+###########################################################
+#
+#                  write_drill_files
+#
+#  inputs:
+#  - board object
+#  - absolute output dir, ending in '/'
+#
+#  what it does:
+#  - set drill options
+#  - create drill and map files
+#  - create drill statistics report
+#
+#  returns nothing
+#
+###########################################################
+
+def write_drill_files(board, plot_dir_name):
+
+  import pcbnew
+
+  # create drill object and set options
+
+  drlwriter = pcbnew.EXCELLON_WRITER(board)
+  drlwriter.SetMapFileFormat(pcbnew.PLOT_FORMAT_GERBER)
+
+  mirror = False
+  minimalHeader = False
+  offset = pcbnew.wxPoint(0,0)
+
+  mergeNPTH = True
+  metricFmt = True
+  genDrl = True
+  genMap = True
+
+  # Create drill and map files
+
+  drlwriter.SetOptions( mirror, minimalHeader, offset, mergeNPTH )
+  drlwriter.SetFormat( metricFmt )
+  drlwriter.CreateDrillandMapFilesSet( plot_dir_name, genDrl, genMap );
+
+  # Create the drill statistics report
+
+  rptfn = plot_dir_name + 'drill_report.rpt'
+  drlwriter.GenDrillReportFile( rptfn );
+
+###########################################################
+#
+#              plot_gerbers_and_drills
+#
+#  inputs:
+#  - root name of the project, where the
+#    root of 'project.kicad_pcb' would be 'project'
+#  - name of a subdirectory to put output files
+#  - number of plotting processes (default 1)
+#
+#  what it does:
+#  - clean the output dir by removing all files
+#  - set plot options
+#  - create plot layers in output directory, either in
+#    this process or split round-robin across worker
+#    processes that each load the board; the drill files
+#    are written here while the workers plot
+#  - safely close the plot object
+#  - create drill, map and drill report files
+#  - merge the fab notes and rename the outline and
+#    drill files
+#
+#  returns nothing
+#
+###########################################################
+
+@profiled
+def plot_gerbers_and_drills(projname, plot_dir, plot_jobs=1):
+
+  import pcbnew
+
+  # make the output dir if it doesn't already exist
+  if not os.path.exists(plot_dir):
+    os.makedirs(plot_dir)
+
+  # remove all files in the output dir
+  cwd = os.getcwd()
+  os.chdir(plot_dir)
+  filelist = glob.glob('*')
+  for f in filelist:
+    os.remove(f)
+  os.chdir('..')
+  print(os.getcwd())
+
+  # create board object
+  board = pcbnew.LoadBoard(projname+'.kicad_pcb')
+
   # note: the middle value in plot_plan is an integer layer number:
   # 0 F.Cu
   # 1 In1.Cu
@@ -504,76 +777,65 @@ def plot_gerbers_and_drills(projname, plot_dir):
   # 49 F.Fab
 
   plot_plan = [
-      ( "F.Cu", F_Cu, "Copper top" ),
-      ( "B.Cu", B_Cu, "Copper bottom" ),
-      ( "F.Paste", F_Paste, "Paste top" ),
-      ( "B.Paste", B_Paste, "Paste bottom" ),
-      ( "F.SilkS", F_SilkS, "Silk top" ),
-      ( "B.SilkS", B_SilkS, "Silk top" ),
-      ( "F.Mask", F_Mask, "Mask top" ),
-      ( "B.Mask", B_Mask, "Mask bottom" ),
-      ( "Edge.Cuts", Edge_Cuts, "Board outline" ),
-      ( "F.Fab", F_Fab, "Assembly top" ),
-      ( "B.Fab", B_Fab, "Assembly bottom" ),
-      ( "Dwgs.User", Dwgs_User, "Fab notes" ),
+      ( "F.Cu", pcbnew.F_Cu, "Copper top" ),
+      ( "B.Cu", pcbnew.B_Cu, "Copper bottom" ),
+      ( "F.Paste", pcbnew.F_Paste, "Paste top" ),
+      ( "B.Paste", pcbnew.B_Paste, "Paste bottom" ),
+      ( "F.SilkS", pcbnew.F_SilkS, "Silk top" ),
+      ( "B.SilkS", pcbnew.B_SilkS, "Silk top" ),
+      ( "F.Mask", pcbnew.F_Mask, "Mask top" ),
+      ( "B.Mask", pcbnew.B_Mask, "Mask bottom" ),
+      ( "Edge.Cuts", pcbnew.Edge_Cuts, "Board outline" ),
+      ( "F.Fab", pcbnew.F_Fab, "Assembly top" ),
+      ( "B.Fab", pcbnew.B_Fab, "Assembly bottom" ),
+      ( "Dwgs.User", pcbnew.Dwgs_User, "Fab notes" ),
   ]
 
-  # generate all gerbers
-  for layer_info in plot_plan:
-      pctl.SetLayer(layer_info[1])
-      pctl.OpenPlotfile(layer_info[0], PLOT_FORMAT_GERBER, layer_info[2])
-      pctl.PlotLayer()
-
-  # generate internal copper layers, if any
+  # add internal copper layers, if any
   lyrcnt = board.GetCopperLayerCount();
 
   for innerlyr in range ( 1, lyrcnt-1 ):
-      pctl.SetLayer(innerlyr)
-      lyrname = 'In.%s' % innerlyr
-      pctl.OpenPlotfile(lyrname, PLOT_FORMAT_GERBER, "Inner")
-      #print 'plot %s' % pctl.GetPlotFileName()
-      if pctl.PlotLayer() == False:
-          print("Plot Error: Layer Missing?")
+      plot_plan.append(( 'In.%s' % innerlyr, innerlyr, "Inner" ))
 
-  # close out the plot to safely free the object.
+  plot_dir_name = os.path.abspath(plot_dir)+'/'
 
-  pctl.ClosePlot()
-
-  # create drill object and set options
-
-  drlwriter = EXCELLON_WRITER(board)
-  drlwriter.SetMapFileFormat(PLOT_FORMAT_GERBER)
+  if plot_jobs > 1:
 
-  mirror = False
-  minimalHeader = False
-  offset = wxPoint(0,0)
-
-  mergeNPTH = True
-  metricFmt = True
-  genDrl = True
-  genMap = True
+    # split the plan round-robin so heavy copper layers spread out
+    plot_jobs = min(plot_jobs, len(plot_plan))
+    groups = [(projname, plot_dir, plot_plan[i::plot_jobs]) for i in range(plot_jobs)]
 
-  # Create drill and map files
+    pool = multiprocessing.Pool(plot_jobs)
+    try:
+      result = pool.map_async(plot_gerber_layer_group, groups)
+      write_drill_files(board, plot_dir_name)
+      result.get()
+    finally:
+      pool.close()
+      pool.join()
 
-  drlwriter.SetOptions( mirror, minimalHeader, offset, mergeNPTH )
-  drlwriter.SetFormat( metricFmt )
-  drlwriter.CreateDrillandMapFilesSet( pctl.GetPlotDirName(), genDrl, genMap );
+  else:
 
-  # Create fab notes file
+    # create plot controller objects
+    pctl = pcbnew.PLOT_CONTROLLER(board)
+    set_gerber_plot_options(pctl, plot_dir)
 
+    # generate all gerbers
+    plot_gerber_layers(pctl, plot_plan)
 
-  # Create the drill statistics report
+    # close out the plot to safely free the object.
+    pctl.ClosePlot()
 
-  rptfn = pctl.GetPlotDirName() + 'drill_report.rpt'
-  drlwriter.GenDrillReportFile( rptfn );
+    write_drill_files(board, plot_dir_name)
 
   # rename the drill and outline files
 
   path = os.path.join(plot_dir,projname)
-  call(['gerbv','-x','rs274x',path+'-drl_map.gbr',path+'-Dwgs.User.gbr',path+'-Edge.Cuts.gm1','-o',path+'-FabNotes.gbr'])
-  call(['rm',path+'-Dwgs.User.gbr',path+'-drl_map.gbr'])
-  call(['mv',path+'-Edge.Cuts.gm1',path+'-Edge.Cuts.gko'])
-  call(['mv',path+'.drl',path+'.xln'])
+  kfgerber.merge_gerbers([path+'-drl_map.gbr',path+'-Dwgs.User.gbr',path+'-Edge.Cuts.gm1'],path+'-FabNotes.gbr')
+  os.remove(path+'-Dwgs.User.gbr')
+  os.remove(path+'-drl_map.gbr')
+  os.rename(path+'-Edge.Cuts.gm1',path+'-Edge.Cuts.gko')
+  os.rename(path+'.drl',path+'.xln')
 
 ##########################################################
 #
@@ -585,45 +847,36 @@ def plot_gerbers_and_drills(projname, plot_dir):
 #  - name of a subdirectory to put output files
 #
 # what it does:
-# - open the board outline file (ends in .gko)
-#   which is in KiCad export format
-# - calculate the size of the board outline
+# - reads the board outline file (ends in .gko) with
+#   kfgerber, following its format and units and
+#   including arc bulges, so round boards work too
+# - calculate the size, area and perimeter of the
+#   board outline
+# - sizes the preview images to the outline including
+#   its line width, which is what they're fitted to
 #
 # returns:
 # - a list in format:
 #   [width (inch), height (inch),      # actual board
 #    width (mm), height (mm),          # actual board
-#    width (pixels), height (pixels)]  # preview images
-#
-# Note: the code in this section is derived from Wayne
-# and Layne's script to get Gerber file outer dimensions,
-# which is public domain. > wayneandlayne.com, accessed 2016
-#
-# TODO: handle circle boards!
+#    width (pixels), height (pixels),  # preview images
+#    area (sq mm), perimeter (mm)]     # actual board
 #
 ###########################################################
 
+@profiled
 def get_board_size(projname,plot_dir):
 
   fp = os.path.join(plot_dir,projname+'-Edge.Cuts.gko')
 
-  xmin = None
-  xmax = None
-  ymin = None
-  ymax = None
-  with open(fp, 'r') as f:
-    for line in f:
-      results = re.search("^X([\d-]+)Y([\d-]+)", line.strip())
-      if results:
-        x = int(results.group(1))
-        y = int(results.group(2))
-        xmin = min(xmin, x) if xmin else x
-        xmax = max(xmax, x) if xmax else x
-        ymin = min(ymin, y) if ymin else y
-        ymax = max(ymax, y) if ymax else y
-
-  x = (xmax-xmin)/1000000.0
-  y = (ymax-ymin)/1000000.0
+  outline = kfgerber.outline_geometry(fp)
+  if outline is None:
+    print("No board outline in "+fp+", can't continue.")
+    exit()
+
+  xmin, ymin, xmax, ymax = outline['bbox']
+  x = xmax-xmin
+  y = ymax-ymin
 
   width_mm = '%.2f' % x
   height_mm = '%.2f' % y
@@ -632,21 +885,20 @@ def get_board_size(projname,plot_dir):
   height_in = '%.2f' % float(y*0.03937)
   print(width_in, height_in)
 
-  if x is 0 or y is 0:
-    print("This may be a circular board, can't deal with it yet.")
-    print("can't continue.")
-    exit()
+  xmin, ymin, xmax, ymax = outline['ink_bbox']
+  dim_ratio = (xmax-xmin)/(ymax-ymin)
+
+  if dim_ratio > 1:
+    scaled_w = PREVIEW_LONG_EDGE
+    scaled_h = int(scaled_w/dim_ratio)
   else:
-    dim_ratio = x/y
+    scaled_h = PREVIEW_LONG_EDGE
+    scaled_w = int(scaled_h*dim_ratio)
 
-    if x > y:
-      scaled_w = 700
-      scaled_h = int(scaled_w/dim_ratio)
-    else:
-      scaled_h = 700
-      scaled_w = int(scaled_h*dim_ratio)
+  area = '%.2f' % outline['area']
+  perimeter = '%.2f' % outline['perimeter']
 
-    ret_list = [width_in,height_in,width_mm,height_mm,scaled_w,scaled_h]
+  ret_list = [width_in,height_in,width_mm,height_mm,scaled_w,scaled_h,area,perimeter]
 
   return ret_list
 
@@ -672,11 +924,87 @@ def get_board_size_string(board_dims):
   height_mm = board_dims[3]
   width_pixels = board_dims[4]
   height_pixels = board_dims[5]
+  area = board_dims[6]
+  perimeter = board_dims[7]
 
   boardsize = '\nBoard size is '+width_in+' x '+height_in+' inches (' \
-        +width_mm+' x '+height_mm+' mm)'
+        +width_mm+' x '+height_mm+' mm), area '+area+' sq mm, perimeter ' \
+        +perimeter+' mm'
   return boardsize
 
+###########################################################
+#
+#                  get_preview_sizes
+#
+# inputs:
+# - data object
+#
+# what it does:
+# - reads the comma-separated 'preview_sizes' value from
+#   proj.json, ex: "160,700,2400", the long edge in pixels
+#   of each board side
+# - always includes the 700 pixel size of preview.png,
+#   which the README and PDF use
+#
+# returns:
+# - sorted list of sizes, ex: [160, 700, 2400]
+#
+###########################################################
+
+PREVIEW_LONG_EDGE = 700
+
+def get_preview_sizes(data):
+
+  setting = data.get('preview_sizes') or kfconfig.default_preview_sizes
+  sizes = set([PREVIEW_LONG_EDGE])
+
+  for size in setting.split(','):
+    size = size.strip()
+    if not size:
+      continue
+    if not size.isdigit() or int(size) < 1:
+      print("\nERROR! '"+size+"' in preview_sizes isn't a size in pixels, ex: \"160,700,2400\"\n")
+      exit()
+    sizes.add(int(size))
+
+  return sorted(sizes)
+
+def preview_filename(size):
+  if size == PREVIEW_LONG_EDGE:
+    return 'preview.png'
+  return 'preview-%d.png' % size
+
+###########################################################
+#
+#                       save_png
+#
+# inputs:
+# - image array from kfgerber
+# - file name
+# - optional (width, height) to scale it to first
+#
+# what it does:
+# - writes the PNG, downscaling with the Lanczos filter
+#   if a size is given; PIL is imported here rather than
+#   at startup, so commands that make no images don't
+#   need it
+#
+# returns nothing
+#
+###########################################################
+
+def save_png(pixels, filename, size=None):
+
+  try:
+    from PIL import Image
+  except ImportError:
+    import Image
+
+  img = Image.fromarray(pixels)
+  if size and size != img.size:
+    img = img.resize(size, getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS)
+  img.save(filename)
+
 ###########################################################
 #
 #            create_assembly_diagrams
@@ -693,72 +1021,56 @@ def get_board_size_string(board_dims):
 #  - width of board in pixels
 #
 # what it does:
-# - uses gerbv to export F.Assembly and B.Assembly images
-# - remove empty layers
+# - draws F.Fab and B.Fab with kfgerber, fitted to the
+#   board outline so both sides share one scale
+# - skips empty layers
+# - merges each Fab layer with the outline into a .gba
+#   and draws the two together
 # - create the output file from non-empty layers,
 #   stitching them together side by side depending
-#   on whether the images are portrait or landscape
+#   on whether the images are portrait or landscape,
+#   all in memory so assembly.png is written once
+# - if both are empty, assembly.png is just the outline
+# - the Fab gerbers are left in place for the next
+#   build; the zips leave them out
 #
 # returns nothing
 #
 ###########################################################
 
+@profiled
 def create_assembly_diagrams(projname,plotdir,width,height):
 
-  width = str(width)
-  height = str(height)
+  outline = plotdir+'/'+projname+'-Edge.Cuts.gko'
+  sides = [('top', plotdir+'/'+projname+'-F.Fab.gbr', plotdir+'/'+projname+'-F.Assembly.gba'),
+           ('bottom', plotdir+'/'+projname+'-B.Fab.gbr', plotdir+'/'+projname+'-B.Assembly.gba')]
 
   # test if there are any non-outline assembly markings on the Fab layers
-  # delete the empty layers
-
-  call(['gerbv','-x','png',plotdir+'/'+projname+'-F.Fab.gbr','-b#ffffff','-f#000000','-w',width+'x'+height,'-o','assembly-top.png'])
-  call(['gerbv','-x','png',plotdir+'/'+projname+'-B.Fab.gbr','-b#ffffff','-f#000000','-w',width+'x'+height,'-o','assembly-bottom.png'])
-
-  img = Image.open('assembly-top.png')
-  extrema = img.convert("L").getextrema()
-  if extrema[0] == extrema[1]:
-    call(['rm','assembly-top.png'])
-  img = Image.open('assembly-bottom.png')
-  extrema = img.convert("L").getextrema()
-  if extrema[0] == extrema[1]:
-    call(['rm','assembly-bottom.png'])
-
-  if os.path.isfile('assembly-top.png'):
-    call(['gerbv','-x','rs274x',plotdir+'/'+projname+'-F.Fab.gbr',plotdir+'/'+projname+'-Edge.Cuts.gko','-o',plotdir+'/'+projname+'-F.Assembly.gba'])
-    call(['gerbv','-x','png',plotdir+'/'+projname+'-F.Assembly.gba','-b#ffffff','-f#000000','-w',width+'x'+height,'-o','assembly-top.png'])
-#    call(['convert','assembly-top.png','-background','White','label:'+data['title']+' v'+data['version']+' Assembly Diagram Top View','+swap','-gravity','Center','-append','assembly-top.png'])
-    call(['convert','assembly-top.png','-bordercolor','White','-border','1x10','assembly-top.png'])
-
-  if os.path.isfile('assembly-bottom.png'):
-    call(['gerbv','-x','rs274x',plotdir+'/'+projname+'-B.Fab.gbr',plotdir+'/'+projname+'-Edge.Cuts.gko','-o',plotdir+'/'+projname+'-B.Assembly.gba'])
-    call(['gerbv','-x','png',plotdir+'/'+projname+'-B.Assembly.gba','-b#ffffff','-f#000000','-w',width+'x'+height,'-o','assembly-bottom.png'])
-    call(['convert','assembly-bottom.png','-flop','assembly-bottom.png'])
-#    call(['convert','assembly-bottom.png','-background','White','label:'+data['title']+' v'+data['version']+' Assembly Diagram Bottom View','-gravity','Center','-append','assembly-bottom.png'])
-    call(['convert','assembly-bottom.png','-bordercolor','White','-border','1x10','assembly-bottom.png'])
-
-  call(['rm',plotdir+'/'+projname+'-F.Fab.gbr',plotdir+'/'+projname+'-B.Fab.gbr'])
-
-  # create preview.png file from one or both
-  f1 = os.path.isfile('assembly-top.png')
-  f2 = os.path.isfile('assembly-bottom.png')
-
-  if f1 is True and f2 is True:
-    new_w = str(int(width) + 20)
-    new_h = str(int(height) + 20)
-
-    if width > height:
-      call(['convert','assembly-top.png','-bordercolor','white','-extent',width+'x'+new_h,'assembly-top.png'])
-      call(['convert','assembly-top.png','assembly-bottom.png','-append','assembly.png'])
-    else:
-      call(['convert','assembly-top.png','-bordercolor','white','-extent',new_w+'x'+height,'assembly-top.png'])
-      call(['convert','assembly-top.png','assembly-bottom.png','+append','assembly.png'])
-    call(['rm','assembly-top.png','assembly-bottom.png'])
-  elif f1 is True:
-    call(['mv','assembly-top.png','assembly.png'])
-  elif f2 is True:
-    call(['mv','assembly-bottom.png','assembly.png'])
+  # and only draw the ones that have some
+
+  images = []
+  for side, fab, gba in sides:
+    if kfgerber.gerber_is_empty(fab):
+      continue
+
+    kfgerber.merge_gerbers([fab, outline], gba)
+    art = kfgerber.render_line_art([fab, outline], outline, width, height)
+    if side == 'bottom':
+      art = art[:, ::-1]
+    images.append(kfgerber.pad_image(art, 10, 1))
+
+  # create assembly.png from one or both, stacked for
+  # landscape boards and side by side for portrait ones
+
+  if len(images) == 2:
+    save_png(kfgerber.stitch_images(images[0], images[1], width > height, 0), 'assembly.png')
+  elif images:
+    save_png(images[0], 'assembly.png')
   else:
-    print ("no assembly diagrams.")
+    # the README links to assembly.png, so draw the bare outline
+    print ("no assembly diagrams, drawing the board outline.")
+    art = kfgerber.render_line_art([outline], outline, width, height)
+    save_png(kfgerber.pad_image(art, 10, 1), 'assembly.png')
 
 
 ###########################################################
@@ -771,252 +1083,1060 @@ def create_assembly_diagrams(projname,plotdir,width,height):
 #  - name of a subdirectory to put output files
 #  - height of board in pixels
 #  - width of board in pixels
+#  - list of long edge sizes from get_preview_sizes
 #
 # what it does:
-# - create GerbV .gvp project file
-# - create the composite top image in GerbV
-# - use ImageMagick to flip the bottom-side images
-#   because GerbV command line doesn't support mirroring.
-# - create composite bottom image in GerbV
+# - hashes the gerbers; if every size was already made
+#   from the same gerbers, copies them out of
+#   kfconfig.cache_dir/previews and stops there
+# - otherwise draws the top and bottom composites with
+#   kfgerber, once, at the largest size: soldermask,
+#   copper in the mask openings, silk, the outline and
+#   drills, fitted to the board outline
+# - mirrors the bottom-side image so it reads as seen
+#   from below
 # - merge the two images depending on whether they're
 #   oriented as portraits or landscapes
+# - scales that down to each size, writing preview.png
+#   for the 700 pixel one and preview-<size>.png for
+#   the rest, and caches them
 #
-# inpired by this code for the one liner
-# - https://github.com/lukeweston/eagle-makefile/blob/master/makefile
-#
-# inspired by this code for the project-based solution
+# layer colors follow the old GerbV project files, inspired
+# by this code for the project-based solution
 # - https://gist.github.com/docprofsky/70b718b434d7d184c59729263d436a3d#file-heliopsis-gvp
 #
 ###########################################################
 
-def create_image_previews(projname,plotdir,width_pixels,height_pixels):
+@profiled
+def create_image_previews(projname,plotdir,width_pixels,height_pixels,sizes=(PREVIEW_LONG_EDGE,)):
 
-  width_pixels = str(width_pixels)
-  height_pixels = str(height_pixels)
+  path = os.path.join(plotdir,projname)
+  top_layers = [path+'-F.Cu.gtl',path+'-F.Mask.gts',path+'-F.SilkS.gto',path+'-Edge.Cuts.gko',path+'.xln']
+  bottom_layers = [path+'-B.Cu.gbl',path+'-B.Mask.gbs',path+'-B.SilkS.gbo',path+'-Edge.Cuts.gko',path+'.xln']
 
-  # top side
+  # the width and height are for PREVIEW_LONG_EDGE; the
+  # render is done at the largest size and scaled down
+  largest = max(sizes)
+  scale = float(largest)/max(width_pixels,height_pixels)
+  render_w = int(round(width_pixels*scale))
+  render_h = int(round(height_pixels*scale))
 
-  projfile = 'top.gvp'
-  cwd = os.getcwd()
+  sha = hashlib.sha1(('%d %d\n' % (render_w, render_h)).encode('utf-8'))
+  for layer in top_layers + bottom_layers:
+    sha.update((hash_file(layer) if os.path.isfile(layer) else '').encode('utf-8'))
+  key = sha.hexdigest()
 
-  with open(plotdir+'/'+projfile,'w') as pf:
-    pf.write("(gerbv-file-version! \"2.0A\")\n")
-    pf.write("(define-layer! 4 (cons \'filename \""+projname+"-F.Cu.gtl\")(cons \'visible #t)(cons \'color #(59110 51400 0)))\n")
-    pf.write("(define-layer! 3 (cons \'filename \""+projname+"-F.Mask.gts\")(cons \'inverted #t)(cons \'visible #t)(cons \'color #(21175 0 23130)))\n")
-    pf.write("(define-layer! 2 (cons \'filename \""+projname+"-F.SilkS.gto\")(cons \'visible #t)(cons \'color #(65535 65535 65535)))\n")
-    pf.write("(define-layer! 1 (cons \'filename \""+projname+"-Edge.Cuts.gko\")(cons \'visible #t)(cons \'color #(0 0 0)))\n")
-    pf.write("(define-layer! 0 (cons \'filename \""+projname+".xln\")(cons \'visible #t)(cons \'color #(0 0 0))(cons \'attribs (list (list \'autodetect \'Boolean 1) (list \'zero_supression \'Enum 1) (list \'units \'Enum 0) (list \'digits \'Integer 4))))\n")
-    pf.write("(define-layer! -1 (cons \'filename \""+cwd+"\")(cons \'visible #f)(cons \'color #(0 0 0)))\n")
-    pf.write("(set-render-type! 3)")
-
-  call(['gerbv','-x','png','--project',plotdir+'/'+projfile,'-w',width_pixels+'x'+height_pixels,'-o','preview-top.png','-B=0'])
-  #call(['convert','preview-top.png','-bordercolor','White','-border','10x10','test.png'])
-  call(['convert','preview-top.png','-fill','White','-draw','color 1,1 floodfill','preview-top.png'])
-  call(['convert','preview-top.png','-fill','Black','-opaque','#E2DCB1','preview-top.png']) # fill most of drill circles
-  call(['convert','preview-top.png','-fill','Black','-opaque','#B1B1B1','preview-top.png']) # clean up drill circle edge
-  call(['convert','preview-top.png','-fill','Black','-opaque','#F6F4E7','preview-top.png']) # clean up extra copper ring
-  call(['rm',plotdir+'/top.gvp'])
-
-  # bottom side
-
-  projfile = 'bottom.gvp'
-  cwd = os.getcwd()
-  print(cwd)
-
-  with open(plotdir+'/'+projfile,'w') as pf:
-    pf.write("(gerbv-file-version! \"2.0A\")\n")
-    pf.write("(define-layer! 4 (cons \'filename \""+projname+"-B.Cu.gbl\")(cons \'visible #t)(cons \'color #(59110 51400 0)))\n")
-    pf.write("(define-layer! 3 (cons \'filename \""+projname+"-B.Mask.gbs\")(cons \'inverted #t)(cons \'visible #t)(cons \'color #(21175 0 23130)))\n")
-    pf.write("(define-layer! 2 (cons \'filename \""+projname+"-B.SilkS.gbo\")(cons \'visible #t)(cons \'color #(65535 65535 65535)))\n")
-    pf.write("(define-layer! 1 (cons \'filename \""+projname+"-Edge.Cuts.gko\")(cons \'visible #t)(cons \'color #(0 0 0)))\n")
-    pf.write("(define-layer! 0 (cons \'filename \""+projname+".xln\")(cons \'visible #t)(cons \'color #(0 0 0))(cons \'attribs (list (list \'autodetect \'Boolean 1) (list \'zero_supression \'Enum 1) (list \'units \'Enum 0) (list \'digits \'Integer 4))))\n")
-    pf.write("(define-layer! -1 (cons \'filename \""+cwd+"\")(cons \'visible #f)(cons \'color #(0 0 0)))\n")
-    pf.write("(set-render-type! 0)")
-
-  call(['gerbv','-x','png','--project',plotdir+'/'+projfile,'-w',width_pixels+'x'+height_pixels,'-o','preview-bottom.png','-B=0'])
-  call(['convert','preview-bottom.png','-flop','preview-bottom.png'])
-  call(['convert','preview-bottom.png','-fill','White','-draw','color 1,1 floodfill','preview-bottom.png'])
-  call(['convert','preview-bottom.png','-fill','Black','-opaque','#E2DCB1','preview-bottom.png']) # fill most of drill circles
-  call(['convert','preview-bottom.png','-fill','Black','-opaque','#B1B1B1','preview-bottom.png']) # clean up drill circle edge
-  call(['convert','preview-bottom.png','-fill','Black','-opaque','#F6F4E7','preview-bottom.png']) # clean up extra copper ring
-  call(['rm',plotdir+'/bottom.gvp'])
-
-  # create stitched-together previews based on whether they're portrait or landscape
-
-  new_w = str(int(width_pixels) + 20)
-  new_h = str(int(height_pixels) + 20)
-
-  if width_pixels > height_pixels:
-    call(['convert','preview-top.png','-bordercolor','white','-extent',width_pixels+'x'+new_h,'preview-top.png'])
-    call(['convert','preview-top.png','preview-bottom.png','-append','preview.png'])
-  else:
-    call(['convert','preview-top.png','-bordercolor','white','-extent',new_w+'x'+height_pixels,'preview-top.png'])
-    call(['convert','preview-top.png','preview-bottom.png','+append','preview.png'])
+  preview_dir = os.path.join(kfconfig.cache_dir,'previews')
+  cached = dict([(size, os.path.join(preview_dir, '%s-%d.png' % (key, size))) for size in sizes])
+
+  missing = [size for size in sizes if not os.path.isfile(cached[size])]
+
+  if missing:
 
-  # cleanup
+    # top side
 
-  call(['rm','preview-top.png','preview-bottom.png'])
+    top = kfgerber.render_board_side(*(top_layers+[render_w,render_h]))
+
+    # bottom side, mirrored
+
+    bottom = kfgerber.render_board_side(*(bottom_layers+[render_w,render_h]))
+    bottom = bottom[:, ::-1]
+
+    # stitch them together based on whether they're portrait or landscape
+
+    preview = kfgerber.stitch_images(top, bottom, width_pixels > height_pixels, int(round(20*scale)))
+    full_h, full_w = preview.shape[:2]
+
+    if not os.path.exists(preview_dir):
+      os.makedirs(preview_dir)
+
+    for size in missing:
+      scaled = (max(1, int(round(full_w*float(size)/largest))),
+                max(1, int(round(full_h*float(size)/largest))))
+      temp = os.path.join(preview_dir, '%s-%d-temp.png' % (key, size))
+      save_png(preview, temp, scaled)
+      os.rename(temp, cached[size])
+
+  for size in sizes:
+    copyfile(cached[size], preview_filename(size))
+
+  # drop the previews of older gerbers and sizes no longer asked for
+  keep = set(cached.values())
+  for old in glob.glob(os.path.join(preview_dir,'*.png')):
+    if old not in keep:
+      os.remove(old)
 
 ###########################################################
 #
-#           create_component_list_from_netlist
+#                   iter_sexp_tokens
 #
 # inputs:
-# - data object
+# - an open KiCad s-expression file, ex: projname.net
 #
 # what it does:
-# - opens the netlist file
-# - for every line in the netlist, create a component line
-#   there is no handling of duplicate entries; this is a
-#   raw list right from the netlist.
+# - reads the file one line at a time and splits it into
+#   open parens, close parens and atoms
+# - quoted atoms have their quotes and escapes removed,
+#   and may run across several lines
 #
-# returns:
-# - json object of every part on the board listed by refdes
+# yields:
+# - SEXP_OPEN, SEXP_CLOSE or the atom string
 #
 ###########################################################
 
-def create_component_list_from_netlist(data):
-
-  netfile_name = data['projname']+'.net'
-
-  components_from_json = []
-
-  comp_flag = False
-  comp_count = 0
-  fields_flag = False
-
-  if not os.path.exists(netfile_name):
-    print("\nERROR! Netfile doesn't exist. Did you export it from the schematic?")
-    print("--> Leaving the program without creating bill of materials.\n")
-    exit()
+SEXP_OPEN = object()
+SEXP_CLOSE = object()
 
-  net_json = []
-  net_json.append('[\n  ')
-  first_flag = True
-
-  with open(netfile_name,'r') as netfile:
-    for line in netfile:
-      if '(components' in line:
-        comp_flag = True
-      if '(libparts' in line:
-        comp_flag = False
-
-      if comp_flag is True:
-        if '(ref ' in line:
-          if not first_flag:
-            net_json.append(',\n')
-          first_flag = False
-          line = line.replace(')','').replace('\n','').replace('(comp (ref ','').lstrip(' ')
-          line = '     {\n        "ref":"'+line+'",'
-          net_json.append(line)
-        if '(value ' in line:
-          line = line.replace(')','').replace('\n','').replace('"','')
-          line = line.replace('(value ','').lstrip(' ')
-          line = '        "value":"'+line+'",'
-          net_json.append(line)
-        if '(footprint ' in line:
-          line = line.replace(')','').replace('\n','').replace('(footprint ','').lstrip(' ')
-          splitline = line.split(':')
-          if splitline[0]:
-            net_json.append('        "footprint_lib":"'+splitline[0]+'",')
-          if splitline[1]:
-            net_json.append('        "footprint":"'+splitline[1]+'",')
-        if '(datasheet ' in line:
-          line = line.replace(')','').replace('"','').replace('\n','').replace('(datasheet ','').lstrip(' ')
-          net_json.append('        "datasheet":"'+line+'",')
-        if '(field (name ' in line:
-          line = line.replace(') ',':').replace('\n','').replace('(field (name ','').lstrip('  ')
-          line = line.replace('"','').strip('))')
-          splitline = line.split(':')
-          net_json.append('        "'+splitline[0].lower()+'":"'+splitline[1]+'",')
-        if '(libsource (lib ' in line:
-          line = line.replace(') ',':').replace('\n','').replace('(libsource (lib ','').lstrip('  ')
-          line = line.replace('(part ','').strip('))')
-          splitline = line.split(':')
-          net_json.append('        "symbol_lib":"'+splitline[0]+'",')
-          net_json.append('        "symbol":"'+splitline[1]+'"')
-          net_json.append('      }')
-
-  net_json.append('\n]')
-
-  net_json_path = data['projname']+'-parts.json'
-
-  with open(net_json_path,'w') as parts_json:
-    for line in net_json:
-      parts_json.write(line+'\n')
-
-  if os.path.isfile(net_json_path):
-    print(net_json_path)
-    with open(net_json_path) as jfile:
-      components_from_json = json.load(jfile)
+# one match is one token: '(' or ')' or "quoted atom" or bare atom
+SEXP_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+SEXP_ESCAPE = re.compile(r'\\(.)')
 
-  else:
-    print("Something went wrong when converting the netlist to a json file.")
-    exit()
+def iter_sexp_tokens(sexpfile):
 
-  os.remove(net_json_path)
+  pending = ''
 
-  # create components list of Comp() objects
-  components = []
+  for line in sexpfile:
+    if pending:
+      line = pending + line
+    pos = 0
 
-  for c in components_from_json:
+    while True:
+      match = SEXP_TOKEN.match(line, pos)
+      if match is None:
+        break
+      pos = match.end()
 
-    new_comp = Comp()
-    for key, value in c.iteritems():
-      if key == 'ref':
-        new_comp.ref = c['ref']
-      if key == 'value':
-        new_comp.value = c['value']
-      if key == 'footprint_lib':
-        new_comp.fp_lib = c['footprint_lib']
-      if key == 'footprint':
-        new_comp.footprint = c['footprint']
-      if key == 'symbol_lib':
-        new_comp.sym_lib = c['symbol_lib']
-      if key == 'symbol':
-        new_comp.symbol = c['symbol']
-      if key == 'datasheet':
-        new_comp.datasheet = c['datasheet']
-      if key == 'description':
-        new_comp.description = c['description']
-      if key == 'mf_name':
-        new_comp.mf_name = c['mf_name']
-      if key == 'mf_pn':
-        new_comp.mf_pn = c['mf_pn']
-      if key == 's1_name':
-        new_comp.s1_name = c['s1_name']
-      if key == 's1_pn':
-        new_comp.s1_pn = c['s1_pn']
-      if key == 'type':
-        new_comp.thsmt = c['type']
-      if key == 'xsize_mils':
-        new_comp.xsize_mils = c['xsize_mils']
-      if key == 'ysize_mils':
-        new_comp.ysize_mils = c['ysize_mils']
-
-    #new_comp.print_component()
-    components.append(new_comp)
+      if match.group(1):
+        yield SEXP_OPEN
+      elif match.group(2):
+        yield SEXP_CLOSE
+      elif match.group(4) is not None:
+        yield match.group(4)
+      elif '\\' in match.group(3):
+        yield SEXP_ESCAPE.sub(r'\1', match.group(3))
+      else:
+        yield match.group(3)
 
-    new_comp.print_component()
+    # whatever is left is whitespace or a quoted atom
+    # that continues on the next line
+    pending = line[pos:]
+    if not pending.strip():
+      pending = ''
 
-  return components
+  if pending:
+    raise ValueError('unterminated quoted string in s-expression file')
 
 ###########################################################
 #
-#             create_bill_of_materials
+#                   read_sexp_list
 #
 # inputs:
-# - data object
+# - token iterator from iter_sexp_tokens, positioned just
+#   after the SEXP_OPEN of the list to read
 #
 # what it does:
-# - remove all existing bom files in that directory
-# - create a components list organized by refdes
+# - consumes tokens up to and including the matching
+#   SEXP_CLOSE
+#
+# returns:
+# - the list as nested python lists of strings,
+#   ex: ['field', ['name', 'MF_PN'], 'ESR03EZPJ471']
+#
+###########################################################
+
+def read_sexp_list(tokens):
+
+  items = []
+  for tok in tokens:
+    if tok is SEXP_OPEN:
+      items.append(read_sexp_list(tokens))
+    elif tok is SEXP_CLOSE:
+      return items
+    else:
+      items.append(tok)
+
+  raise ValueError('unexpected end of s-expression file')
+
+###########################################################
+#
+#                  comp_from_netlist_sexp
+#
+# inputs:
+# - one (comp ...) list as returned by read_sexp_list
+#
+# what it does:
+# - copies the ref, value, footprint, datasheet, symbol
+#   and the known user fields into a new Comp()
+# - keeps any other user fields in Comp().fields under
+#   their schematic name
+#
+# returns:
+# - the Comp() object
+#
+###########################################################
+
+# lowercased schematic field name -> Comp() attribute
+NETLIST_FIELDS = {
+  'description': 'description',
+  'mf_name':     'mf_name',
+  'mf_pn':       'mf_pn',
+  's1_name':     's1_name',
+  's1_pn':       's1_pn',
+  'type':        'thsmt',
+  'xsize_mils':  'xsize_mils',
+  'ysize_mils':  'ysize_mils',
+}
+
+def comp_from_netlist_sexp(item):
+
+  new_comp = Comp()
+
+  for child in item[1:]:
+    if not isinstance(child, list) or len(child) < 2:
+      continue
+    key = child[0]
+
+    if key == 'ref':
+      new_comp.ref = child[1]
+    elif key == 'value':
+      new_comp.value = child[1]
+    elif key == 'footprint':
+      # ex: Wickerlib:RLC-0603-SMD
+      fp_lib, sep, footprint = child[1].partition(':')
+      if sep:
+        new_comp.fp_lib = fp_lib
+        new_comp.footprint = footprint
+      else:
+        new_comp.footprint = fp_lib
+    elif key == 'datasheet':
+      new_comp.datasheet = child[1]
+    elif key == 'fields':
+      # ex: (field (name MF_PN) ESR03EZPJ471)
+      for field in child[1:]:
+        if len(field) < 2 or len(field[1]) < 2:
+          continue
+        name = field[1][1]
+        value = field[2] if len(field) > 2 else ''
+        attr = NETLIST_FIELDS.get(name.lower())
+        if attr:
+          setattr(new_comp, attr, value)
+        else:
+          new_comp.fields[name] = value
+    elif key == 'libsource':
+      # ex: (libsource (lib wickerlib) (part RES-470-5%-1/4W-0603))
+      for source in child[1:]:
+        if len(source) < 2:
+          continue
+        if source[0] == 'lib':
+          new_comp.sym_lib = source[1]
+        elif source[0] == 'part':
+          new_comp.symbol = source[1]
+
+  return new_comp
+
+###########################################################
+#
+#                    iter_components
+#
+# inputs:
+# - an open netlist file in KiCad (export ...) format
+#
+# what it does:
+# - streams tokens until it reaches (components ...)
+# - builds one Comp() per (comp ...) entry, holding only
+#   that one entry in memory at a time
+# - stops reading at the end of the components section,
+#   so (libparts ...) and (nets ...) are never parsed
+#
+# yields:
+# - one Comp() object per schematic component
+#
+###########################################################
+
+def iter_components(netfile):
+
+  tokens = iter_sexp_tokens(netfile)
+  depth = 0
+
+  for tok in tokens:
+    if tok is SEXP_OPEN:
+      depth += 1
+
+      # sections are the direct children of (export ...)
+      if depth == 2 and next(tokens, None) == 'components':
+        for tok in tokens:
+          if tok is SEXP_CLOSE:
+            return
+          if tok is SEXP_OPEN:
+            item = read_sexp_list(tokens)
+            if item and item[0] == 'comp':
+              yield comp_from_netlist_sexp(item)
+        return
+
+    elif tok is SEXP_CLOSE:
+      depth -= 1
+
+###########################################################
+#
+#                      hash_file
+#
+# inputs:
+# - file path
+#
+# what it does:
+# - reads the file in 1 MB chunks into a sha1 hash
+#
+# returns:
+# - the hex digest string
+#
+###########################################################
+
+def hash_file(path):
+
+  sha = hashlib.sha1()
+  with open(path,'rb') as f:
+    chunk = f.read(1<<20)
+    while chunk:
+      sha.update(chunk)
+      chunk = f.read(1<<20)
+
+  return sha.hexdigest()
+
+###########################################################
+#
+#                 read_netlist_cache
+#
+# inputs:
+# - netlist file path
+# - cache file path
+#
+# what it does:
+# - loads the cached parse if there is one
+# - checks it against the netlist's size and mtime,
+#   then falls back to its sha1 if only the mtime moved,
+#   saving the new mtime when the sha1 still matches
+#
+# returns:
+# - list of Comp() objects, or None if the cache is
+#   missing, unreadable or out of date
+#
+###########################################################
+
+# bump this whenever Comp() or the parser changes
+NETLIST_CACHE_VERSION = 1
+
+def read_netlist_cache(netfile_name, cache_file):
+
+  if not os.path.isfile(cache_file):
+    return None
+
+  try:
+    with open(cache_file,'rb') as f:
+      cache = pickle.load(f)
+  except Exception:
+    return None
+
+  if cache.get('version') != NETLIST_CACHE_VERSION or \
+     cache.get('slots') != Comp.__slots__:
+    return None
+
+  st = os.stat(netfile_name)
+  if cache['size'] != st.st_size:
+    return None
+  if cache['mtime'] != st.st_mtime:
+    if cache['sha1'] != hash_file(netfile_name):
+      return None
+
+    # same contents, just touched; store the new mtime so
+    # the next run can skip the hash again
+    cache['mtime'] = st.st_mtime
+    try:
+      with open(cache_file+'.tmp','wb') as f:
+        pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+      os.rename(cache_file+'.tmp', cache_file)
+    except (IOError, OSError):
+      pass
+
+  components = []
+  for row in cache['rows']:
+    new_comp = Comp()
+    for attr, value in zip(Comp.__slots__, row):
+      setattr(new_comp, attr, value)
+    components.append(new_comp)
+
+  return components
+
+###########################################################
+#
+#                 write_netlist_cache
+#
+# inputs:
+# - netlist file path
+# - cache file path
+# - list of Comp() objects parsed from the netlist
+#
+# what it does:
+# - stores the netlist size, mtime and sha1 and one
+#   tuple per component in a binary pickle
+# - writes to a temporary file and renames it so a
+#   crash never leaves a half-written cache behind
+#
+# returns nothing
+#
+###########################################################
+
+def write_netlist_cache(netfile_name, cache_file, components):
+
+  cache_dir = os.path.dirname(cache_file)
+  if cache_dir and not os.path.exists(cache_dir):
+    os.makedirs(cache_dir)
+
+  st = os.stat(netfile_name)
+  cache = {
+    'version': NETLIST_CACHE_VERSION,
+    'slots': Comp.__slots__,
+    'size': st.st_size,
+    'mtime': st.st_mtime,
+    'sha1': hash_file(netfile_name),
+    'rows': [tuple([getattr(c, attr) for attr in Comp.__slots__]) for c in components],
+  }
+
+  with open(cache_file+'.tmp','wb') as f:
+    pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+  os.rename(cache_file+'.tmp', cache_file)
+
+###########################################################
+#
+#                 parse_symbol_library
+#
+# inputs:
+# - path to a KiCad .lib symbol library
+#
+# what it does:
+# - reads each DEF ... ENDDEF symbol and its ALIAS names
+# - takes the datasheet (F3) and the user fields named
+#   like the netlist ones, ex: "MF_PN"
+# - fills in descriptions and datasheets from the
+#   matching .dcm file if there is one
+#
+# returns:
+# - list of dicts, one per symbol name or alias, keyed by
+#   'symbol' and the LIB_INDEX_FIELDS
+#
+###########################################################
+
+LIB_INDEX_FIELDS = ('description', 'datasheet', 'mf_name', 'mf_pn',
+                    's1_name', 's1_pn')
+
+LIB_QUOTED = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+def parse_symbol_library(lib_path):
+
+  parts = []
+  part = None
+  names = []
+
+  with open(lib_path,'r') as lib:
+    for line in lib:
+      if line.startswith('DEF '):
+        part = dict.fromkeys(LIB_INDEX_FIELDS, '')
+        names = [line.split()[1].lstrip('~')]
+      elif part is None:
+        continue
+      elif line.startswith('ALIAS '):
+        names.extend(line.split()[1:])
+      elif line.startswith('F'):
+        quoted = LIB_QUOTED.findall(line)
+        num = line[1:].split(' ',1)[0]
+        if not quoted:
+          continue
+        if num == '3':
+          part['datasheet'] = quoted[0]
+        elif len(quoted) > 1:
+          attr = NETLIST_FIELDS.get(quoted[-1].lower())
+          if attr in part:
+            part[attr] = quoted[0]
+      elif line.startswith('ENDDEF'):
+        for name in names:
+          entry = dict(part)
+          entry['symbol'] = name
+          parts.append(entry)
+        part = None
+
+  # the .dcm doc file holds descriptions and datasheet links
+  docs = {}
+  dcm_path = lib_path[:-4]+'.dcm'
+  if os.path.isfile(dcm_path):
+    name = None
+    with open(dcm_path,'r') as dcm:
+      for line in dcm:
+        if line.startswith('$CMP '):
+          name = line[5:].strip()
+          docs[name] = {}
+        elif line.startswith('$ENDCMP'):
+          name = None
+        elif name and line.startswith('D '):
+          docs[name]['description'] = line[2:].strip()
+        elif name and line.startswith('F '):
+          docs[name]['datasheet'] = line[2:].strip()
+
+  for entry in parts:
+    for key, value in docs.get(entry['symbol'], {}).items():
+      if not entry[key]:
+        entry[key] = value
+
+  return parts
+
+###########################################################
+#
+#                  get_lib_index_path
+#
+# inputs:
+# - data object
+#
+# what it does:
+# - picks the index database for the project's lib_dir,
+#   one per library dir in kfconfig.lib_index_dir
+#
+# returns:
+# - path to the sqlite file, or None if there's no lib_dir
+#
+###########################################################
+
+def get_lib_index_path(data):
+
+  lib_dir = data.get('lib_dir')
+  if not lib_dir:
+    return None
+
+  lib_dir = os.path.abspath(os.path.expanduser(lib_dir))
+  key = hashlib.sha1(lib_dir.encode('utf-8')).hexdigest()[:12]
+  return os.path.join(os.path.expanduser(kfconfig.lib_index_dir),'libindex-'+key+'.sqlite')
+
+###########################################################
+#
+#                 index_part_library
+#
+# inputs:
+# - data object
+#
+# what it does:
+# - finds every .lib file under the project's lib_dir
+# - reparses only the libraries whose .lib or .dcm mtime
+#   changed since the last run, and drops the ones that
+#   were removed
+# - stores one row per symbol in an indexed sqlite table,
+#   all inside one write transaction that waits for any
+#   other build indexing the same libraries
+#
+# returns nothing
+#
+###########################################################
+
+@profiled
+def index_part_library(data):
+
+  lib_dir = os.path.expanduser(data.get('lib_dir',''))
+  db_path = get_lib_index_path(data)
+
+  if not db_path or not os.path.isdir(lib_dir):
+    print("\nERROR! lib_dir in proj.json is not a directory: "+lib_dir)
+    exit()
+
+  if not os.path.exists(os.path.dirname(db_path)):
+    os.makedirs(os.path.dirname(db_path))
+
+  # one write transaction for the whole diff, so two builds
+  # sharing a lib_dir wait their turn instead of failing
+  conn = sqlite3.connect(db_path, timeout=600, isolation_level=None)
+  conn.execute('BEGIN IMMEDIATE')
+  conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL)')
+  conn.execute('CREATE TABLE IF NOT EXISTS parts (lib TEXT, symbol TEXT, path TEXT, ' +
+               ', '.join([f+' TEXT' for f in LIB_INDEX_FIELDS])+')')
+  conn.execute('CREATE INDEX IF NOT EXISTS parts_symbol ON parts (symbol, lib)')
+  conn.execute('CREATE INDEX IF NOT EXISTS parts_path ON parts (path)')
+
+  indexed = dict(conn.execute('SELECT path, mtime FROM files').fetchall())
+
+  lib_paths = []
+  for root, dirs, files in os.walk(lib_dir):
+    for f in files:
+      if f.endswith('.lib'):
+        lib_paths.append(os.path.join(root,f))
+
+  insert = 'INSERT INTO parts VALUES (?, ?, ?, '+', '.join(['?']*len(LIB_INDEX_FIELDS))+')'
+  updated = 0
+
+  for lib_path in lib_paths:
+    mtime = os.path.getmtime(lib_path)
+    dcm_path = lib_path[:-4]+'.dcm'
+    if os.path.isfile(dcm_path):
+      mtime = max(mtime, os.path.getmtime(dcm_path))
+
+    if indexed.get(lib_path) == mtime:
+      continue
+
+    lib = os.path.basename(lib_path)[:-4]
+    rows = [[lib, p['symbol'], lib_path] + [p[f] for f in LIB_INDEX_FIELDS]
+            for p in parse_symbol_library(lib_path)]
+
+    conn.execute('DELETE FROM parts WHERE path = ?', (lib_path,))
+    conn.executemany(insert, rows)
+    conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', (lib_path, mtime))
+    updated = updated + 1
+
+  removed = [p for p in indexed if p not in set(lib_paths)]
+  for lib_path in removed:
+    conn.execute('DELETE FROM parts WHERE path = ?', (lib_path,))
+    conn.execute('DELETE FROM files WHERE path = ?', (lib_path,))
+
+  count = conn.execute('SELECT COUNT(*) FROM parts').fetchone()[0]
+  conn.execute('COMMIT')
+  conn.close()
+
+  print('Indexed '+str(len(lib_paths))+' libraries ('+str(updated)+' updated, '+
+        str(len(removed))+' removed), '+str(count)+' symbols in '+db_path)
+
+###########################################################
+#
+#                  PartLibraryIndex
+#
+# read side of the index built by index_part_library.
+# lookup(lib, symbol) returns a dict of LIB_INDEX_FIELDS
+# or None, matching on library and symbol first and then
+# on symbol alone. the most recent lookups are kept in
+# an LRU cache since one symbol is usually shared by
+# many components.
+#
+###########################################################
+
+class PartLibraryIndex(object):
+
+  def __init__(self, db_path, cache_size=4096):
+    self.conn = sqlite3.connect(db_path)
+    self.cache = OrderedDict()
+    self.cache_size = cache_size
+    self.query = 'SELECT '+', '.join(LIB_INDEX_FIELDS)+' FROM parts WHERE symbol = ?'
+
+  def lookup(self, lib, symbol):
+    key = (lib, symbol)
+    if key in self.cache:
+      part = self.cache.pop(key)
+      self.cache[key] = part
+      return part
+
+    row = self.conn.execute(self.query+' AND lib = ?', (symbol, lib)).fetchone()
+    if row is None:
+      row = self.conn.execute(self.query, (symbol,)).fetchone()
+    part = dict(zip(LIB_INDEX_FIELDS, row)) if row else None
+
+    self.cache[key] = part
+    if len(self.cache) > self.cache_size:
+      self.cache.popitem(last=False)
+    return part
+
+  def close(self):
+    self.conn.close()
+
+###########################################################
+#
+#              enrich_components_from_library
+#
+# inputs:
+# - data object
+# - list of Comp() objects
+#
+# what it does:
+# - if the project's lib_dir has been indexed with
+#   --index-lib, fills in any empty description,
+#   datasheet, manufacturer and vendor fields from the
+#   library symbol
+#
+# returns nothing
+#
+###########################################################
+
+def enrich_components_from_library(data, components):
+
+  db_path = get_lib_index_path(data)
+  if not db_path or not os.path.isfile(db_path):
+    return
+
+  index = PartLibraryIndex(db_path)
+  filled = 0
+
+  for c in components:
+    if all([getattr(c, f) for f in LIB_INDEX_FIELDS]):
+      continue
+    part = index.lookup(c.sym_lib, c.symbol)
+    if part is None:
+      continue
+    for f in LIB_INDEX_FIELDS:
+      if not getattr(c, f) and part[f]:
+        setattr(c, f, part[f])
+        filled = filled + 1
+
+  index.close()
+  print('Filled in '+str(filled)+' empty fields from the part library index.')
+
+###########################################################
+#
+#           create_component_list_from_netlist
+#
+# inputs:
+# - data object
+# - whether to use the parse cache (default True)
+#
+# what it does:
+# - loads the components from the parse cache in
+#   kfconfig.cache_dir if the netlist hasn't changed
+# - otherwise opens the netlist file and, for every
+#   (comp ...) entry, creates a Comp() object, then
+#   saves the result to the cache.
+#   there is no handling of duplicate entries; this is
+#   a raw list right from the netlist.
+# - fills in empty fields from the part library index
+#
+# returns:
+# - list of Comp() objects for every part on the board
+#
+###########################################################
+
+@profiled
+def create_component_list_from_netlist(data, use_cache=True):
+
+  netfile_name = data['projname']+'.net'
+  cache_file = os.path.join(kfconfig.cache_dir, netfile_name+'.pickle')
+
+  if not os.path.exists(netfile_name):
+    print("\nERROR! Netfile doesn't exist. Did you export it from the schematic?")
+    print("--> Leaving the program without creating bill of materials.\n")
+    exit()
+
+  components = None
+  if use_cache:
+    components = read_netlist_cache(netfile_name, cache_file)
+    if components is not None:
+      print('Loaded '+str(len(components))+' components from the netlist cache.')
+
+  # create components list of Comp() objects
+  if components is None:
+    components = []
+
+    with open(netfile_name,'r') as netfile:
+      for new_comp in iter_components(netfile):
+        components.append(new_comp)
+        new_comp.print_component()
+
+    if use_cache:
+      write_netlist_cache(netfile_name, cache_file, components)
+
+  # the cache holds the netlist as-is, library fields are
+  # filled in afterwards so a re-index takes effect
+  enrich_components_from_library(data, components)
+
+  return components
+
+###########################################################
+#
+#                get_bom_group_fields
+#
+# inputs:
+# - data object
+#
+# what it does:
+# - reads the comma-separated 'bom_group_by' value from
+#   proj.json, ex: "value,footprint,mf_pn"
+# - accepts schematic field names (MF_PN, Type) as well
+#   as Comp() attribute names
+# - defaults to grouping by symbol if it's not set
+#
+# returns:
+# - tuple of Comp() attribute names, ex: ('symbol',)
+#
+###########################################################
+
+BOM_GROUP_FIELDS = ('value', 'description', 'footprint', 'fp_lib', 'symbol',
+                    'sym_lib', 'datasheet', 'mf_name', 'mf_pn', 's1_name',
+                    's1_pn', 'thsmt')
+
+def get_bom_group_fields(data):
+
+  group_by = data.get('bom_group_by') or 'symbol'
+  group_fields = []
+
+  for f in group_by.split(','):
+    f = f.strip().lower()
+    if not f:
+      continue
+    f = NETLIST_FIELDS.get(f, f)
+    if f not in BOM_GROUP_FIELDS:
+      print("\nERROR! Can't group the BOM by '"+f+"'. Use a comma-separated list of:")
+      print(', '.join(BOM_GROUP_FIELDS)+'\n')
+      exit()
+    group_fields.append(f)
+
+  return tuple(group_fields)
+
+###########################################################
+#
+#                    compress_refs
+#
+# inputs:
+# - any iterable of reference designators,
+#   ex: ['R11', 'C2', 'LCD1', 'C1', 'R10', 'C3']
+#
+# what it does:
+# - splits each ref into prefix, number and suffix,
+#   ex: U1A is ('U', 1, 'A')
+# - sorts them once by prefix, suffix and number
+# - walks the sorted list and joins consecutive numbers
+#   with the same prefix and suffix into a range
+# - refs without a number and duplicates are kept as-is
+#   and dropped respectively
+#
+# returns:
+# - string of refs and ranges, ex: 'C1-C3 LCD1 R10-R11'
+#
+###########################################################
+
+REF_PARTS = re.compile(r'^(\D*)(\d+)(.*)$')
+
+def compress_refs(refs):
+
+  keyed = []
+  for ref in set(refs):
+    match = REF_PARTS.match(ref)
+    if match:
+      keyed.append((match.group(1), match.group(3), int(match.group(2)), ref))
+    else:
+      keyed.append((ref, '', -1, ref))
+  keyed.sort()
+
+  out_str_list = []
+  seq_start = None
+  prev = None
+
+  for key in keyed:
+
+    # extend the current sequence
+    if prev is not None and prev[2] >= 0 and key[2] == prev[2] + 1 \
+       and key[0] == prev[0] and key[1] == prev[1]:
+      prev = key
+      continue
+
+    # otherwise close it out and start a new one
+    if prev is not None:
+      if seq_start is prev:
+        out_str_list.append(prev[3])
+      else:
+        out_str_list.append(seq_start[3] + '-' + prev[3])
+    seq_start = prev = key
+
+  if prev is not None:
+    if seq_start is prev:
+      out_str_list.append(prev[3])
+    else:
+      out_str_list.append(seq_start[3] + '-' + prev[3])
+
+  return ' '.join(out_str_list)
+
+###########################################################
+#
+#                     BOM writers
+#
+# every class registered with @register_bom_writer gets
+# one output file next to the other BOM files.
+#
+# a writer is created with:
+# - the output path prefix, ex: bom/testboard-v1.2
+# - a context dict with the sorted 'vendors' list and the
+#   sorted 'extra_fields' schematic field names
+#
+# then create_bill_of_materials calls write_line(b) once
+# per BOMline and close() at the end.
+#
+# to support a new contract manufacturer, subclass
+# BOMcsvWriter with a suffix, a header and a row() and
+# register it.
+#
+###########################################################
+
+bom_writers = []
+
+def register_bom_writer(writer_class):
+  bom_writers.append(writer_class)
+  return writer_class
+
+class BOMcsvWriter(object):
+  suffix = '.csv'
+
+  def __init__(self, base_path, context):
+    self.context = context
+    self.outfile = open(base_path+self.suffix,'w')
+    self.writer = csv.writer(self.outfile, lineterminator='\n')
+    self.writer.writerow(self.header())
+
+  def header(self):
+    return []
+
+  # return a list of columns, or None to leave the line out
+  def row(self, b):
+    return None
+
+  def write_line(self, b):
+    cols = self.row(b)
+    if cols is not None:
+      self.writer.writerow(cols)
+
+  def close(self):
+    self.outfile.close()
+
+# master BOM with all possible info
+
+@register_bom_writer
+class MasterBOMWriter(BOMcsvWriter):
+  suffix = '-bom-master.csv'
+
+  def header(self):
+    return ['Ref','Qty1','Qty3','Footprint','Footprint Library','Symbol',
+            'Symbol Library','Datasheet','MF_Name','MF_PN','S1_Name','S1_PN',
+            'Type'] + self.context['extra_fields']
+
+  def row(self, b):
+    return [b.refs,b.qty,b.qty*3,b.footprint,b.fp_lib,b.symbol,b.sym_lib,
+            b.datasheet,b.mf_name,b.mf_pn,b.s1_name,b.s1_pn,b.thsmt] + \
+           [b.fields.get(name,'') for name in self.context['extra_fields']]
+
+# master BOM for reading, with descriptions instead of libraries
+
+@register_bom_writer
+class ReadableBOMWriter(BOMcsvWriter):
+  suffix = '-bom-readable.csv'
+
+  def header(self):
+    return ['Ref','Qty','Qty3','Description','MF','MF_PN','S1','S1_PN','Type']
+
+  def row(self, b):
+    return [b.refs,b.qty,b.qty*3,b.description,b.mf_name,b.mf_pn,
+            b.s1_name,b.s1_pn,b.thsmt]
+
+# Seeed Fusion PCBA
+
+@register_bom_writer
+class SeeedBOMWriter(BOMcsvWriter):
+  suffix = '-bom-seeed.csv'
+
+  def header(self):
+    return ['Location','MPN/Seeed SKU','Quantity']
+
+  def row(self, b):
+    if b.qty > 0:
+      return [b.refs,b.mf_pn,b.qty]
+
+# Tempo Automation
+
+@register_bom_writer
+class TempoBOMWriter(BOMcsvWriter):
+  suffix = '-bom-tempo.csv'
+
+  def header(self):
+    return ['Refdes','Quantity','Description','Manufacturer','MPN']
+
+  def row(self, b):
+    if b.qty > 0:
+      return [b.refs,b.qty,b.description,b.mf_name,b.mf_pn]
+
+# one csv file per vendor, ex: -bom-digikey.csv
+
+@register_bom_writer
+class VendorBOMWriter(object):
+
+  def __init__(self, base_path, context):
+    self.outfiles = []
+    self.writers = {}
+    for v in context['vendors']:
+      outfile = open(base_path+'-bom-'+v.lower()+'.csv','w')
+      writer = csv.writer(outfile, lineterminator='\n')
+      writer.writerow(['Ref','Qty','Qty3','Description',v+' PN'])
+      self.outfiles.append(outfile)
+      self.writers[v] = writer
+
+  def write_line(self, b):
+    writer = self.writers.get(b.s1_name)
+    if writer is not None and b.qty > 0:
+      writer.writerow([b.refs,b.qty,b.qty*3,b.description,b.s1_pn])
+
+  def close(self):
+    for outfile in self.outfiles:
+      outfile.close()
+
+# one readable markdown file for github with each vendor
+# given its own table, ends up in the README.md
+
+@register_bom_writer
+class ReadmeBOMWriter(object):
+
+  def __init__(self, base_path, context):
+    self.outfile_md = base_path+'-bom-readme.md'
+    self.vendors = context['vendors']
+    self.tables = {}
+    for v in self.vendors:
+      self.tables[v] = []
+
+  def write_line(self, b):
+    table = self.tables.get(b.s1_name)
+    if table is not None and b.qty > 0:
+      cols = [b.refs,str(b.qty),b.description,b.s1_pn]
+      table.append('|'+'|'.join([col.replace('|','\\|') for col in cols])+'|')
+
+  def close(self):
+    with open(self.outfile_md,'w') as obom:
+      for v in self.vendors:
+        obom.write('|Ref|Qty|Description|'+v+' PN|\n')
+        obom.write('|---|---|-----------|------|\n')
+        for line in self.tables[v]:
+          obom.write(line+'\n')
+        obom.write('\n\n')
+
+# the preliminary assembly information for quoting:
+# number of different parts, number of total placements
+
+@register_bom_writer
+class AssemblyInfoWriter(object):
+
+  def __init__(self, base_path, context):
+    self.outfile_md = base_path+'-assy-readme.md'
+    self.place_count = 0
+    self.part_count = 0
+
+  def write_line(self, b):
+    if b.qty > 0:
+      self.place_count = self.place_count + b.qty
+      self.part_count = self.part_count + 1
+
+  # write to the readable markdown file that will end up
+  # appended in the github repo README.md
+  def close(self):
+    with open(self.outfile_md,'w') as oassy:
+      oassy.write('Individual Placements per board: '+str(self.part_count)+'\n\n')
+      oassy.write('Number of Parts: '+str(self.place_count)+'\n\n')
+
+###########################################################
+#
+#             create_bill_of_materials
+#
+# inputs:
+# - data object
+# - whether to use the netlist parse cache (default True)
+#
+# what it does:
+# - remove all existing bom files in that directory
+# - create a components list organized by refdes
 # - figure out which vendors are necessary
 # - create the master BOM object made up of BOM lines
-# - create a master CSV file with all possible info
-# - create a CSV file in the Seeed format
-# - create CSV files for each vendor
-# - create one Markdown file with tables
+# - write every format in bom_writers in a single pass
+#   over the BOM lines
 #
 # returns:
 # - the list of components directly from netlist
@@ -1024,7 +2144,8 @@ def create_component_list_from_netlist(data):
 #
 ###########################################################
 
-def create_bill_of_materials(data):
+@profiled
+def create_bill_of_materials(data, use_cache=True):
 
   if not os.path.exists(data['bom_dir']):
     os.makedirs(data['bom_dir'])
@@ -1038,18 +2159,11 @@ def create_bill_of_materials(data):
   os.chdir('..')
 
   # get the components list containing Comp() objects
-  components = create_component_list_from_netlist(data)
+  components = create_component_list_from_netlist(data, use_cache)
 
-  # create output file paths
+  # create output file path prefix, each writer adds its own suffix
   bom_dir_base_path = data['bom_dir']+'/'+data['projname']+'-v'+data['version']
 
-  bom_outfile_csv          = bom_dir_base_path+'-bom-master.csv'
-  bom_outfile_readable_csv = bom_dir_base_path+'-bom-readable.csv'
-  bom_outfile_seeed_csv    = bom_dir_base_path+'-bom-seeed.csv'
-  bom_outfile_md           = bom_dir_base_path+'-bom-readme.md'
-
-  bom = []
-
   # figure out which vendors to create BOMs for
   vendors = []
   for c in components:
@@ -1060,33 +2174,41 @@ def create_bill_of_materials(data):
   vendors = set(vendors)
 
   # create the master BOM object
+  # bom keeps the lines in the order they were first seen,
+  # bom_index finds the line for a group key in one lookup
   bom = []
+  bom_index = {}
+  group_fields = get_bom_group_fields(data)
+
+  # extra master BOM columns, one per schematic field
+  # name seen on any line
+  extra_fields = set()
 
   # create all the lines of the BOM
   for c in components:
 
-    bomline = BOMline()
-
     # only proceed of this component is to be placed
     if 'th' in c.thsmt or 'smt' in c.thsmt or 'dnp' in c.thsmt:
 
       # handle parts of the same type
       # all items will have a ref (ex: C1)
-      exists_flag = False
-      if bom:
-        for line in bom:
-          if line.symbol == c.symbol:
-            line.qty = line.qty + 1
-            line.refs = line.refs + ' ' + c.ref
-            exists_flag = True
+      group_key = tuple([getattr(c, f) for f in group_fields])
+      bomline = bom_index.get(group_key)
+
+      # refs are collected in a list here and turned into
+      # a string by compress_refs once the BOM is complete
+      if bomline is not None:
+        bomline.qty = bomline.qty + 1
+        bomline.refs.append(c.ref)
 
       # if this is not a duplicate entry
       # create a new row for it
-      if exists_flag is False:
+      else:
+        bomline = BOMline()
         bomline.qty = 1
-        bomline.refs = c.ref
-        bomline.footprint_lib = c.fp_lib
-        bomline.symbol_lib = c.sym_lib
+        bomline.refs = [c.ref]
+        bomline.fp_lib = c.fp_lib
+        bomline.sym_lib = c.sym_lib
         bomline.footprint = c.footprint
         bomline.symbol = c.symbol
         bomline.datasheet = c.datasheet
@@ -1096,78 +2218,15 @@ def create_bill_of_materials(data):
         bomline.s1_name = c.s1_name
         bomline.s1_pn = c.s1_pn
         bomline.thsmt = c.thsmt
+        bomline.fields = c.fields
+        extra_fields.update(c.fields)
+        bom_index[group_key] = bomline
         bom.append(bomline)
 
+  # compress each line's refs into ranges, ex: C1-C3 C5
   for b in bom:
-
-    refs_str = b.refs
-    if 'UA1' in b.refs:
-      out_str = 'UA1-UF1'
-    else:
-      # get leading chars (could be J, could be LCD)
-      match = re.match(r"([a-z]+)([0-9]+)", refs_str, re.I)
-      if match:
-        items = match.groups()
-      lead_str = items[0]
-
-      # strip out the chars, sort
-      refs_str = refs_str.replace(lead_str,'').split(' ')
-      refs_str.sort(key=int)
-
-      # create a list of integers to make math easier
-      refs_str_ints = []
-      for num in refs_str:
-        refs_str_ints.append(int(num))
-
-      # create a styled list of integer sequences
-      out_str_list = []
-      out_str = ''
-      prev_num = refs_str_ints[0]
-      seq_start = refs_str_ints[0]
-      last_num_in_list = refs_str_ints[-1]
-
-      for num in refs_str_ints:
-
-        # if there's a gap between us and previous
-        # add it and any possible sequence to the list
-        if num != refs_str_ints[0] and num - prev_num != 1:
-
-          # it was a standalone number
-          if seq_start == prev_num:
-            out_str = str(seq_start)
-
-          # it was the end of a sequence
-          else:
-            out_str = str(seq_start) + '-' + str(prev_num)
-          out_str_list.append(out_str)
-          seq_start = num
-
-        # if this is the last number
-        # add it and any possible sequence to the list
-        if num == last_num_in_list:
-
-          # the last number was a standalone number
-          if seq_start == num:
-            out_str = str(seq_start)
-
-          # the last number was the end of a sequence
-          else:
-            out_str = str(seq_start) + '-' + str(num)
-          out_str_list.append(out_str)
-
-        # in any case, track the previous number
-        prev_num = num
-
-      # add the leading chars back in
-      result = []
-      for num in out_str_list:
-        result.append(lead_str + num)
-
-      # create the final output string
-      out_str = ' '.join(result)
-
-    b.refs = out_str
-    print(out_str)
+    b.refs = compress_refs(b.refs)
+    print(b.refs)
 
   # sort bom list by ref
   # ex: C1 C2 ~~~~
@@ -1177,120 +2236,21 @@ def create_bill_of_materials(data):
   #
   bom.sort(key=lambda x: x.refs)
 
-  # create master output string including the dynamic fields
-  # this is brute force for now
-  title_string = 'Ref,Qty1,Qty3,Footprint,Footprint Library,Symbol,Symbol Library,Datasheet'
-  title_string += ',MF_Name,MF_PN,S1_Name,S1_PN,Type\n'
-
-  # write to the master output file
-  outfile = bom_outfile_csv
-
-  with open(outfile,'w') as obom:
-    obom.write(title_string)
-    for b in bom:
-
-      q = b.qty*3
-      obom.write(b.refs+','+str(b.qty)+','+str(q)+','+b.footprint+','+b.fp_lib+','+ \
-                 b.symbol+','+b.sym_lib+','+b.datasheet)
-      obom.write(','+b.mf_name) if b.mf_name else obom.write(',')
-      obom.write(','+b.mf_pn) if b.mf_pn else obom.write(',')
-      obom.write(','+b.s1_name) if b.s1_name else obom.write(',')
-      obom.write(','+b.s1_pn) if b.s1_pn else obom.write(',')
-      obom.write(','+b.thsmt) if b.thsmt else obom.write(',')
-      obom.write('\n')
-
-  # Create the master readable output
-  outfile = bom_outfile_readable_csv
-
-  with open(outfile,'w') as obom:
-    obom.write('Ref,Qty,Qty3,Description,MF,MF_PN,S1,S1_PN,Type\n')
-    for b in bom:
-
-      q = b.qty*3
-      obom.write(b.refs+',')
-      obom.write(str(b.qty)+','+str(q)+','+b.description)
-
-      obom.write(','+b.mf_name) if b.mf_name else obom.write(',')
-      obom.write(','+b.mf_pn) if b.mf_pn else obom.write(',')
-      obom.write(','+b.s1_name) if b.s1_name else obom.write(',')
-      obom.write(','+b.s1_pn) if b.s1_pn else obom.write(',')
-      obom.write(','+b.thsmt) if b.thsmt else obom.write(',')
-      obom.write('\n')
-
-  # Create the master Seeed output
-
-  outfile = bom_outfile_seeed_csv
-
-  with open(outfile,'w') as obom:
-    obom.write('Location,MPN/Seeed SKU,Quantity\n')
-    for b in bom:
-      if b.qty > 0:
-        obom.write(b.refs+','+b.mf_pn+','+str(b.qty)+'\n')
-
-  # Create a markdown file for github with each vendor
-  # given its own table for easy reading
-  # Also create the vendor-specific csv files
-
-  outbom_list = []
-  outcsv_list = []
-  outfile_md = bom_outfile_md
-
-  for v in vendors:
-    outcsv_list = []
-    outfile_csv = bom_dir_base_path+'-bom-'+v.lower()+'.csv'
-    which_line = 0
-
-    for line in bom:
-      if which_line is 0:
-        outcsv_list.append('Ref,Qty,Qty3,Description,'+v+' PN')
-        outbom_list.append('|Ref|Qty|Description|'+v+' PN|')
-        outbom_list.append('|---|---|-----------|------|')
-        which_line = 1
-
-      if line.qty > 0 and line.s1_name == v:
-        outcsv_list.append(line.refs+','+str(line.qty)+','+str(line.qty*3)+','+line.description+','+line.s1_pn)
-        outbom_list.append('|'+line.refs+'|'+str(line.qty)+'|'+line.description+'|'+line.s1_pn+'|')
-
-    outbom_list.append('\n')
-
-    # write out this particular vendor into its own csv file
-    with open(outfile_csv,'w') as ocsv:
-      for line in outcsv_list:
-        ocsv.write(line+'\n')
-
-    # empty the output csv list to start fresh for the next file
-    outcsv_list = []
-
-  # write out all the vendors in one readable markdown file
-  with open(outfile_md,'w') as obom:
-    for line in outbom_list:
-      obom.write(line+'\n')
-
-  # collect the preliminary assembly information for quoting
-  # board size, number of different parts, number of total placements
-
-  assy_outfile_md = data['bom_dir']+'/'+data['projname']+'-v'+data['version']+'-assy-readme.md'
-  outassy_list = []
-
-  place_count = 0
-  part_count = 0
-  for b in bom:
-    if b.qty > 0:
-      place_count = place_count + b.qty
-      part_count = part_count + 1
+  context = {
+    'vendors': sorted(vendors),
+    'extra_fields': sorted(extra_fields),
+  }
 
-  outassy_list.append('Individual Placements per board: '+str(part_count)+'\n')
-  outassy_list.append('Number of Parts: '+str(place_count)+'\n')
+  # open every registered output format, then walk the BOM
+  # once and hand each line to all of them
+  writers = [w(bom_dir_base_path, context) for w in bom_writers]
 
-#  don't use this here, it requires the manufacturing section to be run
-#  board_dims = get_board_size(data['projname'],data['gerbers_dir'])
-#  outassy_list.append(get_board_size_string(board_dims)+'\n')
+  for b in bom:
+    for w in writers:
+      w.write_line(b)
 
-  # write to the readable markdown file that will end up
-  # appended in the github repo README.md
-  with open(assy_outfile_md,'w') as oassy:
-    for line in outassy_list:
-      oassy.write(line+'\n')
+  for w in writers:
+    w.close()
 
   #for line in bom:
   #  line.print_line()
@@ -1299,6 +2259,151 @@ def create_bill_of_materials(data):
   # return the json components data object
   return components
 
+###########################################################
+#
+#                     ArtifactStore
+#
+# a cache of deflated files in .kifisher/artifacts, one
+# blob per distinct file content, named by its sha1
+#
+# - each blob is a small header (method, crc32, size,
+#   compressed size) followed by the raw deflate stream,
+#   exactly the bytes a zip member holds
+# - files that are already compressed (zip, pdf, png)
+#   are kept stored instead of deflated again
+# - write_zip() assembles a zip by copying blobs, so a
+#   file that goes into several zips, or into the same
+#   zip on the next build, is compressed only once
+# - refs.json lists the blobs each zip was built from;
+#   after a zip is written, blobs that no zip still on
+#   disk uses are deleted, so replots don't pile up
+#
+###########################################################
+
+ARTIFACT_HEADER = struct.Struct('<BIII')
+STORED_EXTENSIONS = ('.zip', '.pdf', '.png', '.jpg')
+
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP_END_RECORD = struct.Struct('<IHHHHIIH')
+
+class ArtifactStore(object):
+
+  def __init__(self, store_dir):
+    self.store_dir = os.path.abspath(store_dir)
+    self.entries = {}
+
+  def blob_path(self, digest):
+    return os.path.join(self.store_dir, digest[:2], digest)
+
+  def add(self, path):
+
+    # returns (blob path, method, crc32, size, compressed size)
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if key in self.entries and os.path.isfile(self.entries[key][0]):
+      return self.entries[key]
+
+    with open(path,'rb') as f:
+      raw = f.read()
+
+    blob = self.blob_path(hashlib.sha1(raw).hexdigest())
+
+    if os.path.isfile(blob):
+      with open(blob,'rb') as b:
+        method, crc, size, csize = ARTIFACT_HEADER.unpack(b.read(ARTIFACT_HEADER.size))
+    else:
+      crc = zlib.crc32(raw) & 0xffffffff
+      if path.lower().endswith(STORED_EXTENSIONS):
+        method, packed = 0, raw
+      else:
+        deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        method, packed = 8, deflater.compress(raw) + deflater.flush()
+      size, csize = len(raw), len(packed)
+
+      if not os.path.exists(os.path.dirname(blob)):
+        os.makedirs(os.path.dirname(blob))
+      with open(blob+'.tmp','wb') as b:
+        b.write(ARTIFACT_HEADER.pack(method, crc, size, csize))
+        b.write(packed)
+      os.rename(blob+'.tmp', blob)
+
+    self.entries[key] = (blob, method, crc, size, csize)
+    return self.entries[key]
+
+  def write_zip(self, zip_path, members):
+
+    # members is a list of (name in the zip, file path);
+    # one file may be listed under several names
+    central = []
+    blobs = set()
+    offset = 0
+
+    with open(zip_path+'.tmp','wb') as z:
+      for name, path in members:
+        blob, method, crc, size, csize = self.add(path)
+        blobs.add(os.path.basename(blob))
+        name = name.encode('utf-8') if not isinstance(name, bytes) else name
+        t = time.localtime(os.stat(path).st_mtime)
+        dos_time = (t[3] << 11) | (t[4] << 5) | (t[5] // 2)
+        dos_date = ((t[0] - 1980) << 9) | (t[1] << 5) | t[2]
+
+        z.write(ZIP_LOCAL_HEADER.pack(0x04034b50, 20, 0, method, dos_time, dos_date,
+                                      crc, csize, size, len(name), 0))
+        z.write(name)
+        with open(blob,'rb') as b:
+          b.seek(ARTIFACT_HEADER.size)
+          copyfileobj(b, z)
+
+        central.append(ZIP_CENTRAL_HEADER.pack(0x02014b50, 0x314, 20, 0, method, dos_time, dos_date,
+                                               crc, csize, size, len(name), 0, 0, 0, 0,
+                                               0o644 << 16, offset) + name)
+        offset = offset + ZIP_LOCAL_HEADER.size + len(name) + csize
+
+      directory = b''.join(central)
+      z.write(directory)
+      z.write(ZIP_END_RECORD.pack(0x06054b50, 0, 0, len(central), len(central),
+                                  len(directory), offset, 0))
+
+    os.rename(zip_path+'.tmp', zip_path)
+    self.prune(zip_path, blobs)
+
+  def prune(self, zip_path, blobs):
+
+    # zips are recorded relative to the project dir, which
+    # holds the .kifisher dir the store lives in
+    root = os.path.dirname(os.path.dirname(self.store_dir))
+    refs_file = os.path.join(self.store_dir,'refs.json')
+    refs = {}
+    if os.path.isfile(refs_file):
+      try:
+        with open(refs_file) as f:
+          refs = json.load(f)
+      except ValueError:
+        refs = {}
+
+    refs[os.path.relpath(os.path.abspath(zip_path), root)] = sorted(blobs)
+    refs = dict([(z, b) for z, b in refs.items() if os.path.isfile(os.path.join(root, z))])
+
+    live = set()
+    for b in refs.values():
+      live.update(b)
+
+    for sub in os.listdir(self.store_dir):
+      sub = os.path.join(self.store_dir, sub)
+      if not os.path.isdir(sub):
+        continue
+      for blob in os.listdir(sub):
+        if blob not in live:
+          os.remove(os.path.join(sub, blob))
+
+    with open(refs_file+'.tmp','w') as f:
+      json.dump(refs, f, indent=2, sort_keys=True)
+    os.rename(refs_file+'.tmp', refs_file)
+
+def get_artifact_store():
+  return ArtifactStore(os.path.join(kfconfig.cache_dir,'artifacts'))
+
 ###########################################################
 #
 #                   create_mfr_zip_files
@@ -1312,8 +2417,11 @@ def create_bill_of_materials(data):
 #
 ###########################################################
 
+@profiled
 def create_mfr_zip_files(data):
 
+  store = get_artifact_store()
+
   # Work entirely inside the mfr sub_dir
   if os.path.exists(data['gerbers_dir']):
     os.chdir(data['gerbers_dir'])
@@ -1324,12 +2432,8 @@ def create_mfr_zip_files(data):
     files.extend(glob.glob(ext))
 
   for stencilfile_path in files:
-    stencilfile_lines = []
-    with open(stencilfile_path) as f:
-      for line in f:
-        stencilfile_lines.append(line)
-    if stencilfile_lines[13] == 'G04 APERTURE END LIST*\n':
-      call(['rm',stencilfile_path])
+    if kfgerber.gerber_is_empty(stencilfile_path):
+      os.remove(stencilfile_path)
 
   # Create zip file for OSH Park and generic manufacturing
 
@@ -1339,12 +2443,10 @@ def create_mfr_zip_files(data):
               '*.gts','*.gbr','*.gko','*.gtp','*.gbp',):
     files.extend(glob.glob(ext))
 
-  # Make a copy for the board file required for macrofab
-  call(['cp',data['projname']+'-Edge.Cuts.gko',data['projname']+'-Edge.Cuts.bor'])
+  # the Fab layers are only drawn into assembly.png
+  files = [f for f in files if not f.endswith('.Fab.gbr')]
 
-  ZipFile = zipfile.ZipFile(data['projname']+'-v'+data['version']+"-gerbers.zip", "w")
-  for f in files:
-    ZipFile.write(os.path.basename(f))
+  store.write_zip(data['projname']+'-v'+data['version']+"-gerbers.zip", [(f, f) for f in files])
 
   # Create zip file for stencils
   # always using .gko (outline) and .gtp,.gbp (paste) files
@@ -1356,13 +2458,90 @@ def create_mfr_zip_files(data):
 
   if files:
     files.extend(glob.glob('*.gko'))
-    ZipFile = zipfile.ZipFile(data['projname']+'-v'+data['version']+"-stencil.zip", "w")
-    for f in files:
-      ZipFile.write(os.path.basename(f))
+    store.write_zip(data['projname']+'-v'+data['version']+"-stencil.zip", [(f, f) for f in files])
   else:
     print('There are no stencil files! Are all components through-hole?')
 
-  os.chdir("..")
+  os.chdir("..")
+
+###########################################################
+#
+#                 iter_pos_placements
+#
+# inputs:
+# - list of KiCad .pos file paths
+#
+# what it does:
+# - streams every file one line at a time
+# - skips the '#' header and footer lines
+# - splits each placement line on whitespace:
+#   Ref Val Package PosX PosY Rot Side
+#
+# yields:
+# - (ref, posx, posy, rot, side) tuples of strings
+#
+###########################################################
+
+def iter_pos_placements(posfiles):
+
+  for pf in posfiles:
+    with open(pf) as p:
+      for line in p:
+        if line.startswith('#'):
+          continue
+        cols = line.split()
+        if len(cols) < 7:
+          continue
+        # values with spaces push the columns right,
+        # so count the position columns from the end
+        yield (cols[0], cols[-4], cols[-3], cols[-2], cols[-1])
+
+###########################################################
+#
+#                 join_pos_placements
+#
+# inputs:
+# - list of Comp() objects
+# - list of KiCad .pos file paths
+#
+# what it does:
+# - indexes the components by ref once
+# - fills in xloc, yloc, rot and side for every
+#   placement found in the .pos files
+#
+# returns:
+# - tuple of two sorted lists of refs:
+#   ([placed parts in the netlist but not the .pos files],
+#    [refs in the .pos files but not the netlist])
+#
+###########################################################
+
+def join_pos_placements(components, posfiles):
+
+  comp_index = {}
+  for c in components:
+    comp_index[c.ref] = c
+
+  placed = set()
+  not_in_netlist = []
+
+  for ref, posx, posy, rot, side in iter_pos_placements(posfiles):
+    c = comp_index.get(ref)
+    if c is None:
+      not_in_netlist.append(ref)
+      continue
+    c.xloc = str(float(posx)*1000)
+    c.yloc = str(float(posy)*1000)
+    c.rot = '{:.2f}'.format(float(rot))
+    c.side = side
+    placed.add(ref)
+
+  not_in_pos = []
+  for c in components:
+    if (c.thsmt == 'th' or c.thsmt == 'smt') and c.ref not in placed:
+      not_in_pos.append(c.ref)
+
+  return (sorted(not_in_pos), sorted(not_in_netlist))
 
 ###########################################################
 #
@@ -1374,11 +2553,14 @@ def create_mfr_zip_files(data):
 #
 # what it does:
 # - removes all existing assembly files in that directory
-# - updates the components list with x/y pos, rot, size
-# -
+# - updates the components list with x/y pos, rot, side
+#   from the .pos files
+# - warns about refs that are only in the netlist or
+#   only in the .pos files
 #
 ###########################################################
 
+@profiled
 def create_assembly_files(data, components):
 
   print("Creating assembly files for PCB+Assembly")
@@ -1388,23 +2570,16 @@ def create_assembly_files(data, components):
 
   # make a tuple of the .pos files
   posfiles = (data['projname']+'-top.pos',data['projname']+'-bottom.pos')
-  xyrs_parts_master = []
 
-  # create xyrs_parts_master from the position files
-  for pf in posfiles:
-    with open(pf) as p:
-      for line in p:
-        if '#' not in line:
-          # clean the line
-          line = line.strip('\n').split(' ')
-          line = [x for x in line if x]
-
-          for c in components:
-            if c.ref == line[0]:
-              c.xloc = str(float(line[3])*1000)
-              c.yloc = str(float(line[4])*1000)
-              c.rot = '{:.2f}'.format(float(line[5]))
-              c.side = line[6]
+  # add the placements to the components
+  not_in_pos, not_in_netlist = join_pos_placements(components, posfiles)
+
+  if not_in_pos:
+    print("WARNING! These parts are in the netlist but not the .pos files:")
+    print('  '+compress_refs(not_in_pos))
+  if not_in_netlist:
+    print("WARNING! These parts are in the .pos files but not the netlist:")
+    print('  '+compress_refs(not_in_netlist))
 
 #  for c in components:
 #    c.print_component()
@@ -1440,27 +2615,26 @@ def create_assembly_files(data, components):
         oxyrs.write('\n')
 
 
-  macrofab_zip = zipfile.ZipFile(data['projname']+'-v'+data['version']+'-macrofab.zip','w')
+  # the xyrs plus the gerbers, with the outline a second
+  # time as the .bor board file macrofab requires
 
-  if os.path.exists(data['bom_dir']):
-    os.chdir(data['bom_dir'])
-    if os.path.exists(data['projname']+'-v'+data['version']+'-assy.xyrs'):
-      macrofab_zip.write(data['projname']+'-v'+data['version']+'-assy.xyrs')
-    os.chdir('..')
+  members = []
+  xyrs = data['projname']+'-v'+data['version']+'-assy.xyrs'
+  if os.path.exists(os.path.join(data['bom_dir'],xyrs)):
+    members.append((xyrs, os.path.join(data['bom_dir'],xyrs)))
 
   files = []
   for ext in ('*.xln','*.gbl','*.gtl','*.gbo','*.gto','*.gbs',
-              '*.gts','*.gbr','*.bor','*.gtp','*.gbp',):
+              '*.gts','*.gbr','*.gtp','*.gbp',):
     files.extend(glob.glob(os.path.join(data['gerbers_dir'], ext)))
+  files = [f for f in files if not f.endswith('.Fab.gbr')]
+  members.extend([(os.path.basename(f), f) for f in files])
 
-  if os.path.exists(data['gerbers_dir']):
-    os.chdir(data['gerbers_dir'])
-
-  for f in files:
-    macrofab_zip.write(os.path.basename(f))
-  os.chdir("..")
+  outline = os.path.join(data['gerbers_dir'], data['projname']+'-Edge.Cuts.gko')
+  if os.path.exists(outline):
+    members.append((data['projname']+'-Edge.Cuts.bor', outline))
 
-  call(['mv',data['projname']+'-v'+data['version']+'-macrofab.zip','bom/'])
+  get_artifact_store().write_zip(os.path.join(data['bom_dir'],data['projname']+'-v'+data['version']+'-macrofab.zip'), members)
 
 ###########################################################
 #
@@ -1468,16 +2642,27 @@ def create_assembly_files(data, components):
 #
 # inputs:
 # - data object
+# - names of the sections to regenerate, any of 'bom',
+#   'assy', 'size' and 'changelog'
 #
 # what it does:
 # - creates README.md if it doesn't already exist
-# - appends BOM to README if there's a commented section
+# - reads it once and finds every <!--- name start --->
+#   and <!--- name end ---> marker pair
+# - fills each section asked for from readme_section(),
+#   leaving sections it has no content for alone
+# - if any of them changed, sets the Updated: date in the
+#   title and writes the file once, through README.md.tmp
 #
-# returns nothing
+# returns:
+# - list of the names of the sections that changed
 #
 ###########################################################
 
-def update_readme(data):
+README_MARKER = re.compile(r'<!---\s*(?:(\w+)\s+(start|end)|(start|end)\s+(\w+))\s*--->')
+
+@profiled
+def update_readme(data, sections):
 
   # create the README if we don't have one
 
@@ -1485,76 +2670,116 @@ def update_readme(data):
   if not os.path.isfile(readme):
     create_readme(readme,data)
 
-  # now update the README
-  ## if the bom flag was passed in, update the bom info
+  with open(readme,'r') as f:
+    lines = f.readlines()
+
+  # index the marker pairs, ex: {'bom': (12, 40)}
+
+  starts = {}
+  blocks = {}
+  for i, line in enumerate(lines):
+    match = README_MARKER.search(line)
+    if match is None:
+      continue
+    name = match.group(1) or match.group(4)
+    edge = match.group(2) or match.group(3)
+    if edge == 'start':
+      starts[name] = i
+    elif name in starts:
+      blocks[name] = (starts.pop(name), i)
+
+  for name in starts:
+    print("README.md has no end marker for the "+name+" section, leaving it alone.")
+
+  new_bodies = {}
+  for name in sections:
+    if name not in blocks:
+      continue
+    start, end = blocks[name]
+    body = readme_section(data, name, lines[start+1:end])
+    if body is not None and ''.join(body) != ''.join(lines[start+1:end]):
+      new_bodies[name] = body
+
+  changed = sorted(new_bodies)
+  if not changed:
+    print("README.md is up to date.")
+    return changed
+
+  # the date in the title only moves when a section did
+
+  if 'title' in blocks:
+    start, end = blocks['title']
+    new_bodies['title'] = [('- Updated: '+data['date_update']+'\n') if 'Updated: ' in line else line
+                           for line in lines[start+1:end]]
+
+  out = []
+  skip_to = -1
+  for i, line in enumerate(lines):
+    if i < skip_to:
+      continue
+    out.append(line)
+    for name in new_bodies:
+      if blocks[name][0] == i:
+        out.extend(new_bodies[name])
+        skip_to = blocks[name][1]
+
+  with open(readme+'.tmp','w') as f:
+    f.writelines(out)
+  os.rename(readme+'.tmp', readme)
+
+  print("README.md sections updated: "+', '.join(changed))
+  return changed
 
-  if args.bom:
-    newlinefile = data['bom_dir']+'/'+data['projname']+'-v'+data['version']+'-bom-readme.md'
-    tempfile = []
-    newlines = []
+###########################################################
+#
+#                    readme_section
+#
+# inputs:
+# - data object
+# - section name
+# - the lines currently between its markers
+#
+# what it does:
+# - bom and assy: the -bom-readme.md and -assy-readme.md
+#   files written by the -b and -a builds
+# - size: the board size from the Edge.Cuts gerber
+# - changelog: the current lines, with one for this
+#   version added at the top if it isn't listed yet
+#
+# returns:
+# - list of lines to go between the markers, or None if
+#   there's nothing to fill it with
+#
+###########################################################
 
+def readme_section(data, name, current):
 
-    with open(newlinefile,'r') as f:
-      for line in f:
-        newlines.append(line)
-
-      write_bom = False
-
-      with open(readme,'r') as f:
-        for line in f:
-          if 'Updated: ' in line:
-            tempfile.append('- Updated: '+data['date_update']+'\n')
-          else:
-            if write_bom is False:
-              tempfile.append(line)
-              if '<!--- bom start' in line:
-                write_bom = True
-                tempfile.append("## Bill of Materials\n\n")
-                for bomline in newlines:
-                  tempfile.append(bomline)
-            else:
-              if '<!--- bom end' in line:
-                tempfile.append(line)
-                write_bom = False
-
-      with open(readme,'w') as f:
-        for line in tempfile:
-          f.write(line)
-
-  ## if the assembly flag was passed in, update the assembly info
-
-  elif args.assy:
-    newlinefile = data['bom_dir']+'/'+data['projname']+'-v'+data['version']+'-assy-readme.md'
-
-    tempfile = []
-    newlines = []
+  base = data['bom_dir']+'/'+data['projname']+'-v'+data['version']
 
+  if name in ('bom', 'assy'):
+    newlinefile = base+'-'+name+'-readme.md'
+    if not os.path.isfile(newlinefile):
+      return None
     with open(newlinefile,'r') as f:
-      for line in f:
-        newlines.append(line)
-
-      write_assy = False
-
-      with open(readme,'r') as f:
-        for line in f:
-          if 'Updated: ' in line:
-            tempfile.append('- Updated: '+data['date_update']+'\n')
-          else:
-            if write_assy is False:
-              tempfile.append(line)
-              if '<!--- assy start' in line:
-                write_assy = True
-                tempfile.append("\n### Assembly Info for Quoting\n\n")
-                for assyline in newlines:
-                  tempfile.append(assyline)
-            else:
-              if '<!--- assy end' in line:
-                tempfile.append(line)
-                write_assy = False
-
-      with open(readme,'w') as f:
-        for line in tempfile:
-          f.write(line)
+      newlines = f.readlines()
+    if name == 'bom':
+      return ["## Bill of Materials\n\n"] + newlines
+    return ["\n### Assembly Info for Quoting\n\n"] + newlines
+
+  if name == 'size':
+    outline = os.path.join(data['gerbers_dir'],data['projname']+'-Edge.Cuts.gko')
+    if not os.path.isfile(outline) or kfgerber.outline_geometry(outline) is None:
+      return None
+    board_dims = get_board_size(data['projname'],data['gerbers_dir'])
+    return ['- '+get_board_size_string(board_dims).strip()+'\n']
+
+  if name == 'changelog':
+    entry = '- v'+data['version']+': '
+    if [line for line in current if line.startswith(entry)]:
+      return current
+    return [entry+data['date_update']+'\n'] + current
+
+  return None
 
 ###########################################################
 #
@@ -1564,18 +2789,22 @@ def update_readme(data):
 # - data object
 #
 # what it does:
-# - creates a temporary file which will be pandoc input
-# - copies over the README to the temporary file,
-#   ignoring anything in the title
-# - uses the appropriate LaTeX template
-# - adjusts the width of the png files by input arg
-# - calls pandoc to create the PDF from temporary file
-# - remove the temporary file
+# - builds the pandoc input from the README, ignoring
+#   anything in the title, with the png widths set from
+#   proj.json
+# - keys it on that markdown, the LaTeX template and the
+#   hashes of the images it links to
+# - reuses the pandoc output cached under that key in
+#   kfconfig.cache_dir/pdf, otherwise writes the
+#   temporary file and runs pandoc
+# - appends the schematic PDF with pdfunite, unless the
+#   key, schematic and PDF all match the last build
 #
 # returns nothing
 #
 ###########################################################
 
+@profiled
 def create_pdf(data):
 
   tempfile = 'temporary.md'
@@ -1583,7 +2812,9 @@ def create_pdf(data):
   src_list = []
   title_flag = False
 
-  with open(src,'r') as s:
+  # read as text so the README and the proj.json values
+  # are both unicode on python 2
+  with io.open(src,'r',encoding='utf-8') as s:
     for line in s:
       if 'start title' in line:
         title_flag = True
@@ -1620,40 +2851,123 @@ def create_pdf(data):
         else:
           src_list.append(line)
 
-  with open(tempfile,'w') as tfile:
-    tfile.write('---\n')
-    tfile.write('title: '+data['title']+'\n')
-    tfile.write('version: '+data['version']+'\n')
-    tfile.write('description: '+data['description']+'\n')
-    tfile.write('company: '+data['company']+'\n')
-    tfile.write('email: '+data['email']+'\n')
-    tfile.write('website: '+data['website']+'\n')
-    tfile.write('license: '+data['license']+'\n')
-    if 'author' in data:
-      tfile.write('author: '+data['author']+'\n')
-    tfile.write('---\n')
-    tfile.write('\n')
-
-    for line in src_list:
-      tfile.write(line)
+  header = ['---\n',
+            'title: '+data['title']+'\n',
+            'version: '+data['version']+'\n',
+            'description: '+data['description']+'\n',
+            'company: '+data['company']+'\n',
+            'email: '+data['email']+'\n',
+            'website: '+data['website']+'\n',
+            'license: '+data['license']+'\n']
+  if 'author' in data:
+    header.append('author: '+data['author']+'\n')
+  header.append('---\n')
+  header.append('\n')
+  markdown = ''.join(header + src_list).encode('utf-8')
 
   latex_template_dir = data['template_dir'][:-9]
+  pdf = data['projname']+'-v'+data['version']+'.pdf'
+  schematic = data['projname']+'-v'+data['version']+'-schematic.pdf'
+  temp_pdf = data['projname']+'-v'+data['version']+'-temp.pdf'
+  pandoc_args = ['pandoc','-fmarkdown-implicit_figures','-R','--data-dir='+latex_template_dir,'--template='+data['template_latex'],'-V','geometry:margin=1in']
+
+  key = pdf_cache_key(markdown, data, pandoc_args)
+  pdf_dir = os.path.join(kfconfig.cache_dir,'pdf')
+  body = os.path.join(pdf_dir, key+'.pdf')
+  state_file = os.path.join(pdf_dir,'state.json')
+  schematic_hash = hash_file(schematic) if os.path.exists(schematic) else ''
+
+  state = {}
+  if os.path.isfile(state_file):
+    try:
+      with open(state_file) as f:
+        state = json.load(f)
+    except ValueError:
+      state = {}
+
+  if state.get('key') == key and state.get('schematic') == schematic_hash and \
+     os.path.isfile(body) and os.path.isfile(pdf) and state.get('pdf') == hash_file(pdf):
+    print("PDF is up to date.")
+    return
+
+  if not os.path.exists(pdf_dir):
+    os.makedirs(pdf_dir)
+
+  # create PDF, then if it exists, append the schematic to the end of it
+  tools = ToolScheduler()
+  pandoc = None
+  rendered = body
+  if not os.path.isfile(body):
+    with open(tempfile,'wb') as tfile:
+      tfile.write(markdown)
+    # pandoc picks the output format from the extension
+    rendered = os.path.join(pdf_dir, key+'-temp.pdf')
+    pandoc = tools.submit('pdf', pandoc_args+[tempfile,'-o',rendered])
+  else:
+    print("Reusing the cached pandoc output.")
+  if os.path.exists(schematic):
+    tools.submit('schematic', ['pdfunite',rendered,schematic,temp_pdf], deps=[pandoc] if pandoc else [])
+
+  try:
+    tools.wait()
+  finally:
+    # remove input file
+    if os.path.exists(tempfile):
+      os.remove(tempfile)
+
+  if rendered != body:
+    os.rename(rendered, body)
+
+  if os.path.exists(temp_pdf):
+    os.rename(temp_pdf, pdf)
+  else:
+    copyfile(body, pdf)
+
+  # only the current pandoc output is worth keeping
+  for old in glob.glob(os.path.join(pdf_dir,'*.pdf')):
+    if old != body:
+      os.remove(old)
+
+  state = {'key': key, 'schematic': schematic_hash, 'pdf': hash_file(pdf)}
+  with open(state_file+'.tmp','w') as f:
+    json.dump(state, f, indent=2, sort_keys=True)
+  os.rename(state_file+'.tmp', state_file)
+
+###########################################################
+#
+#                    pdf_cache_key
+#
+# inputs:
+# - the pandoc input markdown, as utf-8 bytes
+# - data object
+# - the pandoc command line, without input and output
+#
+# what it does:
+# - hashes the markdown, which already carries the png
+#   widths, and the command line
+# - adds the hash of the LaTeX template and of every png
+#   the markdown links to; a missing file hashes as empty
+#
+# returns:
+# - the hex digest string
+#
+###########################################################
 
-  # create PDF
-  call(['pandoc','-fmarkdown-implicit_figures','-R','--data-dir='+latex_template_dir,'--template='+data['template_latex'],'-V','geometry:margin=1in',tempfile,'-o',data['projname']+'-v'+data['version']+'.pdf'])
+def pdf_cache_key(markdown, data, pandoc_args):
 
-  # if it exists, append the schematic to the end of the PDF
-  if os.path.exists(data['projname']+'-v'+data['version']+'-schematic.pdf'):
-    call(['pdfunite',data['projname']+'-v'+data['version']+'.pdf',
-      data['projname']+'-v'+data['version']+'-schematic.pdf',
-      data['projname']+'-v'+data['version']+'-temp.pdf'])
+  sha = hashlib.sha1()
+  sha.update(markdown)
+  sha.update(' '.join(pandoc_args).encode('utf-8'))
 
-    call(['mv',data['projname']+'-v'+data['version']+'-temp.pdf',
-      data['projname']+'-v'+data['version']+'.pdf'])
+  template = os.path.join(data['template_dir'],data['template_latex'])
+  files = [template, template+'.latex']
+  files += sorted(set(re.findall(r'\(([^()\s]+\.png)\)', markdown.decode('utf-8'))))
 
+  for path in files:
+    digest = hash_file(path) if os.path.isfile(path) else ''
+    sha.update((path+' '+digest+'\n').encode('utf-8'))
 
-  # remove input file
-  call(['rm',tempfile])
+  return sha.hexdigest()
 
 ###########################################################
 #
@@ -1673,28 +2987,683 @@ def create_pdf(data):
 #
 ###########################################################
 
+@profiled
 def create_release_zipfile(data):
 
-  release_zip = zipfile.ZipFile(data['projname']+'-v'+data['version']+'.zip','w')
+  release = data['projname']+'-v'+data['version']
+  members = []
 
-  if os.path.exists(data['bom_dir']):
-    os.chdir(data['bom_dir'])
-    if os.path.exists(data['projname']+'-v'+data['version']+'-bom-readable.csv'):
-      release_zip.write(data['projname']+'-v'+data['version']+'-bom-readable.csv')
-    if os.path.exists(data['projname']+'-v'+data['version']+'-macrofab.zip'):
-      release_zip.write(data['projname']+'-v'+data['version']+'-macrofab.zip')
-    os.chdir('..')
+  for path in (os.path.join(data['bom_dir'],release+'-bom-readable.csv'),
+               os.path.join(data['bom_dir'],release+'-macrofab.zip'),
+               os.path.join(data['gerbers_dir'],release+'-gerbers.zip'),
+               os.path.join(data['gerbers_dir'],release+'-stencil.zip'),
+               release+'.pdf'):
+    if os.path.exists(path):
+      members.append((os.path.basename(path), path))
 
-  if os.path.exists(data['gerbers_dir']):
-    os.chdir(data['gerbers_dir'])
-    if os.path.exists(data['projname']+'-v'+data['version']+'-gerbers.zip'):
-      release_zip.write(data['projname']+'-v'+data['version']+'-gerbers.zip')
-    if os.path.exists(data['projname']+'-v'+data['version']+'-stencil.zip'):
-      release_zip.write(data['projname']+'-v'+data['version']+'-stencil.zip')
-    os.chdir('..')
+  get_artifact_store().write_zip(release+'.zip', members)
+
+###########################################################
+#
+#                     ToolScheduler
+#
+# runs external tools and slow in-process steps side by
+# side, in threads
+#
+# - submit(name, action, deps) queues a job; action is
+#   either an argv list for an external tool or a python
+#   function to call, and deps are jobs that must finish
+#   first
+# - at most max_jobs run at once, the core count by
+#   default
+# - a tool that exits non-zero, or a function that
+#   raises, fails its job; jobs that depend on a failed
+#   job are skipped
+# - wait() blocks until every job is done and raises
+#   ToolError naming the failed jobs, if any
+#
+###########################################################
+
+class ToolError(Exception):
+  pass
+
+class ToolJob(object):
+
+  def __init__(self, name, action, deps):
+    self.name = name
+    self.action = action
+    self.deps = deps
+    self.error = None
+    self.done = threading.Event()
+
+class ToolScheduler(object):
+
+  def __init__(self, max_jobs=None):
+    self.max_jobs = max_jobs or multiprocessing.cpu_count()
+    self.slots = threading.Semaphore(self.max_jobs)
+    self.jobs = []
+
+  def submit(self, name, action, deps=()):
+    job = ToolJob(name, action, deps)
+    self.jobs.append(job)
+    worker = threading.Thread(target=self.run_job, args=(job,))
+    worker.daemon = True
+    worker.start()
+    return job
+
+  def run_job(self, job):
+
+    for dep in job.deps:
+      dep.done.wait()
+
+    failed = [dep.name for dep in job.deps if dep.error]
+    if failed:
+      job.error = ToolError(job.name+' skipped because '+', '.join(failed)+' failed')
+      job.done.set()
+      return
+
+    with self.slots:
+      try:
+        if callable(job.action):
+          job.action()
+        else:
+          with profile_span(job.action[0], 'tool'):
+            ret = call(job.action)
+          if ret != 0:
+            raise ToolError(job.name+': '+job.action[0]+' exited with status '+str(ret))
+      except ToolError as e:
+        job.error = e
+      except Exception:
+        job.error = ToolError(job.name+' failed:\n'+traceback.format_exc())
+
+    job.done.set()
+
+  def wait(self):
+
+    for job in self.jobs:
+      job.done.wait()
+
+    errors = [job.error for job in self.jobs if job.error]
+    self.jobs = []
+    if errors:
+      raise ToolError('\n'.join([str(e) for e in errors]))
+
+###########################################################
+#
+#                        Stage
+#
+# one step of the build, declared make-style:
+# - name, ex: 'gerbers'
+# - func, called with no arguments to build the outputs;
+#   it may return a list of what it changed
+# - inputs, file paths or glob patterns it reads
+# - outputs, file paths that must exist afterwards
+# - deps, names of stages whose outputs it reads; if one
+#   of them ran, this stage runs too
+# - params, a string of the proj.json settings that
+#   change its outputs, ex: the version number
+#
+###########################################################
+
+class Stage(object):
+
+  def __init__(self, name, func, inputs=(), outputs=(), deps=(), params=''):
+    self.name = name
+    self.func = func
+    self.inputs = inputs
+    self.outputs = outputs
+    self.deps = deps
+    self.params = params
+
+###########################################################
+#
+#                  fingerprint_inputs
+#
+# inputs:
+# - list of file paths or glob patterns
+# - the fingerprints stored by the last build, if any
+#
+# what it does:
+# - expands the globs; missing files are left out
+# - reuses the stored sha1 when a file's size and mtime
+#   haven't changed, otherwise hashes it
+#
+# returns:
+# - dict of path -> [size, mtime, sha1]
+#
+###########################################################
+
+def fingerprint_inputs(inputs, old_prints):
+
+  paths = set()
+  for pattern in inputs:
+    paths.update(glob.glob(pattern))
+
+  prints = {}
+  for path in paths:
+    if not os.path.isfile(path):
+      continue
+    st = os.stat(path)
+    old = old_prints.get(path)
+    if old and old[0] == st.st_size and old[1] == st.st_mtime:
+      prints[path] = old
+    else:
+      prints[path] = [st.st_size, st.st_mtime, hash_file(path)]
+
+  return prints
+
+###########################################################
+#
+#                      run_build
+#
+# inputs:
+# - list of Stage() objects in dependency order
+# - force flag to run every stage regardless
+#
+# what it does:
+# - loads the build manifest from kfconfig.cache_dir
+# - skips a stage when its input hashes and params match
+#   the manifest, its outputs all exist, and none of its
+#   deps ran in this build
+# - otherwise runs it and records its input hashes,
+#   saving the manifest after every stage; a stage whose
+#   func returns an empty list changed nothing, so it
+#   doesn't make its dependents run
+# - prints which stages ran and which were up to date
+#
+# returns:
+# - list of the names of the stages that ran
+#
+###########################################################
+
+def run_build(stages, force=False):
+
+  manifest_file = os.path.join(kfconfig.cache_dir,'manifest.json')
+  manifest = {}
+  if os.path.isfile(manifest_file):
+    try:
+      with open(manifest_file) as f:
+        manifest = json.load(f)
+    except ValueError:
+      manifest = {}
+
+  ran = []
+  unchanged = []
+
+  for stage in stages:
+    old = manifest.get(stage.name, {})
+    prints = fingerprint_inputs(stage.inputs, old.get('inputs', {}))
+
+    hashes = dict([(path, prints[path][2]) for path in prints])
+    old_hashes = dict([(path, old['inputs'][path][2]) for path in old.get('inputs', {})])
+
+    up_to_date = not force and \
+                 old.get('params') == stage.params and \
+                 hashes == old_hashes and \
+                 all([os.path.exists(o) for o in stage.outputs]) and \
+                 not [d for d in stage.deps if d in ran and d not in unchanged]
+
+    if up_to_date:
+      print("\n["+stage.name+"] is up to date.")
+      continue
+
+    print("\n["+stage.name+"] running.")
+    with profile_span(stage.name, 'stage'):
+      result = stage.func()
+    ran.append(stage.name)
+    if result is not None and not result:
+      unchanged.append(stage.name)
+
+    manifest[stage.name] = {'inputs': prints, 'params': stage.params}
+
+    if not os.path.exists(kfconfig.cache_dir):
+      os.makedirs(kfconfig.cache_dir)
+    with open(manifest_file+'.tmp','w') as f:
+      json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(manifest_file+'.tmp', manifest_file)
+
+  print("\nBuild summary:")
+  for stage in stages:
+    if stage.name in unchanged:
+      status = 'ran, nothing changed'
+    elif stage.name in ran:
+      status = 'ran'
+    else:
+      status = 'up to date'
+    print('  %-10s %s' % (stage.name, status))
+
+  return ran
+
+###########################################################
+#
+#                 create_build_stages
+#
+# inputs:
+# - data object
+# - parsed command line args
+#
+# what it does:
+# - declares the inputs and outputs of every stage the
+#   -m, -b, -a and -p flags ask for
+#
+# returns:
+# - list of Stage() objects in dependency order
+#
+###########################################################
+
+def create_build_stages(data, args):
+
+  projname = data['projname']
+  release = projname+'-v'+data['version']
+  gerbers = data['gerbers_dir']+'/'+projname
+  bom_base = data['bom_dir']+'/'+release
+
+  preview_sizes = get_preview_sizes(data)
+
+  # the parsed components are shared by the bom and assy stages;
+  # if bom is up to date, assy reads them from the netlist cache
+  state = {}
+
+  def get_components():
+    if 'components' not in state:
+      state['components'] = create_component_list_from_netlist(data, not args.no_cache)
+    return state['components']
+
+  def build_gerbers():
+    print("Creating the manufacturing file outputs.")
+    plot_gerbers_and_drills(projname,data['gerbers_dir'],args.plot_jobs)
+
+  def build_images():
+    board_dims = get_board_size(projname,data['gerbers_dir'])
+    print(get_board_size_string(board_dims))
+    tools = ToolScheduler()
+    tools.submit('assembly', lambda: create_assembly_diagrams(projname,data['gerbers_dir'],board_dims[4], board_dims[5]))
+    tools.submit('preview', lambda: create_image_previews(projname,data['gerbers_dir'],board_dims[4], board_dims[5], preview_sizes))
+    tools.wait()
 
-  if os.path.exists(data['projname']+'-v'+data['version']+'.pdf'):
-    release_zip.write(data['projname']+'-v'+data['version']+'.pdf')
+  def build_mfr_zip():
+    create_mfr_zip_files(data)
+
+  def build_bom():
+    print("Creating the bill of materials, which will update the README.")
+    state['components'] = create_bill_of_materials(data, not args.no_cache)
+
+  def build_assy():
+    print("Preparing files for assembly quotes. Currently supports:\n")
+    print("  -- MacroFab\n  -- Seeed/Fusion\n  -- Tempo Automation\n  -- Small Batch Assembly\n")
+
+    # assy should fail if top or bottom .pos doesn't exist
+    if not os.path.exists(projname+'-top.pos'):
+      print("Missing top .pos file. Unable to create assembly information.")
+      exit()
+    if not os.path.exists(projname+'-bottom.pos'):
+      print("Missing bottom .pos file. Unable to create assembly information.")
+      exit()
+
+    # the components list contains each refdes (part) on a separate row
+    # it needs to be sanitized for non-populated parts
+    # then merged with .pos file values
+    create_assembly_files(data, get_components())
+
+  def build_readme():
+    sections = ['changelog']
+    if args.bom:
+      sections.append('bom')
+    if args.assy:
+      sections.append('assy')
+    if args.mfr or args.assy:
+      sections.append('size')
+    return update_readme(data, sections)
+
+  def build_pdf():
+    print("Creating or updating the PDF.")
+    create_pdf(data)
+    create_release_zipfile(data)
+
+  stages = []
+
+  if args.mfr or args.assy:
+    stages.append(Stage('gerbers', build_gerbers,
+      inputs=[projname+'.kicad_pcb'],
+      outputs=[gerbers+'-Edge.Cuts.gko', gerbers+'.xln', gerbers+'-F.Fab.gbr', gerbers+'-B.Fab.gbr']))
+    stages.append(Stage('images', build_images,
+      inputs=[gerbers+'-Edge.Cuts.gko', gerbers+'.xln', gerbers+'-F.Cu.gtl',
+              gerbers+'-B.Cu.gbl', gerbers+'-F.Mask.gts', gerbers+'-B.Mask.gbs',
+              gerbers+'-F.SilkS.gto', gerbers+'-B.SilkS.gbo',
+              gerbers+'-F.Fab.gbr', gerbers+'-B.Fab.gbr'],
+      outputs=['assembly.png'] + [preview_filename(size) for size in preview_sizes],
+      deps=['gerbers'],
+      params=','.join([str(size) for size in preview_sizes])))
+    stages.append(Stage('mfr_zip', build_mfr_zip,
+      outputs=[data['gerbers_dir']+'/'+release+'-gerbers.zip'],
+      deps=['gerbers'],
+      params=release))
+
+  if args.bom or args.assy:
+    stages.append(Stage('bom', build_bom,
+      inputs=[projname+'.net', get_lib_index_path(data) or ''],
+      outputs=[bom_base+'-bom-master.csv', bom_base+'-bom-readme.md'],
+      params=release+' '+str(data.get('bom_group_by',''))))
+
+  if args.assy:
+    stages.append(Stage('assy', build_assy,
+      inputs=[projname+'.net', get_lib_index_path(data) or '',
+              projname+'-top.pos', projname+'-bottom.pos'],
+      outputs=[bom_base+'-assy.xyrs', data['bom_dir']+'/'+release+'-macrofab.zip'],
+      deps=['bom', 'gerbers', 'mfr_zip'],
+      params=release))
+
+  stages.append(Stage('readme', build_readme,
+    inputs=[bom_base+'-bom-readme.md', bom_base+'-assy-readme.md', gerbers+'-Edge.Cuts.gko'],
+    outputs=['README.md'],
+    deps=['bom', 'assy', 'gerbers'],
+    params=' '.join([release, data['date_update'], str(args.mfr), str(args.bom), str(args.assy)])))
+
+  if args.pdf:
+    template = os.path.join(data['template_dir'],data['template_latex'])
+    stages.append(Stage('pdf', build_pdf,
+      inputs=['README.md', '*.png', release+'-schematic.pdf', template],
+      outputs=[release+'.pdf', release+'.zip'],
+      deps=['readme', 'images', 'mfr_zip', 'bom', 'assy'],
+      params=' '.join([release, str(data['width_assembly_png']),
+                       str(data['width_preview_png']), str(data['width_schematic_png']),
+                       str(data['width_other_png'])])))
+
+  return stages
+
+###########################################################
+#
+#                    build_project
+#
+# inputs:
+# - path to the project folder holding proj.json
+# - parsed command line args
+#
+# what it does:
+# - reads proj.json, updating the version if asked to
+#   and the date_update field
+# - changes into the project folder
+# - runs the build stages for the -m, -b, -a, -p flags
+#
+# returns nothing
+#
+###########################################################
+
+def build_project(name, args):
+
+  # read in the proj.json if it exists
+  # error gracefully if it does not
+  if os.path.isfile(name+'/proj.json'):
+    with open(name+'/proj.json') as jfile:
+      if args.version:
+        update_version(name,args.version)
+      data = json.load(jfile)
+      now = datetime.datetime.now()
+      data['date_update'] = now.strftime('%-d %b %Y')
+    with open(name+'/proj.json','w') as jsonfile:
+      json.dump(data, jsonfile, indent=4, sort_keys=True, separators=(',', ':'))
+
+  else:
+    print("This project is missing a proj.json file. Leaving program.")
+    exit()
+
+  print('\nThis is the',data['title'],'project:\n')
+  print(data['description']+'\n')
+
+  # all plotting is done from the same dir as the kicad files
+  os.chdir(name)
+
+  if args.index_lib:
+    index_part_library(data)
+
+  if args.pdf:
+    # accept user input for percent width of assembly.png in pdf
+    if args.width_assembly_png and 1 <= int(args.width_assembly_png) <= 100:
+      data['width_assembly_png'] = args.width_assembly_png
+    elif 'width_assembly_png' in data and 0 < int(data['width_assembly_png']) <= 100:
+      print("using value from json file")
+    else:
+      #print "Arg for width of assembly.png in PDF not valid or not given. Using 50%."
+      data['width_assembly_png'] = kfconfig.default_assembly_image_width
+
+    # accept user input for percent width of preview.png in pdf
+    if args.width_preview_png and int(args.width_preview_png) in range (1,100):
+      data['width_preview_png'] = args.width_preview_png
+    elif 'width_preview_png' in data and 0 < int(data['width_preview_png']) <= 100:
+      print("using value from json file")
+    else:
+      #print "Arg for width of preview.png in PDF not valid or not given. Using 50%."
+      data['width_preview_png'] = kfconfig.default_preview_image_width
+
+    # accept user input for percent width of schematic.png in pdf
+    if args.width_schematic_png and int(args.width_schematic_png) in range (1,100):
+      data['width_schematic_png'] = args.width_schematic_png
+    elif 'width_schematic_png' in data and 0 < int(data['width_schematic_png']) <= 100:
+      print("using value from json file")
+    else:
+      #print "Arg for width of schematic.png in PDF not valid or not given. Using 50%."
+      data['width_schematic_png'] = kfconfig.default_schematic_image_width
+
+    # accept user input for percent width of all other .png in pdf
+    if args.width_other_png and int(args.width_other_png) in range (1,100):
+      data['width_other_png'] = args.width_other_png
+    elif 'width_other_png' in data and 0 < int(data['width_other_png']) <= 100:
+      print("using value from json file")
+    else:
+      #print "Arg for width of other .png in PDF not valid or not given. Using 50%."
+      data['width_other_png'] = kfconfig.default_other_image_width
+
+  # run only the stages whose inputs changed since the last build
+  global profiler
+  if args.profile:
+    profiler = Profiler()
+
+  try:
+    run_build(create_build_stages(data, args), args.force)
+  finally:
+    if profiler is not None:
+      trace_file = os.path.join(kfconfig.cache_dir,'profile.json')
+      profiler.write_trace(trace_file)
+      print('\nProfile, also saved as a Chrome trace in '+trace_file+':\n')
+      print(profiler.summary())
+      profiler = None
+
+###########################################################
+#
+#                 find_batch_projects
+#
+# inputs:
+# - a directory, or a glob pattern matching project
+#   directories or proj.json files
+#
+# what it does:
+# - walks a directory for every proj.json below it
+# - expands a glob pattern
+#
+# returns:
+# - sorted list of absolute project folder paths
+#
+###########################################################
+
+def find_batch_projects(pattern):
+
+  projects = set()
+
+  if os.path.isdir(pattern):
+    for root, dirs, files in os.walk(pattern):
+      dirs[:] = [d for d in dirs if d != kfconfig.cache_dir]
+      if 'proj.json' in files:
+        projects.add(os.path.abspath(root))
+  else:
+    for path in glob.glob(pattern):
+      if os.path.basename(path) == 'proj.json':
+        path = os.path.dirname(path)
+      if os.path.isfile(os.path.join(path,'proj.json')):
+        projects.add(os.path.abspath(path))
+
+  return sorted(projects)
+
+###########################################################
+#
+#                 build_batch_project
+#
+# inputs:
+# - (project folder, parsed args) tuple
+#
+# what it does:
+# - runs build_project in a pool worker, with its
+#   output going to .kifisher/build.log in the project
+# - catches exit() and any error so that one broken
+#   board doesn't stop the rest of the batch
+#
+# returns:
+# - (project folder, passed flag, seconds, message)
+#
+###########################################################
+
+def build_batch_project(job):
+
+  project_dir, args = job
+  start_dir = os.getcwd()
+  start = datetime.datetime.now()
+
+  log_dir = os.path.join(project_dir, kfconfig.cache_dir)
+  if not os.path.exists(log_dir):
+    os.makedirs(log_dir)
+  log_path = os.path.join(log_dir,'build.log')
+
+  # send both our prints and any child process output to the log
+  sys.stdout.flush()
+  sys.stderr.flush()
+  saved_fds = (os.dup(1), os.dup(2))
+  log = open(log_path,'w')
+  os.dup2(log.fileno(), 1)
+  os.dup2(log.fileno(), 2)
+
+  passed = False
+  message = log_path
+  try:
+    build_project(project_dir, args)
+    passed = True
+  except SystemExit:
+    message = 'exited early, see '+log_path
+  except Exception as e:
+    traceback.print_exc()
+    message = repr(e)+', see '+log_path
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(saved_fds[0], 1)
+    os.dup2(saved_fds[1], 2)
+    os.close(saved_fds[0])
+    os.close(saved_fds[1])
+    log.close()
+    os.chdir(start_dir)
+
+  seconds = (datetime.datetime.now() - start).total_seconds()
+  return (project_dir, passed, seconds, message)
+
+###########################################################
+#
+#                index_batch_libraries
+#
+# inputs:
+# - list of project folders
+# - parsed command line args
+#
+# what it does:
+# - indexes each distinct lib_dir once, here in the
+#   parent, before the workers start, so boards that
+#   share libraries don't all rewrite one index
+# - a lib_dir that can't be indexed is left to its
+#   projects' workers, so those boards fail with the
+#   error in their own build.log
+#
+# returns:
+# - dict of project folder -> args for its worker
+#
+###########################################################
+
+def index_batch_libraries(projects, args):
+
+  worker_args = copy.copy(args)
+  worker_args.index_lib = False
+
+  indexed = {}
+  project_args = {}
+
+  for project_dir in projects:
+    with open(os.path.join(project_dir,'proj.json')) as jfile:
+      data = json.load(jfile)
+
+    # lib_dir may be relative to the project folder
+    if data.get('lib_dir'):
+      data['lib_dir'] = os.path.join(project_dir, os.path.expanduser(data['lib_dir']))
+    db_path = get_lib_index_path(data)
+
+    if db_path not in indexed:
+      try:
+        index_part_library(data)
+        indexed[db_path] = True
+      except SystemExit:
+        indexed[db_path] = False
+
+    project_args[project_dir] = worker_args if indexed[db_path] else args
+
+  return project_args
+
+###########################################################
+#
+#                      run_batch
+#
+# inputs:
+# - directory or glob pattern of projects
+# - parsed command line args, args.jobs is the number of
+#   worker processes (default: one per core)
+#
+# what it does:
+# - indexes the part libraries first, if asked to
+# - builds every project found in a process pool; each
+#   worker has its own working directory
+# - prints a pass/fail summary
+#
+# returns:
+# - number of projects that failed
+#
+###########################################################
+
+def run_batch(pattern, args):
+
+  projects = find_batch_projects(pattern)
+  if not projects:
+    print("No proj.json files found in "+pattern+".")
+    return 0
+
+  jobs = args.jobs or multiprocessing.cpu_count()
+  jobs = max(1, min(jobs, len(projects)))
+  print("Building "+str(len(projects))+" projects with "+str(jobs)+" workers.\n")
+
+  project_args = dict([(p, args) for p in projects])
+  if args.index_lib:
+    project_args = index_batch_libraries(projects, args)
+
+  pool = multiprocessing.Pool(jobs)
+  try:
+    results = []
+    for result in pool.imap_unordered(build_batch_project, [(p, project_args[p]) for p in projects]):
+      print('  %-4s %7.1fs  %s' % ('ok' if result[1] else 'FAIL', result[2], result[0]))
+      results.append(result)
+  finally:
+    pool.close()
+    pool.join()
+
+  failed = [r for r in results if not r[1]]
+
+  print("\nBatch summary: "+str(len(results)-len(failed))+" passed, "+str(len(failed))+" failed.")
+  for r in sorted(failed):
+    print('  '+r[0]+': '+r[3])
+
+  return len(failed)
 
 ###########################################################
 #
@@ -1711,7 +3680,7 @@ def create_release_zipfile(data):
 if __name__ == '__main__':
 
   parser = argparse.ArgumentParser('Kingfisher automates KiCad project management.\n')
-  parser.add_argument('name',action='store',help="Name of the project")
+  parser.add_argument('name',action='store',nargs='?',help="Name of the project")
   parser.add_argument('-n','--new',action='store_true',default=False,dest='new',help='create a new project')
   parser.add_argument('-m','--mfr',action='store_true',default=False,dest='mfr',help='create manufacturing output files')
   parser.add_argument('-b','--bom',action='store_true',default=False,dest='bom',help='create bill of materials output files')
@@ -1723,8 +3692,25 @@ if __name__ == '__main__':
   parser.add_argument('-ws',action='store',dest='width_schematic_png',help='integer value (1-100) of pdf schematic.png percent width.')
   parser.add_argument('-wo',action='store',dest='width_other_png',help='integer value (1-100) of pdf other png percent width.')
   parser.add_argument('-t',action='store',dest='template',help='only used with new project; which template?')
+  parser.add_argument('--no-cache',action='store_true',default=False,dest='no_cache',help='reparse the netlist instead of using the cached parse')
+  parser.add_argument('--index-lib',action='store_true',default=False,dest='index_lib',help='index the lib_dir symbol libraries to fill in missing BOM fields')
+  parser.add_argument('--force',action='store_true',default=False,dest='force',help='run every stage even if its outputs are up to date')
+  parser.add_argument('--profile',action='store_true',default=False,dest='profile',help='time every build step and tool, save a trace to .kifisher/profile.json')
+  parser.add_argument('--plot-jobs',action='store',type=int,default=1,dest='plot_jobs',help='number of processes to plot gerber layers with')
+  parser.add_argument('--batch',action='store',dest='batch',help='build every project with a proj.json in this dir or glob')
+  parser.add_argument('-j',action='store',type=int,dest='jobs',help='number of projects to build at once with --batch')
   args = parser.parse_args()
 
+  if not args.name and not args.batch:
+    parser.error('give a project name, or --batch with a dir or glob')
+  if args.new and args.batch:
+    parser.error('--batch can not be used to create new projects')
+  if args.version and args.batch:
+    parser.error('--batch can not be used to change versions; give each project its own -v')
+  if args.plot_jobs > 1 and args.batch:
+    # batch boards already build in pool processes, which can't start pools of their own
+    parser.error('--plot-jobs can not be used with --batch; use -j to build more boards at once')
+
   dirname, filename = os.path.split(os.path.abspath(__file__))
   # dirname will give the absolute path root for /templates/proj.json and /templates/default.tex
 
@@ -1747,118 +3733,16 @@ if __name__ == '__main__':
       version = '1.0'
     create_new_project(args.name,args.template,version)
 
-  else:
-
-    # read in the proj.json if it exists
-    # error gracefully if it does not
-    if os.path.isfile(args.name+'/proj.json'):
-      with open(args.name+'/proj.json') as jfile:
-        if args.version:
-          update_version(args.name,args.version)
-        data = json.load(jfile)
-        now = datetime.datetime.now()
-        data['date_update'] = now.strftime('%-d %b %Y')
-      with open(args.name+'/proj.json','w') as jsonfile:
-        json.dump(data, jsonfile, indent=4, sort_keys=True, separators=(',', ':'))
-
-    else:
-      print("This project is missing a proj.json file. Leaving program.")
-      exit()
-
-    print('\nThis is the',data['title'],'project:\n')
-    print(data['description']+'\n')
-
-    # all plotting is done from the same dir as the kicad files
-    cwd = os.getcwd()
-    os.chdir(data['projname'])
-
-    if args.mfr or args.assy:
-
-      # remove all files in the assembly output dir
-      cwd = os.getcwd()
-      if not os.path.exists(data['bom_dir']):
-        os.makedirs(data['bom_dir'])
-
-      if args.assy:
-        os.chdir(data['bom_dir'])
-        filelist = glob.glob('*')
-        for f in filelist:
-          os.remove(f)
-        os.chdir('..')
-
-      print("Creating the manufacturing file outputs.")
-      plot_gerbers_and_drills(data['projname'],data['gerbers_dir'])
-      board_dims = get_board_size(data['projname'],data['gerbers_dir'])
-      print(get_board_size_string(board_dims))
+  elif args.batch:
+    if run_batch(args.batch, args):
+      sys.exit(1)
 
-      create_assembly_diagrams(data['projname'],data['gerbers_dir'],board_dims[4], board_dims[5])
-      create_image_previews(data['projname'],data['gerbers_dir'],board_dims[4], board_dims[5])
-      create_mfr_zip_files(data)
-
-    if args.bom or args.assy:
-      print("Creating the bill of materials, which will update the README.")
-      components_raw = create_bill_of_materials(data)
-
-    if args.assy:
-      print("Preparing files for assembly quotes. Currently supports:\n")
-      print("  -- MacroFab\n  -- Seeed/Fusion\n  -- Tempo Automation\n  -- Small Batch Assembly\n")
-
-      # assy should fail if top or bottom .pos doesn't exist
-      if not os.path.exists(data['projname']+'-top.pos'):
-        print("Missing top .pos file. Unable to create assembly information.")
-        exit()
-      if not os.path.exists(data['projname']+'-bottom.pos'):
-        print("Missing bottom .pos file. Unable to create assembly information.")
-        exit()
-
-      # the components_raw list contains each refdes (part) on a separate row
-      # it needs to be sanitized for non-populated parts
-      # then merged with .pos file values
-      create_assembly_files(data, components_raw)
-
-    update_readme(data)
-
-    if args.pdf:
-      print("Creating or updating the PDF.")
-
-      # accept user input for percent width of assembly.png in pdf
-      if args.width_assembly_png and 1 <= int(args.width_assembly_png) <= 100:
-        data['width_assembly_png'] = args.width_assembly_png
-      elif 'width_assembly_png' in data and 0 < int(data['width_assembly_png']) <= 100:
-        print("using value from json file")
-      else:
-        #print "Arg for width of assembly.png in PDF not valid or not given. Using 50%."
-        data['width_assembly_png'] = kfconfig.default_assembly_image_width
-
-      # accept user input for percent width of preview.png in pdf
-      if args.width_preview_png and int(args.width_preview_png) in range (1,100):
-        data['width_preview_png'] = args.width_preview_png
-      elif 'width_preview_png' in data and 0 < int(data['width_preview_png']) <= 100:
-        print("using value from json file")
-      else:
-        #print "Arg for width of preview.png in PDF not valid or not given. Using 50%."
-        data['width_preview_png'] = kfconfig.default_preview_image_width
-
-      # accept user input for percent width of schematic.png in pdf
-      if args.width_schematic_png and int(args.width_schematic_png) in range (1,100):
-        data['width_schematic_png'] = args.width_schematic_png
-      elif 'width_schematic_png' in data and 0 < int(data['width_schematic_png']) <= 100:
-        print("using value from json file")
-      else:
-        #print "Arg for width of schematic.png in PDF not valid or not given. Using 50%."
-        data['width_schematic_png'] = kfconfig.default_schematic_image_width
-
-      # accept user input for percent width of all other .png in pdf
-      if args.width_other_png and int(args.width_other_png) in range (1,100):
-        data['width_other_png'] = args.width_other_png
-      elif 'width_other_png' in data and 0 < int(data['width_other_png']) <= 100:
-        print("using value from json file")
-      else:
-        #print "Arg for width of other .png in PDF not valid or not given. Using 50%."
-        data['width_other_png'] = kfconfig.default_other_image_width
-
-      create_pdf(data)
-      create_release_zipfile(data)
+  else:
+    try:
+      build_project(args.name, args)
+    except ToolError as e:
+      print('\n'+str(e))
+      sys.exit(1)
 
   print("\nProgram completed running successfully.")
   exit()
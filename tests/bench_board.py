@@ -0,0 +1,19 @@
+# benchmarks for sizing the board and zipping the outputs
+#
+# run with: python -m pytest tests/bench_board.py --benchmark-json=results.json
+
+import os, zipfile
+import kfbench
+
+def test_board_size(benchmark, project):
+  benchmark(kfbench.bench_board_size(project))
+
+def test_zip_cold(benchmark, project):
+  # every file deflated from scratch
+  benchmark(kfbench.bench_zip_cold(project))
+  assert zipfile.ZipFile(os.path.join(project['dir'], 'cold.zip')).testzip() is None
+
+def test_zip_warm(benchmark, project):
+  # every file already in the artifact store
+  benchmark(kfbench.bench_zip_warm(project))
+  assert zipfile.ZipFile(os.path.join(project['dir'], 'warm.zip')).testzip() is None
@@ -0,0 +1,18 @@
+# benchmarks for grouping the BOM and joining the .pos files
+#
+# run with: python -m pytest tests/bench_bom.py --benchmark-json=results.json
+
+import os
+import kfbench
+
+def test_bom_grouping(benchmark, project):
+  # the setup fills the netlist cache, so this times the
+  # grouping and the BOM writers
+  benchmark(kfbench.bench_bom(project))
+  assert os.path.isfile(os.path.join('bom', 'bench-v1.0-bom-master.csv'))
+
+def test_pos_join(benchmark, project):
+  # the synthetic board leaves a few parts off the .pos
+  # files and places a few that aren't in the netlist
+  missing, extra = benchmark(kfbench.bench_pos_join(project))
+  assert missing and extra
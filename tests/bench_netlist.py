@@ -0,0 +1,13 @@
+# benchmarks for reading the netlist and writing ref lists
+#
+# run with: python -m pytest tests/bench_netlist.py --benchmark-json=results.json
+
+import kfbench
+
+def test_netlist_parse(benchmark, project):
+  components = benchmark(kfbench.bench_netlist_parse(project))
+  assert len(components) == len(kfbench.parse_netlist(project))
+
+def test_compress_refs(benchmark, project):
+  refs = benchmark(kfbench.bench_compress_refs(project))
+  assert refs.startswith('C1-C6 ')
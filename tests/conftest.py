@@ -0,0 +1,53 @@
+# shared pytest setup for the KiFisher tests and benchmarks
+#
+# kifisher.py and kfgerber.py are scripts in the repo root,
+# not an installed package, so put the root on the path
+
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURE_GERBERS = os.path.join(ROOT, 'testboard', 'gerbers')
+
+###########################################################
+#
+#                    benchmark setup
+#
+# the tests/bench_*.py files time kifisher on a synthetic
+# board made by kfbench.make_synthetic_project; its size
+# is set with --bench-components, ex: 100000
+#
+# they need pytest-benchmark, and are left out if it
+# isn't installed
+#
+###########################################################
+
+import pytest
+
+try:
+  import pytest_benchmark
+except ImportError:
+  collect_ignore_glob = ['bench_*.py']
+
+def pytest_addoption(parser):
+  parser.addoption('--bench-components', type=int, default=10000,
+                   help='components on the synthetic benchmark board')
+  parser.addoption('--bench-vendors', type=int, default=20,
+                   help='vendors to spread the benchmark parts across')
+
+@pytest.fixture(scope='session')
+def bench_project(request, tmp_path_factory):
+  import kfbench
+  root = str(tmp_path_factory.mktemp('kfbench'))
+  return kfbench.make_synthetic_project(root,
+                                        request.config.getoption('--bench-components'),
+                                        request.config.getoption('--bench-vendors'))
+
+@pytest.fixture
+def project(bench_project):
+  # kifisher works relative to the project folder
+  cwd = os.getcwd()
+  os.chdir(bench_project['dir'])
+  yield bench_project
+  os.chdir(cwd)
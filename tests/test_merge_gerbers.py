@@ -0,0 +1,103 @@
+# tests for kfgerber.merge_gerbers
+#
+# a merged file must draw exactly what its inputs drew: the
+# ops read back from it are compared with the inputs' ops,
+# number by number
+
+import os
+import kfgerber
+from conftest import FIXTURE_GERBERS
+
+def flatten(value):
+  # every number and tag in a list of ops, in order
+  if isinstance(value, (list, tuple)):
+    out = []
+    for v in value:
+      out.extend(flatten(v))
+    return out
+  return [value]
+
+def assert_same_ops(merged_path, input_paths, tolerance):
+  expected = []
+  for path in input_paths:
+    expected.extend(kfgerber.read_gerber(path).ops)
+  merged = kfgerber.read_gerber(merged_path).ops
+
+  assert len(merged) == len(expected)
+  a, b = flatten(merged), flatten(expected)
+  assert len(a) == len(b)
+  for x, y in zip(a, b):
+    if isinstance(x, float):
+      assert abs(x - y) <= tolerance
+    else:
+      assert x == y
+
+def write(path, text):
+  with open(str(path), 'w') as f:
+    f.write(text)
+  return str(path)
+
+def test_merge_fixture_layers(tmp_path):
+  # inch 3.4 assembly drawing first, then mm 4.6 KiCad
+  # layers; the output takes the finer mm 4.6 format, which
+  # holds inch 3.4 coordinates exactly
+  paths = [os.path.join(FIXTURE_GERBERS, 'testboard-'+name)
+           for name in ('F.Assembly.gba', 'Edge.Cuts.gko', 'F.Cu.gtl')]
+  out = str(tmp_path / 'merged.gbr')
+  kfgerber.merge_gerbers(paths, out)
+
+  text = open(out).read()
+  assert text.startswith('%FSLAX56Y56*%\n%MOMM*%\n')
+  assert text.count('M02*') == 1
+  assert_same_ops(out, paths, 1e-9)
+
+def test_merge_renumbers_dcodes(tmp_path):
+  # both files use D10 for different apertures
+  first = write(tmp_path / 'a.gbr', '%FSLAX46Y46*%\n%MOMM*%\n%ADD10C,0.5*%\n'
+                'D10*\nX1000000Y1000000D03*\nM02*\n')
+  second = write(tmp_path / 'b.gbr', '%FSLAX46Y46*%\n%MOMM*%\n%ADD10R,1.0X2.0*%\n%ADD11C,0.25*%\n'
+                 'D10*\nX2000000Y1000000D03*\nD11*\nX0Y0D02*\nX3000000Y0D01*\nM02*\n')
+  out = str(tmp_path / 'merged.gbr')
+  kfgerber.merge_gerbers([first, second], out)
+
+  text = open(out).read()
+  assert '%ADD10C,0.5*%' in text
+  assert '%ADD11R,1.0X2.0*%' in text
+  assert '%ADD12C,0.25*%' in text
+  assert_same_ops(out, [first, second], 1e-9)
+
+def test_merge_renames_clashing_macros(tmp_path):
+  # BOX means a different shape in each file; SAME is
+  # identical in both and is only written once
+  first = write(tmp_path / 'a.gbr', '%FSLAX46Y46*%\n%MOMM*%\n'
+                '%AMBOX*21,1,$1,$2,0,0,0*%\n%AMSAME*1,1,$1,0,0*%\n'
+                '%ADD10BOX,2X1*%\n%ADD11SAME,0.5*%\n'
+                'D10*\nX1000000Y1000000D03*\nD11*\nX0Y0D03*\nM02*\n')
+  second = write(tmp_path / 'b.gbr', '%FSLAX46Y46*%\n%MOMM*%\n'
+                 '%AMBOX*21,1,$1,$2,0,0,45*%\n%AMSAME*1,1,$1,0,0*%\n'
+                 '%ADD10BOX,2X1*%\n%ADD11SAME,0.5*%\n'
+                 'D10*\nX5000000Y1000000D03*\nD11*\nX4000000Y0D03*\nM02*\n')
+  out = str(tmp_path / 'merged.gbr')
+  kfgerber.merge_gerbers([first, second], out)
+
+  text = open(out).read()
+  assert '%AMBOX*21,1,$1,$2,0,0,0*%' in text
+  assert '%AMBOX_1*21,1,$1,$2,0,0,45*%' in text
+  assert text.count('%AMSAME*') == 1
+  assert '%ADD12BOX_1,2X1*%' in text
+  assert '%ADD13SAME,0.5*%' in text
+  assert_same_ops(out, [first, second], 1e-9)
+
+def test_merge_rounds_to_finest_input(tmp_path):
+  # inch 2.6 (0.0254 um) is finer than mm 4.4 (0.1 um), so
+  # the output is inch and the mm coordinates are rounded
+  # to within half an inch 2.6 step
+  first = write(tmp_path / 'a.gbr', '%FSLAX44Y44*%\n%MOMM*%\n%ADD10C,0.5*%\n'
+                'D10*\nX12345Y67891D03*\nM02*\n')
+  second = write(tmp_path / 'b.gbr', '%FSLAX26Y26*%\n%MOIN*%\n%ADD10C,0.02*%\n'
+                 'D10*\nX123457Y765432D03*\nM02*\n')
+  out = str(tmp_path / 'merged.gbr')
+  kfgerber.merge_gerbers([first, second], out)
+
+  assert open(out).read().startswith('%FSLAX46Y46*%\n%MOIN*%\n')
+  assert_same_ops(out, [first, second], 0.5 * 25.4e-6 + 1e-12)